@@ -3,7 +3,6 @@ from dotenv import load_dotenv
 import os
 import sqlite3
 from pathlib import Path
-import json
 
 load_dotenv()
 
@@ -15,6 +14,13 @@ DB_PATH = DATA_DIR / "cfc.db"
 app = Flask(__name__, static_folder=str(STATIC_DIR))
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "dev-secret-change-me")
 
+from app.json_provider import OrjsonProvider
+app.json = OrjsonProvider(app)
+
+# URL converters used by the blueprint routes
+from app.api.converters import ActionIdConverter
+app.url_map.converters["action_id"] = ActionIdConverter
+
 # Register Blueprints
 from app.api import auth_bp, metrics_bp, custom_role_bp, analysis_bp, priority_insights_bp, action_bp, kpi_bp
 app.register_blueprint(auth_bp)
@@ -26,17 +32,10 @@ app.register_blueprint(action_bp)
 app.register_blueprint(kpi_bp)
 
 
-def get_db_connection():
-	DATA_DIR.mkdir(parents=True, exist_ok=True)
-	conn = sqlite3.connect(str(DB_PATH))
-	conn.row_factory = sqlite3.Row
-	return conn
-
-
 # Page-serving routes
 @app.route("/")
 def index():
-	return send_from_directory(str(STATIC_DIR), "index.html")
+	return send_from_directory(str(STATIC_DIR), "index.html", max_age=300)
 
 
 @app.route("/dashboard")
@@ -47,7 +46,7 @@ def dashboard_page():
 
 @app.route("/register")
 def register_page():
-    return send_from_directory(str(STATIC_DIR), "register.html")
+    return send_from_directory(str(STATIC_DIR), "register.html", max_age=300)
 
 @app.route("/dashboard/<role_name>")
 def custom_dashboard_page(role_name):
@@ -5,6 +5,7 @@ This module creates and configures the Flask application with all blueprints.
 """
 
 from flask import Flask
+from flask_compress import Compress
 from dotenv import load_dotenv
 import os
 from pathlib import Path
@@ -12,10 +13,7 @@ from pathlib import Path
 # Load environment variables
 load_dotenv()
 
-# Import blueprints
-from app.api import auth_bp, metrics_bp, custom_role_bp, analysis_bp, kpi_bp
-from app.api.priority_insights_routes import priority_insights_bp
-from app.api.action_routes import action_bp
+from app.json_provider import OrjsonProvider
 
 def create_app():
     """
@@ -30,15 +28,26 @@ def create_app():
     
     app = Flask(__name__, static_folder=str(STATIC_DIR))
     app.secret_key = os.getenv("FLASK_SECRET_KEY", "dev-secret-change-me")
+    app.json = OrjsonProvider(app)
     
-    # Register blueprints
-    app.register_blueprint(auth_bp)
-    app.register_blueprint(metrics_bp)
-    app.register_blueprint(custom_role_bp)
-    app.register_blueprint(analysis_bp)
-    app.register_blueprint(priority_insights_bp)
-    app.register_blueprint(action_bp)
-    app.register_blueprint(kpi_bp)
+    # Compress JSON bodies (action payloads carry several KB of generated
+    # markdown); NDJSON streams are left out so their lines are not held back
+    app.config.update(
+        COMPRESS_MIMETYPES=["application/json"],
+        COMPRESS_ALGORITHM=["br", "gzip"],
+        COMPRESS_BR_LEVEL=4,
+        COMPRESS_MIN_SIZE=1024,
+    )
+    Compress(app)
+    
+    # URL converters must exist before the blueprints add their rules
+    from app.api.converters import ActionIdConverter
+    app.url_map.converters["action_id"] = ActionIdConverter
+    
+    # Register blueprints (app.api imports each route module on first access)
+    from app import api
+    for name in api.__all__:
+        app.register_blueprint(getattr(api, name))
     
     return app
 
@@ -2,14 +2,34 @@
 API module for the data-driven application.
 
 This module contains API route handlers organized by functionality.
+Blueprints are imported on first access, so importing one route module
+does not pull in every other one (and their service dependencies).
 """
 
-from .auth_routes import auth_bp
-from .metrics_routes import metrics_bp
-from .custom_role_routes import custom_role_bp
-from .analysis_routes import analysis_bp
-from .priority_insights_routes import priority_insights_bp
-from .action_routes import action_bp
-from .kpi_routes import kpi_bp
+import importlib
+
+# Blueprint name -> module that defines it
+_BLUEPRINT_MODULES = {
+    'auth_bp': '.auth_routes',
+    'metrics_bp': '.metrics_routes',
+    'custom_role_bp': '.custom_role_routes',
+    'analysis_bp': '.analysis_routes',
+    'priority_insights_bp': '.priority_insights_routes',
+    'action_bp': '.action_routes',
+    'kpi_bp': '.kpi_routes',
+}
 
 __all__ = ['auth_bp', 'metrics_bp', 'custom_role_bp', 'analysis_bp', 'priority_insights_bp', 'action_bp', 'kpi_bp']
+
+
+def __getattr__(name):
+    module_name = _BLUEPRINT_MODULES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    blueprint = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = blueprint
+    return blueprint
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
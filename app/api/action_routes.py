@@ -5,40 +5,321 @@ This module provides REST API endpoints for managing detailed action entities,
 including exploration, notes, sharing, and workspace management.
 """
 
-from flask import Blueprint, request, jsonify, session
-from app.database.connection import get_role_db_connection
-from services.gemini_service import _generate_json_from_model
+from flask import Blueprint, Response, g, request, jsonify, session
+from app.database.connection import get_role_db_connection, role_db_file
+from app.database.rows import rows_to_dicts
+from app.database.schema import quote_identifier, table_columns
+from services.gemini_service import _generate_json_from_model, _stream_json_from_model
 from services.action_plan_service import (
     update_task_status_in_db, 
+    update_task_statuses_in_db,
     generate_sql_query_for_task,
     generate_communication_for_task
 )
 from services.gemini_service import _generate_content_from_model
-import json
+from services.llm_cache import LLMCache
+import hashlib
+import orjson
 import logging
 import uuid
+from contextlib import closing
 from datetime import datetime
-import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
 
 logger = logging.getLogger(__name__)
 
 # Create blueprint
 action_bp = Blueprint('actions', __name__)
 
+# An action's notes as one JSON array column, oldest first, so the action and
+# its notes come back from a single query (binds the action_id)
+_ACTION_NOTES_JSON = """
+    (SELECT json_group_array(json_object(
+        'id', n.id, 'action_id', n.action_id, 'note_text', n.note_text, 'created_ts', n.created_ts))
+     FROM (SELECT * FROM action_notes WHERE action_id = ? ORDER BY created_ts ASC) AS n) AS notes_json
+"""
+
+# An action's AI assistant conversations as the JSON object the frontend
+# expects, {"<target_key>": [entry, ...]} with entries oldest first (binds the
+# action_id)
+_ACTION_CONVERSATIONS_JSON = """
+    (SELECT json_group_object(target_key, json(entries))
+     FROM (SELECT target_key, json_group_array(json_object(
+               'id', id, 'question', question, 'response', response, 'timestamp', created_ts)) AS entries
+           FROM (SELECT * FROM ai_conversations WHERE action_id = ? ORDER BY target_key, created_ts)
+           GROUP BY target_key)) AS conversations_json
+"""
+
+# The fields the AI assistant endpoints use, from whichever table holds the
+# action (saved_actions first), with the title of its priority for the
+# prompt context, in one statement (binds the action_id twice)
+_ACTION_FOR_ASSISTANT = """
+    WITH a AS (
+        SELECT 'saved_actions' AS source_table, priority_id, action_title,
+               action_description, gemini_context, next_steps
+        FROM saved_actions WHERE action_id = ?
+        UNION ALL
+        SELECT 'proposed_actions', priority_id, action_title,
+               action_description, gemini_context, next_steps
+        FROM proposed_actions WHERE action_id = ?
+        LIMIT 1
+    )
+    SELECT a.*, p.priority_title
+    FROM a LEFT JOIN saved_analyses p ON a.priority_id = p.priority_id
+"""
+
+
+# Fixed instructions of the explore prompt. They come first and never change,
+# so every explore request sends the model the same prefix (which Gemini can
+# serve from its implicit context cache); the role, priority and action are
+# appended after them.
+_EXPLORE_PROMPT_PREFIX = """
+Act as a senior business strategist for the role given below. Your task is to provide a deep analysis of the proposed action described at the end of this prompt, which is related to a strategic priority.
+
+Your analysis must be comprehensive and structured into a JSON object with two top-level keys: "context" and "next_steps".
+
+**1. "context" (Object):**
+This object should contain the following keys, each with a detailed string value that uses markdown for formatting:
+- "strategic_alignment": How does this action directly support the parent priority and broader business goals?
+- "market_rationale": What current market trends, competitive pressures, or customer behaviors make this action timely and relevant?
+- "potential_impact": Quantify the expected positive outcomes (e.g., revenue growth, cost savings, market share).
+- "risk_assessment": What are the potential risks or obstacles (e.g., technical challenges, resource constraints, market adoption)?
+
+**2. "next_steps" (Array of Objects):**
+Provide a list of clear, actionable next steps to operationalize this action. Each step must be an object with the following keys:
+- "id": A unique UUID string for the step.
+- "title": A concise title for the step.
+- "description": A detailed description of the step.
+- "status": The initial status, which must be set to "pending".
+- "sub_tasks": An empty array `[]` where sub-tasks can be added later.
+- "query_generation_enabled": A boolean value (`true` or `false`). Set this to `true` ONLY for steps that involve direct data analysis, validation, or KPI measurement. For all other steps (like stakeholder communication or roadmapping), set it to `false`.
+
+Your response must include at least four distinct steps covering:
+1.  **Data Validation & Analysis:** Initial data work to confirm the hypothesis.
+2.  **KPIs & Measurement:** Specific metrics to measure success.
+3.  **Stakeholder Involvement:** Who needs to be involved.
+4.  **Implementation Roadmap:** High-level phases for rollout.
+
+Return a single, minified JSON object with ONLY the "context" and "next_steps" keys.
+"""
+
+
+# Grouped saved-actions list per role, reused for up to this many seconds.
+# Entries carry the database file stamps and are dropped when those change;
+# saving or deleting an action drops the role's entry straight away.
+SAVED_ACTIONS_CACHE_TTL = 30
+_saved_actions_cache = TTLCache(maxsize=1024, ttl=SAVED_ACTIONS_CACHE_TTL)
+_saved_actions_lock = threading.Lock()
+
+# Explore responses (context and next steps) keyed by a hash of the prompt,
+# which covers the role, the priority and the action's title and description.
+# Stored in the shared database, so they outlive restarts.
+ACTION_CONTEXT_CACHE_TTL = 24 * 3600
+_action_context_cache = LLMCache("action_context", ttl=ACTION_CONTEXT_CACHE_TTL)
+
+# Background explores (Prefer: respond-async), keyed by (role, action_id) and
+# reported by GET /api/actions/<action_id> until collected
+_explore_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="action-explore")
+_explore_jobs = {}
+_explore_jobs_lock = threading.Lock()
+# Finished jobs are forgotten after this many seconds
+EXPLORE_JOB_TTL = 3600
+
 
 def _get_user_role():
     return session.get("role") or request.headers.get("X-Role") or "Customer Analyst"
 
 
+@action_bp.before_request
+def _resolve_user_role():
+    """Resolve the caller's role once per request, for handlers to read from g.user_role."""
+    g.user_role = _get_user_role()
+
+
+def _role_db_stamp(user_role: str) -> tuple:
+    """
+    Get the mtime and size of a role database and its WAL file.
+    
+    Any committed write changes at least one of them, including writes made
+    by other blueprints or services.
+    
+    Args:
+        user_role (str): Session role name
+        
+    Returns:
+        tuple: (db mtime, db size, WAL mtime, WAL size), zeros for missing files
+    """
+    db_path = role_db_file(user_role)
+    stamp = []
+    for path in (db_path, db_path.with_name(db_path.name + "-wal")):
+        try:
+            st = path.stat()
+            stamp.extend((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            stamp.extend((0, 0))
+    return tuple(stamp)
+
+
+def _role_db_etag(user_role: str, stamp: tuple, *parts) -> str:
+    """
+    Build an ETag for a read from a role database.
+    
+    The tag changes with every committed write to the database, so a
+    matching If-None-Match can be answered with a 304 before running any
+    query.
+    
+    Args:
+        user_role (str): Session role name
+        stamp (tuple): The database's _role_db_stamp, taken before reading
+        *parts: Anything else the response depends on (endpoint, IDs, job state)
+        
+    Returns:
+        str: Opaque tag value
+    """
+    key = repr((user_role, stamp, parts)).encode()
+    return hashlib.blake2b(key, digest_size=12).hexdigest()
+
+
+def _not_modified(etag: str):
+    """Return a 304 response for a read from a role database if the client's copy is current, else None."""
+    if request.if_none_match.contains_weak(etag):
+        return _with_etag(Response(status=304), etag)
+    return None
+
+
+def _with_etag(response, etag: str):
+    """Tag a role-database read so clients can revalidate it with If-None-Match."""
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def _invalidate_saved_actions(user_role: str):
+    with _saved_actions_lock:
+        _saved_actions_cache.pop(user_role, None)
+
+
+def _save_explored_action(user_role, target_table, action_id, gemini_response):
+    """
+    Store the generated context and next steps on an action.
+    
+    Args:
+        user_role (str): Session role name
+        target_table (str): "saved_actions" or "proposed_actions"
+        action_id (str): ID of the explored action
+        gemini_response (dict): Model response with "context" and "next_steps"
+        
+    Returns:
+        dict: The updated action row, or None if it no longer exists
+    """
+    context_content = gemini_response.get('context')
+    next_steps = gemini_response.get('next_steps')
+    
+    with closing(get_role_db_connection(user_role)) as conn:
+        cursor = conn.cursor()
+
+        # Update the proposed action in the role's database and get it back
+        cursor.execute(f"""
+            UPDATE {target_table}
+            SET gemini_context = ?, next_steps = ?, updated_ts = CURRENT_TIMESTAMP
+            WHERE action_id = ?
+            RETURNING *, {_ACTION_CONVERSATIONS_JSON}
+        """, (
+            orjson.dumps(context_content).decode() if context_content else None,
+            orjson.dumps(next_steps).decode() if next_steps else None,
+            action_id,
+            action_id
+        ))
+        action_row = cursor.fetchone()
+        conn.commit()
+    
+    if not action_row:
+        return None
+    action = dict(action_row)
+    action['ai_conversations'] = action.pop('conversations_json')
+    return action
+
+
+def _remember_action_context(cache_key, gemini_response):
+    """Cache an explore response, unless the model returned no context."""
+    if gemini_response.get('context'):
+        _action_context_cache.set(cache_key, gemini_response)
+
+
+def _with_fresh_step_ids(gemini_response):
+    """
+    Give the next steps of a cached explore response new IDs.
+    
+    A cached response can be reused for another action with the same title
+    and description, so each use gets its own step and sub-task IDs.
+    
+    Args:
+        gemini_response (dict): Explore response from the cache
+        
+    Returns:
+        dict: The response with every step and sub-task ID replaced
+    """
+    next_steps = gemini_response.get('next_steps')
+    if not isinstance(next_steps, list):
+        return gemini_response
+    steps = []
+    for step in next_steps:
+        if isinstance(step, dict):
+            step = {**step, 'id': str(uuid.uuid4())}
+            if isinstance(step.get('sub_tasks'), list):
+                step['sub_tasks'] = [
+                    {**task, 'id': str(uuid.uuid4())} if isinstance(task, dict) else task
+                    for task in step['sub_tasks']
+                ]
+        steps.append(step)
+    return {**gemini_response, 'next_steps': steps}
+
+
+def _run_exploration(user_role, target_table, action_id, prompt, cache_key):
+    """
+    Generate and store an action's context in the background, recording the outcome.
+    
+    Args:
+        user_role (str): Session role name
+        target_table (str): "saved_actions" or "proposed_actions"
+        action_id (str): ID of the explored action
+        prompt (str): Explore prompt for the model
+        cache_key (str): Key of the prompt in _action_context_cache
+    """
+    try:
+        gemini_response = _generate_json_from_model(prompt, '{}')
+        _remember_action_context(cache_key, gemini_response)
+        action = _save_explored_action(user_role, target_table, action_id, gemini_response)
+        job = {"status": "ready"} if action else {"status": "error", "error": "Action not found after update"}
+    except Exception as e:
+        logger.error(f"Background explore failed for action {action_id}: {e}", exc_info=True)
+        job = {"status": "error", "error": "Failed to explore action"}
+    job["finished_at"] = time.time()
+    with _explore_jobs_lock:
+        _explore_jobs[(user_role, action_id)] = job
+
+
 @action_bp.route('/api/actions/explore', methods=['POST'])
 def api_explore_action():
     """
     Generate context and next steps for a proposed action and save it 
     to the role-specific database.
+    
+    Clients that send ``Accept: application/x-ndjson`` get the model output
+    streamed as ``{"chunk": ...}`` lines of raw JSON text while it is
+    generated, followed by a final ``{"success": ..., "action": ...}`` line
+    (or ``{"success": false, "error": ...}``).
+    
+    Clients that send ``Prefer: respond-async`` get ``202 Accepted`` straight
+    away while the context is generated in the background; poll
+    GET /api/actions/<action_id> until its ``exploration_status`` is
+    "ready" or "error".
     """
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    user_role = g.user_role
     
     try:
         data = request.get_json()
@@ -48,79 +329,88 @@ def api_explore_action():
         if not action_id or not action_data:
             return jsonify({"error": "Missing required fields"}), 400
         
-        prompt = f"""
-        Act as a senior business strategist for a '{user_role}'. Your task is to provide a deep analysis of a proposed action related to a strategic priority.
-
-        **Strategic Priority:** '{data.get('priority_title', 'Not specified')}'
-        
-        **Proposed Action:**
-        - **Title:** '{action_data.get('action_title', '')}'
-        - **Description:** '{action_data.get('action_description', '')}'
-
-        Your analysis must be comprehensive and structured into a JSON object with two top-level keys: "context" and "next_steps".
-
-        **1. "context" (Object):**
-        This object should contain the following keys, each with a detailed string value that uses markdown for formatting:
-        - "strategic_alignment": How does this action directly support the parent priority and broader business goals?
-        - "market_rationale": What current market trends, competitive pressures, or customer behaviors make this action timely and relevant?
-        - "potential_impact": Quantify the expected positive outcomes (e.g., revenue growth, cost savings, market share).
-        - "risk_assessment": What are the potential risks or obstacles (e.g., technical challenges, resource constraints, market adoption)?
-
-        **2. "next_steps" (Array of Objects):**
-        Provide a list of clear, actionable next steps to operationalize this action. Each step must be an object with the following keys:
-        - "id": A unique UUID string for the step.
-        - "title": A concise title for the step.
-        - "description": A detailed description of the step.
-        - "status": The initial status, which must be set to "pending".
-        - "sub_tasks": An empty array `[]` where sub-tasks can be added later.
-        - "query_generation_enabled": A boolean value (`true` or `false`). Set this to `true` ONLY for steps that involve direct data analysis, validation, or KPI measurement. For all other steps (like stakeholder communication or roadmapping), set it to `false`.
-        
-        Your response must include at least four distinct steps covering:
-        1.  **Data Validation & Analysis:** Initial data work to confirm the hypothesis.
-        2.  **KPIs & Measurement:** Specific metrics to measure success.
-        3.  **Stakeholder Involvement:** Who needs to be involved.
-        4.  **Implementation Roadmap:** High-level phases for rollout.
-
-        Return a single, minified JSON object with ONLY the "context" and "next_steps" keys.
-        """
-        gemini_response = _generate_json_from_model(prompt, '{}')
-        context_content = gemini_response.get('context')
-        next_steps = gemini_response.get('next_steps')
-        
-        conn = get_role_db_connection(user_role)
-        conn.row_factory = sqlite3.Row  # Set row_factory before creating the cursor
-        cursor = conn.cursor()
-        
-        # Check if the action is already saved
-        cursor.execute("SELECT 1 FROM saved_actions WHERE action_id = ?", (action_id,))
-        is_saved = cursor.fetchone()
+        # Find the action before the model call, so an unknown action fails
+        # fast instead of after a full Gemini round-trip
+        with closing(get_role_db_connection(user_role)) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT 'saved_actions' FROM saved_actions WHERE action_id = ?
+                UNION ALL
+                SELECT 'proposed_actions' FROM proposed_actions WHERE action_id = ?
+                LIMIT 1
+            """, (action_id, action_id))
+            found = cursor.fetchone()
+        
+        if not found:
+            return jsonify({"error": "Action not found"}), 404
+        target_table = found[0]
         
-        target_table = "saved_actions" if is_saved else "proposed_actions"
+        # Request-specific details go last, after the fixed instructions
+        prompt = _EXPLORE_PROMPT_PREFIX + f"""
+**Role:** '{user_role}'
+**Strategic Priority:** '{data.get('priority_title', 'Not specified')}'
 
-        # Update the proposed action in the role's database
-        cursor.execute(f"""
-            UPDATE {target_table}
-            SET gemini_context = ?, next_steps = ?, updated_ts = CURRENT_TIMESTAMP
-            WHERE action_id = ?
-        """, (
-            json.dumps(context_content) if context_content else None,
-            json.dumps(next_steps) if next_steps else None,
-            action_id
-        ))
-        conn.commit()
-
-        # Get the updated action
-        cursor.execute(f"SELECT * FROM {target_table} WHERE action_id = ?", (action_id,))
-        action_row = cursor.fetchone()
+**Proposed Action:**
+- **Title:** '{action_data.get('action_title', '')}'
+- **Description:** '{action_data.get('action_description', '')}'
+"""
+        # Exploring the same action again reuses the earlier response
+        cache_key = _action_context_cache.key(prompt)
+        gemini_response = _action_context_cache.get(cache_key)
+        if gemini_response is not None:
+            gemini_response = _with_fresh_step_ids(gemini_response)
+        
+        if gemini_response is None and 'respond-async' in request.headers.get('Prefer', ''):
+            job_key = (user_role, action_id)
+            now = time.time()
+            with _explore_jobs_lock:
+                if _explore_jobs.get(job_key, {}).get("status") == "pending":
+                    return jsonify({"success": True, "action_id": action_id, "status": "pending"}), 202
+                # Drop results nobody collected
+                for stale in [k for k, j in _explore_jobs.items() if now - j.get("finished_at", now) > EXPLORE_JOB_TTL]:
+                    del _explore_jobs[stale]
+                _explore_jobs[job_key] = {"status": "pending"}
+            _explore_executor.submit(_run_exploration, user_role, target_table, action_id, prompt, cache_key)
+            return jsonify({"success": True, "action_id": action_id, "status": "pending"}), 202
+        
+        if request.accept_mimetypes.best == "application/x-ndjson":
+            def stream():
+                response = gemini_response
+                try:
+                    if response is None:
+                        chunks = []
+                        try:
+                            for chunk in _stream_json_from_model(prompt):
+                                chunks.append(chunk)
+                                yield orjson.dumps({"chunk": chunk}) + b"\n"
+                            response = orjson.loads("".join(chunks))
+                        except Exception as e:
+                            # Same fallback as _generate_json_from_model
+                            logger.error(f"Error streaming action context from Gemini: {e}")
+                            response = {}
+                        _remember_action_context(cache_key, response)
+                    action = _save_explored_action(user_role, target_table, action_id, response)
+                    if action is None:
+                        yield orjson.dumps({"success": False, "error": "Action not found after update"}) + b"\n"
+                    else:
+                        yield orjson.dumps({"success": True, "action": action}) + b"\n"
+                except Exception as e:
+                    logger.error(f"Error exploring action: {e}")
+                    yield orjson.dumps({"success": False, "error": "Failed to explore action"}) + b"\n"
+            
+            return Response(stream(), mimetype="application/x-ndjson")
         
-        conn.close()
+        if gemini_response is None:
+            gemini_response = _generate_json_from_model(prompt, '{}')
+            _remember_action_context(cache_key, gemini_response)
         
-        if not action_row:
+        action = _save_explored_action(user_role, target_table, action_id, gemini_response)
+        if action is None:
             return jsonify({"error": "Action not found after update"}), 404
             
         return jsonify({
             "success": True,
-            "action": dict(action_row)
+            "action": action
         })
         
     except Exception as e:
@@ -128,44 +418,57 @@ def api_explore_action():
         return jsonify({"error": "Failed to explore action"}), 500
 
 
-@action_bp.route('/api/actions/<action_id>', methods=['GET'])
+@action_bp.route('/api/actions/<action_id:action_id>', methods=['GET'])
 def api_get_action(action_id):
-    """Get a specific action by ID from the appropriate table."""
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    """Get a specific action by ID from the appropriate table, with its notes and any background explore status."""
+    user_role = g.user_role
     
     try:
-        conn = get_role_db_connection(user_role)
-        cursor = conn.cursor()
-
-        # Check saved_actions first, then proposed_actions
-        cursor.execute("SELECT * FROM saved_actions WHERE action_id = ?", (action_id,))
-        row = cursor.fetchone()
-        if row:
-            source_table = "saved_actions"
-        else:
-            cursor.execute("SELECT * FROM proposed_actions WHERE action_id = ?", (action_id,))
+        with _explore_jobs_lock:
+            job = _explore_jobs.get((user_role, action_id))
+        # Polling clients send back the tag and skip the query and body
+        etag = _role_db_etag(user_role, _role_db_stamp(user_role), "action", action_id, job)
+        not_modified = _not_modified(etag)
+        if not_modified is not None:
+            return not_modified
+        
+        with closing(get_role_db_connection(user_role)) as conn:
+            cursor = conn.cursor()
+
+            # Check saved_actions first, then proposed_actions
+            cursor.execute(
+                f"SELECT *, {_ACTION_NOTES_JSON}, {_ACTION_CONVERSATIONS_JSON} FROM saved_actions WHERE action_id = ?",
+                (action_id, action_id, action_id)
+            )
             row = cursor.fetchone()
-            source_table = "proposed_actions"
-
-        if not row:
-            conn.close()
-            return jsonify({"error": "Action not found"}), 404
-
-        columns = [description[0] for description in cursor.description]
-        action = dict(zip(columns, row))
-        action['source_table'] = source_table
-        
-        if source_table == "saved_actions":
-            action['notes'] = []
-
-        conn.close()
-        
-        return jsonify({
+            if row:
+                source_table = "saved_actions"
+            else:
+                cursor.execute(
+                    f"SELECT *, {_ACTION_NOTES_JSON}, {_ACTION_CONVERSATIONS_JSON} FROM proposed_actions WHERE action_id = ?",
+                    (action_id, action_id, action_id)
+                )
+                row = cursor.fetchone()
+                source_table = "proposed_actions"
+
+            if not row:
+                return jsonify({"error": "Action not found"}), 404
+
+            columns = [description[0] for description in cursor.description]
+            action = dict(zip(columns, row))
+            action['source_table'] = source_table
+            action['notes'] = orjson.loads(action.pop('notes_json'))
+            action['ai_conversations'] = action.pop('conversations_json')
+
+        if job is not None:
+            action['exploration_status'] = job["status"]
+            if job.get("error"):
+                action['exploration_error'] = job["error"]
+        
+        return _with_etag(jsonify({
             "success": True,
             "action": action
-        })
+        }), etag)
         
     except Exception as e:
         logger.error(f"Error getting action: {e}")
@@ -175,9 +478,7 @@ def api_get_action(action_id):
 @action_bp.route('/api/actions/save', methods=['POST'])
 def api_save_action():
     """Save a proposed action to the saved_actions table."""
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    user_role = g.user_role
 
     try:
         data = request.get_json()
@@ -186,44 +487,40 @@ def api_save_action():
         if not action_id:
             return jsonify({"error": "Missing action_id"}), 400
 
-        conn = get_role_db_connection(user_role)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT * FROM proposed_actions WHERE action_id = ?", (action_id,))
-        proposed_action = cursor.fetchone()
+        with closing(get_role_db_connection(user_role)) as conn:
+            cursor = conn.cursor()
 
-        if not proposed_action:
-            conn.close()
-            return jsonify({"error": "Proposed action not found"}), 404
-
-        action_json = json.loads(proposed_action['action_json']) if proposed_action['action_json'] else {}
-
-        cursor.execute("""
-            INSERT OR REPLACE INTO saved_actions (
-                action_id, priority_id, grid_type, action_title, action_description,
-                status, estimated_effort, estimated_impact,
-                gemini_context, next_steps
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            proposed_action['action_id'],
-            proposed_action['priority_id'],
-            proposed_action['grid_type'],
-            proposed_action['action_title'],
-            proposed_action['action_description'],
-            'pending',
-            action_json.get('estimated_effort'),
-            action_json.get('estimated_impact'),
-            proposed_action['gemini_context'],
-            proposed_action['next_steps']
-        ))
-        conn.commit()
-
-        cursor.execute("SELECT * FROM saved_actions WHERE action_id = ?", (action_id,))
-        saved_action = cursor.fetchone()
+            cursor.execute("SELECT * FROM proposed_actions WHERE action_id = ?", (action_id,))
+            proposed_action = cursor.fetchone()
+
+            if not proposed_action:
+                return jsonify({"error": "Proposed action not found"}), 404
+
+            action_json = orjson.loads(proposed_action['action_json']) if proposed_action['action_json'] else {}
+
+            cursor.execute("""
+                INSERT OR REPLACE INTO saved_actions (
+                    action_id, priority_id, grid_type, action_title, action_description,
+                    status, estimated_effort, estimated_impact,
+                    gemini_context, next_steps
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                RETURNING *
+            """, (
+                proposed_action['action_id'],
+                proposed_action['priority_id'],
+                proposed_action['grid_type'],
+                proposed_action['action_title'],
+                proposed_action['action_description'],
+                'pending',
+                action_json.get('estimated_effort'),
+                action_json.get('estimated_impact'),
+                proposed_action['gemini_context'],
+                proposed_action['next_steps']
+            ))
+            saved_action = cursor.fetchone()
+            conn.commit()
+            _invalidate_saved_actions(user_role)
         
-        conn.close()
-
         return jsonify({
             "success": True,
             "action": dict(saved_action)
@@ -237,68 +534,81 @@ def api_save_action():
 @action_bp.route('/api/actions/saved', methods=['GET'])
 def api_get_saved_actions():
     """Get all saved actions for the current role."""
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    user_role = g.user_role
 
     try:
-        conn = get_role_db_connection(user_role)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        stamp = _role_db_stamp(user_role)
+        etag = _role_db_etag(user_role, stamp, "saved")
+        not_modified = _not_modified(etag)
+        if not_modified is not None:
+            return not_modified
+        
+        with _saved_actions_lock:
+            cached = _saved_actions_cache.get(user_role)
+        if cached and cached[0] == stamp:
+            return _with_etag(jsonify({
+                "success": True,
+                "actions_by_priority": cached[1]
+            }), etag)
+
+        with closing(get_role_db_connection(user_role)) as conn:
+            cursor = conn.cursor()
+
+            # Let SQLite group the actions: one row per priority, holding its
+            # actions (newest first) as a JSON array of objects
+            columns = [col[1] for col in table_columns(cursor, ["saved_actions"])["saved_actions"]]
+            action_fields = ", ".join(f"'{name}', sa.{quote_identifier(name)}" for name in columns)
+            cursor.execute(f"""
+                SELECT priority_title, json_group_array(json(action_json)) AS actions_json
+                FROM (
+                    SELECT
+                        COALESCE(san.priority_title, 'Priority ' || sa.priority_id) AS priority_title,
+                        json_object({action_fields},
+                            'priority_title', COALESCE(san.priority_title, 'Priority ' || sa.priority_id)) AS action_json
+                    FROM saved_actions sa
+                    LEFT JOIN saved_analyses san ON sa.priority_id = san.priority_id AND (sa.grid_type = san.grid_type OR sa.grid_type = 'unknown')
+                    ORDER BY priority_title, sa.saved_ts DESC
+                )
+                GROUP BY priority_title
+                ORDER BY priority_title
+            """)
+            actions_by_priority = {
+                row['priority_title']: orjson.loads(row['actions_json'])
+                for row in cursor.fetchall()
+            }
 
-        cursor.execute("""
-            SELECT 
-                sa.*,
-                COALESCE(san.priority_title, 'Priority ' || sa.priority_id) as priority_title
-            FROM saved_actions sa
-            LEFT JOIN saved_analyses san ON sa.priority_id = san.priority_id AND (sa.grid_type = san.grid_type OR sa.grid_type = 'unknown')
-            ORDER BY priority_title, sa.saved_ts DESC
-        """)
-        rows = cursor.fetchall()
-        
-        actions_by_priority = {}
-        for row in rows:
-            action = dict(row)
-            priority_title = action.get('priority_title', 'Uncategorized')
-            if priority_title not in actions_by_priority:
-                actions_by_priority[priority_title] = []
-            actions_by_priority[priority_title].append(action)
-
-        conn.close()
+        with _saved_actions_lock:
+            _saved_actions_cache[user_role] = (stamp, actions_by_priority)
 
-        return jsonify({
+        return _with_etag(jsonify({
             "success": True,
             "actions_by_priority": actions_by_priority
-        })
+        }), etag)
 
     except Exception as e:
         logger.error(f"Error getting saved actions: {e}")
         return jsonify({"error": "Failed to get saved actions"}), 500
 
 
-@action_bp.route('/api/actions/saved/<action_id>', methods=['GET'])
+@action_bp.route('/api/actions/saved/<action_id:action_id>', methods=['GET'])
 def api_get_saved_action(action_id):
     """Get a specific saved action from the role-specific DB."""
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    user_role = g.user_role
 
     try:
-        conn = get_role_db_connection(user_role)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            SELECT 
-                sa.*,
-                COALESCE(san.priority_title, 'Priority ' || sa.priority_id) as priority_title,
-                san.priority_data
-            FROM saved_actions sa
-            LEFT JOIN saved_analyses san ON sa.priority_id = san.priority_id AND sa.grid_type = san.grid_type
-            WHERE sa.action_id = ?
-        """, (action_id,))
-        row = cursor.fetchone()
-        conn.close()
+        with closing(get_role_db_connection(user_role)) as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                SELECT 
+                    sa.*,
+                    COALESCE(san.priority_title, 'Priority ' || sa.priority_id) as priority_title,
+                    san.priority_data
+                FROM saved_actions sa
+                LEFT JOIN saved_analyses san ON sa.priority_id = san.priority_id AND sa.grid_type = san.grid_type
+                WHERE sa.action_id = ?
+            """, (action_id,))
+            row = cursor.fetchone()
         
         if not row:
             return jsonify({"error": "Action not found"}), 404
@@ -308,7 +618,7 @@ def api_get_saved_action(action_id):
         # Parse JSON fields
         if action.get('priority_data'):
             try:
-                action['priority_data'] = json.loads(action['priority_data'])
+                action['priority_data'] = orjson.loads(action['priority_data'])
             except:
                 action['priority_data'] = {}
         else:
@@ -338,27 +648,24 @@ def api_get_saved_action(action_id):
         return jsonify({"error": "Failed to get action"}), 500
 
 
-@action_bp.route('/api/actions/saved/<action_id>', methods=['DELETE'])
+@action_bp.route('/api/actions/saved/<action_id:action_id>', methods=['DELETE'])
 def api_delete_saved_action(action_id):
     """Delete a saved action from the role-specific DB."""
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    user_role = g.user_role
 
     try:
-        conn = get_role_db_connection(user_role)
-        cursor = conn.cursor()
+        with closing(get_role_db_connection(user_role)) as conn:
+            cursor = conn.cursor()
         
-        # Check if the action exists
-        cursor.execute("SELECT action_id FROM saved_actions WHERE action_id = ?", (action_id,))
-        if not cursor.fetchone():
-            conn.close()
-            return jsonify({"error": "Action not found"}), 404
+            # Check if the action exists
+            cursor.execute("SELECT action_id FROM saved_actions WHERE action_id = ?", (action_id,))
+            if not cursor.fetchone():
+                return jsonify({"error": "Action not found"}), 404
         
-        # Delete the action
-        cursor.execute("DELETE FROM saved_actions WHERE action_id = ?", (action_id,))
-        conn.commit()
-        conn.close()
+            # Delete the action
+            cursor.execute("DELETE FROM saved_actions WHERE action_id = ?", (action_id,))
+            conn.commit()
+        _invalidate_saved_actions(user_role)
         
         logger.info(f"Deleted saved action {action_id} for role {user_role}")
         return jsonify({"success": True, "message": "Action deleted successfully"})
@@ -368,12 +675,10 @@ def api_delete_saved_action(action_id):
         return jsonify({"error": "Failed to delete action"}), 500
 
 
-@action_bp.route('/api/actions/<action_id>/notes', methods=['POST'])
+@action_bp.route('/api/actions/<action_id:action_id>/notes', methods=['POST'])
 def api_add_note_to_action(action_id):
     """Add a note to a saved action."""
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    user_role = g.user_role
 
     try:
         data = request.get_json()
@@ -382,18 +687,15 @@ def api_add_note_to_action(action_id):
         if not note_text:
             return jsonify({"error": "Missing note_text"}), 400
 
-        conn = get_role_db_connection(user_role)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        cursor.execute("INSERT INTO action_notes (action_id, note_text) VALUES (?, ?)", (action_id, note_text))
-        conn.commit()
-        
-        note_id = cursor.lastrowid
-        cursor.execute("SELECT * FROM action_notes WHERE id = ?", (note_id,))
-        new_note = cursor.fetchone()
+        with closing(get_role_db_connection(user_role)) as conn:
+            cursor = conn.cursor()
 
-        conn.close()
+            cursor.execute(
+                "INSERT INTO action_notes (action_id, note_text) VALUES (?, ?) RETURNING *",
+                (action_id, note_text)
+            )
+            new_note = cursor.fetchone()
+            conn.commit()
 
         return jsonify({"success": True, "note": dict(new_note)}), 201
 
@@ -402,22 +704,17 @@ def api_add_note_to_action(action_id):
         return jsonify({"error": "Failed to add note"}), 500
 
 
-@action_bp.route('/api/actions/<action_id>/notes', methods=['GET'])
+@action_bp.route('/api/actions/<action_id:action_id>/notes', methods=['GET'])
 def api_get_action_notes(action_id):
     """Get all notes for a saved action."""
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    user_role = g.user_role
 
     try:
-        conn = get_role_db_connection(user_role)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT * FROM action_notes WHERE action_id = ? ORDER BY created_ts ASC", (action_id,))
-        notes = [dict(row) for row in cursor.fetchall()]
+        with closing(get_role_db_connection(user_role)) as conn:
+            cursor = conn.cursor()
 
-        conn.close()
+            cursor.execute("SELECT * FROM action_notes WHERE action_id = ? ORDER BY created_ts ASC", (action_id,))
+            notes = rows_to_dicts(cursor)
 
         return jsonify({"success": True, "notes": notes})
 
@@ -426,12 +723,10 @@ def api_get_action_notes(action_id):
         return jsonify({"error": "Failed to get notes"}), 500
 
 
-@action_bp.route('/api/actions/<action_id>/steps/update', methods=['POST'])
+@action_bp.route('/api/actions/<action_id:action_id>/steps/update', methods=['POST'])
 def api_update_action_step_status(action_id):
     """Update the status of a single step or sub-task in an action plan."""
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    user_role = g.user_role
     
     try:
         data = request.get_json()
@@ -456,12 +751,42 @@ def api_update_action_step_status(action_id):
         return jsonify({"error": "Failed to update step status"}), 500
 
 
-@action_bp.route('/api/actions/<action_id>/steps/<task_id>/generate-query', methods=['POST'])
+@action_bp.route('/api/actions/<action_id:action_id>/steps/batch-update', methods=['POST'])
+def api_batch_update_action_steps(action_id):
+    """Update the status of several steps or sub-tasks of an action plan in one write."""
+    user_role = g.user_role
+    
+    try:
+        data = request.get_json()
+        items = data.get('updates') if isinstance(data, dict) else None
+
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": "Missing updates"}), 400
+        updates = []
+        for item in items:
+            if not isinstance(item, dict) or not item.get('task_id') or not item.get('status'):
+                return jsonify({"error": "Each update needs a task_id and status"}), 400
+            updates.append((item['task_id'], item['status']))
+
+        updated_action = update_task_statuses_in_db(user_role, action_id, updates)
+
+        if not updated_action:
+            return jsonify({"error": "Action or task not found"}), 404
+
+        return jsonify({
+            "success": True,
+            "action": updated_action
+        })
+
+    except Exception as e:
+        logger.error(f"Error batch updating action step statuses: {e}")
+        return jsonify({"error": "Failed to update step statuses"}), 500
+
+
+@action_bp.route('/api/actions/<action_id:action_id>/steps/<task_id>/generate-query', methods=['POST'])
 def api_generate_query_for_step(action_id, task_id):
     """Generate a SQL query for a specific action plan step."""
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    user_role = g.user_role
     
     try:
         query_data = generate_sql_query_for_task(user_role, action_id, task_id)
@@ -480,12 +805,10 @@ def api_generate_query_for_step(action_id, task_id):
         return jsonify({"error": "Failed to generate SQL query"}), 500
 
 
-@action_bp.route('/api/actions/<action_id>/steps/<task_id>/generate-communication', methods=['POST'])
+@action_bp.route('/api/actions/<action_id:action_id>/steps/<task_id>/generate-communication', methods=['POST'])
 def api_generate_communication_for_step(action_id, task_id):
     """Generate a communication draft for a specific action plan step."""
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    user_role = g.user_role
     
     try:
         data = request.get_json()
@@ -509,44 +832,35 @@ def api_generate_communication_for_step(action_id, task_id):
         return jsonify({"error": "Failed to generate communication"}), 500
 
 
-@action_bp.route('/api/actions/<action_id>/notes/<int:note_id>', methods=['DELETE'])
+@action_bp.route('/api/actions/<action_id:action_id>/notes/<int:note_id>', methods=['DELETE'])
 def api_delete_action_note(action_id, note_id):
     """Delete a note from a saved action."""
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    user_role = g.user_role
 
     try:
-        conn = get_role_db_connection(user_role)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        with closing(get_role_db_connection(user_role)) as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("DELETE FROM action_notes WHERE id = ? AND action_id = ?", (note_id, action_id))
-        conn.commit()
+            cursor.execute("DELETE FROM action_notes WHERE id = ? AND action_id = ?", (note_id, action_id))
+            conn.commit()
 
-        if cursor.rowcount == 0:
-            conn.close()
-            return jsonify({"error": "Note not found or does not belong to this action"}), 404
-
-        # Fetch remaining notes to send back to the client
-        cursor.execute("SELECT * FROM action_notes WHERE action_id = ? ORDER BY created_ts ASC", (action_id,))
-        notes = [dict(row) for row in cursor.fetchall()]
+            deleted = cursor.rowcount
 
-        conn.close()
+        if deleted == 0:
+            return jsonify({"error": "Note not found or does not belong to this action"}), 404
 
-        return jsonify({"success": True, "notes": notes})
+        # The client drops the note from the list it already has
+        return jsonify({"success": True, "deleted_note_id": note_id})
 
     except Exception as e:
         logger.error(f"Error deleting action note: {e}")
         return jsonify({"error": "Failed to delete note"}), 500
 
 
-@action_bp.route('/api/actions/<action_id>/ai-assistant', methods=['POST'])
+@action_bp.route('/api/actions/<action_id:action_id>/ai-assistant', methods=['POST'])
 def api_ask_ai_assistant(action_id):
     """Ask AI Assistant a question about a specific step or context section."""
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    user_role = g.user_role
     
     try:
         data = request.get_json()
@@ -557,31 +871,13 @@ def api_ask_ai_assistant(action_id):
         if not question or not target_type or not target_id:
             return jsonify({"error": "Missing required fields"}), 400
         
-        conn = get_role_db_connection(user_role)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
         # Fetch the action
-        cursor.execute("""
-            SELECT sa.*, p.priority_title
-            FROM saved_actions sa
-            LEFT JOIN saved_analyses p ON sa.priority_id = p.priority_id
-            WHERE sa.action_id = ?
-        """, (action_id,))
-        action_data = cursor.fetchone()
-        target_table = "saved_actions"
-        
-        if not action_data:
-            cursor.execute("SELECT * FROM proposed_actions WHERE action_id = ?", (action_id,))
-            action_data = cursor.fetchone()
-            target_table = "proposed_actions"
+        with closing(get_role_db_connection(user_role)) as conn:
+            action_data = conn.execute(_ACTION_FOR_ASSISTANT, (action_id, action_id)).fetchone()
         
         if not action_data:
             return jsonify({"error": "Action not found"}), 404
         
-        # Get existing AI conversations or initialize
-        ai_conversations = json.loads(action_data['ai_conversations'] if action_data['ai_conversations'] else '{}')
-        
         # Prepare context for AI based on target type
         if target_type == 'step':
             context = _prepare_step_context(action_data, target_id)
@@ -620,19 +916,15 @@ def api_ask_ai_assistant(action_id):
             "timestamp": datetime.now().isoformat()
         }
         
-        # Save to appropriate target conversations
+        # Save under the step or context section it belongs to (on a fresh
+        # connection, so none is held during the model call)
         target_key = f"{target_type}_{target_id}"
-        if target_key not in ai_conversations:
-            ai_conversations[target_key] = []
-        ai_conversations[target_key].append(conversation_entry)
-        
-        # Update database
-        cursor.execute(
-            f"UPDATE {target_table} SET ai_conversations = ?, updated_ts = CURRENT_TIMESTAMP WHERE action_id = ?",
-            (json.dumps(ai_conversations), action_id)
-        )
-        conn.commit()
-        conn.close()
+        with closing(get_role_db_connection(user_role)) as conn:
+            conn.execute(
+                "INSERT INTO ai_conversations (id, action_id, target_key, question, response, created_ts) VALUES (?, ?, ?, ?, ?, ?)",
+                (conversation_id, action_id, target_key, question, ai_response, conversation_entry["timestamp"])
+            )
+            conn.commit()
         
         return jsonify({
             "success": True,
@@ -646,55 +938,22 @@ def api_ask_ai_assistant(action_id):
         return jsonify({"error": f"Failed to get AI response: {str(e)}"}), 500
 
 
-@action_bp.route('/api/actions/<action_id>/ai-assistant/<conversation_id>', methods=['DELETE'])
+@action_bp.route('/api/actions/<action_id:action_id>/ai-assistant/<conversation_id>', methods=['DELETE'])
 def api_delete_ai_conversation(action_id, conversation_id):
     """Delete a specific AI conversation."""
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    user_role = g.user_role
     
     try:
-        conn = get_role_db_connection(user_role)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        with closing(get_role_db_connection(user_role)) as conn:
+            cursor = conn.execute(
+                "DELETE FROM ai_conversations WHERE id = ? AND action_id = ?",
+                (conversation_id, action_id)
+            )
+            conn.commit()
         
-        # Fetch the action
-        cursor.execute("SELECT * FROM saved_actions WHERE action_id = ?", (action_id,))
-        action_data = cursor.fetchone()
-        target_table = "saved_actions"
-        
-        if not action_data:
-            cursor.execute("SELECT * FROM proposed_actions WHERE action_id = ?", (action_id,))
-            action_data = cursor.fetchone()
-            target_table = "proposed_actions"
-        
-        if not action_data:
-            return jsonify({"error": "Action not found"}), 404
-        
-        # Get existing AI conversations
-        ai_conversations = json.loads(action_data['ai_conversations'] if action_data['ai_conversations'] else '{}')
-        
-        # Find and remove the conversation
-        conversation_found = False
-        for target_key, conversations in ai_conversations.items():
-            ai_conversations[target_key] = [
-                conv for conv in conversations 
-                if conv.get('id') != conversation_id
-            ]
-            if len(ai_conversations[target_key]) != len(conversations):
-                conversation_found = True
-        
-        if not conversation_found:
+        if cursor.rowcount == 0:
             return jsonify({"error": "Conversation not found"}), 404
         
-        # Update database
-        cursor.execute(
-            f"UPDATE {target_table} SET ai_conversations = ?, updated_ts = CURRENT_TIMESTAMP WHERE action_id = ?",
-            (json.dumps(ai_conversations), action_id)
-        )
-        conn.commit()
-        conn.close()
-        
         return jsonify({"success": True})
         
     except Exception as e:
@@ -705,14 +964,14 @@ def api_delete_ai_conversation(action_id, conversation_id):
 def _prepare_step_context(action_data, step_id):
     """Prepare context information for a specific step."""
     try:
-        next_steps = json.loads(action_data['next_steps'] if action_data['next_steps'] else '[]')
+        next_steps = orjson.loads(action_data['next_steps'] if action_data['next_steps'] else '[]')
         step = next((s for s in next_steps if str(s.get('id')).lower() == step_id.lower()), None)
         
         if not step:
             return None
         
         action_dict = dict(action_data)
-        priority_title = action_dict.get('priority_title', 'N/A')
+        priority_title = action_dict.get('priority_title') or 'N/A'
         
         context = f"""
         **Action Title:** {action_data['action_title']}
@@ -751,7 +1010,7 @@ def _prepare_context_section_context(action_data, section_id):
         
         section_name = context_sections.get(section_id, section_id)
         action_dict = dict(action_data)
-        priority_title = action_dict.get('priority_title', 'N/A')
+        priority_title = action_dict.get('priority_title') or 'N/A'
         
         context = f"""
         **Action Title:** {action_data['action_title']}
@@ -5,14 +5,95 @@ This module contains Flask Blueprint for analysis-related API endpoints.
 """
 
 from flask import Blueprint, request, jsonify, session
-from app.models import build_metrics_for_role, filter_data_for_short_term
-from app.database import get_db_connection
+from app.models import build_metrics_for_role, filter_data_for_short_term, json_file_exists, load_json_cached, get_role_db_path
+from app.database import get_db_connection, open_untrusted_db, run_queries_concurrently, rows_to_column_arrays
+from app.database.sql_windows import extract_table, add_time_window, window_comparison_sql
 from services.gemini_service import analyze_metrics_short_term, analyze_metrics_long_term
-import json
+from datetime import datetime, timedelta
+from pathlib import Path
+import functools
+import orjson
 import logging
+import re
+import sqlite3
 
 analysis_bp = Blueprint('analysis', __name__)
 
+# Issue category keywords, one compiled alternation per category. Categories
+# are tried in this order and keywords match anywhere in the text (so "page"
+# also matches "pages"), which is why this is not one combined pattern: a
+# single search would return whichever keyword occurs first in the text.
+_ISSUE_CATEGORY_PATTERNS = tuple(
+    (name, re.compile("|".join(re.escape(k) for k in keywords)))
+    for name, keywords in (
+        ("marketing", ["roas", "ctr", "cvr", "campaign", "creative", "paid", "social", "display", "email"]),
+        ("performance", ["lcp", "fid", "cls", "perf", "web", "latency", "page"]),
+        ("checkout", ["checkout", "payment", "decline", "gateway", "failure"]),
+        ("search", ["search", "zero result", "query"]),
+        ("returns", ["return", "rma"]),
+        ("merch", ["sku", "inventory", "merch", "pdp", "plp"]),
+    )
+)
+
+
+def _summarize_issue(issue):
+    # Flatten one prioritized issue into the analysis_runs issue columns
+    if issue is None:
+        return {"title": "", "why": "", "category": "", "evidence": {}}
+    txt = f"{issue.get('title','')} {issue.get('why','')} {' '.join((issue.get('evidence') or {}).keys())}".lower()
+    cat = next((name for name, pattern in _ISSUE_CATEGORY_PATTERNS if pattern.search(txt)), "")
+    return {
+        "title": issue.get("title", ""),
+        "why": issue.get("why", ""),
+        "category": cat,
+        "evidence": issue.get("evidence") or {}
+    }
+
+
+def _save_analysis_run(role: str, short_term_analysis: dict, analysis: dict):
+    """
+    Replace the stored analysis run for a role with a new one.
+    
+    The top three short-term issues are stored in their own columns next to
+    the full analysis JSON; each value is serialized exactly once.
+    
+    Args:
+        role (str): Role the analysis belongs to
+        short_term_analysis (dict): Short-term Gemini analysis
+        analysis (dict): Combined analysis to store as JSON
+        
+    Returns:
+        str: created_ts of the inserted row
+    """
+    short_prior = short_term_analysis.get("prioritized_issues", []) or []
+    issue_values = []
+    for idx in range(3):
+        item = _summarize_issue(short_prior[idx] if idx < len(short_prior) else None)
+        issue_values += [item["title"], item["why"], item["category"], orjson.dumps(item["evidence"]).decode()]
+    
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        # Delete previous analysis for this role to ensure only latest is kept
+        cur.execute("DELETE FROM analysis_runs WHERE role = ?", (role,))
+        cur.execute(
+            """
+            INSERT INTO analysis_runs(role, summary,
+              issue1_title, issue1_why, issue1_category, issue1_evidence_json,
+              issue2_title, issue2_why, issue2_category, issue2_evidence_json,
+              issue3_title, issue3_why, issue3_category, issue3_evidence_json,
+              analysis_json)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            RETURNING created_ts
+            """,
+            (role, short_term_analysis.get("summary", ""), *issue_values, orjson.dumps(analysis).decode())
+        )
+        row = cur.fetchone()
+        conn.commit()
+    finally:
+        conn.close()
+    return row["created_ts"] if row else None
+
 
 @analysis_bp.route("/api/analyze", methods=["POST"]) 
 def api_analyze():
@@ -50,59 +131,7 @@ def api_analyze():
         # Persist latest successful analysis
         if analysis and isinstance(analysis, dict):
             # Store both analyses in the database
-            conn = get_db_connection()
-            cur = conn.cursor()
-            # Delete previous analysis for this role to ensure only latest is kept
-            cur.execute("DELETE FROM analysis_runs WHERE role = ?", (role,))
-            
-            # Store short-term analysis
-            short_prior = short_term_analysis.get("prioritized_issues", []) or []
-            def extract(i):
-                if i is None: return {"title":"","why":"","category":"","evidence":{}}
-                cat = ""
-                txt = f"{i.get('title','')} {i.get('why','')} {' '.join((i.get('evidence') or {}).keys())}".lower()
-                if any(x in txt for x in ["roas","ctr","cvr","campaign","creative","paid","social","display","email"]): cat = "marketing"
-                elif any(x in txt for x in ["lcp","fid","cls","perf","web","latency","page"]): cat = "performance"
-                elif any(x in txt for x in ["checkout","payment","decline","gateway","failure"]): cat = "checkout"
-                elif any(x in txt for x in ["search","zero result","query"]): cat = "search"
-                elif any(x in txt for x in ["return","rma"]): cat = "returns"
-                elif any(x in txt for x in ["sku","inventory","merch","pdp","plp"]): cat = "merch"
-                return {
-                    "title": i.get("title",""),
-                    "why": i.get("why",""),
-                    "category": cat,
-                    "evidence": i.get("evidence") or {}
-                }
-            
-            short_items = [extract(short_prior[0] if len(short_prior)>0 else None), extract(short_prior[1] if len(short_prior)>1 else None), extract(short_prior[2] if len(short_prior)>2 else None)]
-            
-            cur.execute(
-                """
-                INSERT INTO analysis_runs(role, summary,
-                  issue1_title, issue1_why, issue1_category, issue1_evidence_json,
-                  issue2_title, issue2_why, issue2_category, issue2_evidence_json,
-                  issue3_title, issue3_why, issue3_category, issue3_evidence_json,
-                  analysis_json)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    role, short_term_analysis.get("summary",""),
-                    short_items[0]["title"], short_items[0]["why"], short_items[0]["category"], json.dumps(short_items[0]["evidence"], ensure_ascii=False),
-                    short_items[1]["title"], short_items[1]["why"], short_items[1]["category"], json.dumps(short_items[1]["evidence"], ensure_ascii=False),
-                    short_items[2]["title"], short_items[2]["why"], short_items[2]["category"], json.dumps(short_items[2]["evidence"], ensure_ascii=False),
-                    json.dumps(analysis, ensure_ascii=False)
-                )
-            )
-            conn.commit()
-            conn.close()
-            
-            # Get the created timestamp for the new analysis
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute("SELECT created_ts FROM analysis_runs WHERE role = ? ORDER BY created_ts DESC LIMIT 1", (role,))
-            row = cur.fetchone()
-            conn.close()
-            analysis["created_ts"] = row["created_ts"] if row else None
+            analysis["created_ts"] = _save_analysis_run(role, short_term_analysis, analysis)
     except Exception as e:
         analysis_error = str(e)
     
@@ -136,7 +165,7 @@ def api_analysis_latest():
     
     # Prefer the full saved JSON if present; fallback to columns
     try:
-        analysis = json.loads(row["analysis_json"]) if row["analysis_json"] else None
+        analysis = orjson.loads(row["analysis_json"]) if row["analysis_json"] else None
     except Exception:
         analysis = None
     
@@ -170,7 +199,6 @@ def api_custom_role_analyze():
         return jsonify({"ok": False, "error": "Missing role_name"}), 400
     
     # Get the metrics for this custom role
-    from app.models import get_role_db_path
     role_db = get_role_db_path(role_name)
     
     logging.info(f"Role DB path: {role_db}")
@@ -179,34 +207,27 @@ def api_custom_role_analyze():
     if not role_db.exists():
         return jsonify({"ok": False, "error": "Role DB not found"}), 404
     
-    # Build metrics data similar to build_metrics_for_role
-    import sqlite3
-    conn = sqlite3.connect(str(role_db))
-    conn.row_factory = sqlite3.Row
+    # Build metrics data similar to build_metrics_for_role. The plan SQL is
+    # model-written, so it runs on private read-only connections.
+    conn = open_untrusted_db(role_db)
     cur = conn.cursor()
     
     metrics = {}
-    from pathlib import Path
     APP_ROOT = Path(__file__).parent.parent.parent.resolve()
     CUSTOM_DIR = APP_ROOT / "custom_roles"
     plan_path = CUSTOM_DIR / f"{role_name.replace(' ','_')}.plan.json"
     
-    if plan_path.exists():
+    if json_file_exists(plan_path):
         try:
-            plan = json.loads(plan_path.read_text())
+            plan = load_json_cached(plan_path)
             
             # Execute KPI calculations with change percentage
             kpis = plan.get("kpis") or []
             
             # Helper functions for change calculation
-            import re
-            def extract_table(sql: str) -> str:
-                m = re.search(r"FROM\s+`?\"?([a-zA-Z0-9_]+)`?\"?", sql, re.IGNORECASE)
-                return m.group(1) if m else ""
-            
             def pick_date_column(table: str) -> str:
                 try:
-                    cur.execute(f"PRAGMA table_info('{table}')")
+                    cur.execute("SELECT * FROM pragma_table_info(?)", (table,))
                     cols = [r[1] for r in cur.fetchall()]
                 except Exception:
                     cols = []
@@ -223,74 +244,91 @@ def api_custom_role_analyze():
                         return c
                 return ""
             
-            def add_time_window(sql: str, table: str, date_col: str, start_iso: str, end_iso: str) -> str:
-                if not table or not date_col:
-                    return ""
-                # Normalize SQL spacing
-                s = sql.strip()
-                has_where = re.search(r"\bWHERE\b", s, re.IGNORECASE) is not None
-                clause = f"{date_col} BETWEEN date('{start_iso}') AND date('{end_iso}')"
-                if has_where:
-                    return re.sub(r"\bWHERE\b", lambda m: m.group(0) + " " + clause + " AND ", s, count=1, flags=re.IGNORECASE)
-                else:
-                    return re.sub(r"\bFROM\s+`?\"?" + re.escape(table) + r"`?\"?", lambda m: m.group(0) + f" WHERE {clause}", s, count=1, flags=re.IGNORECASE)
+            def fetch_window_values(sql_curr: str, sql_prev: str):
+                # Both windows as scalar subqueries of one statement: a single round-trip
+                try:
+                    cur.execute(f"SELECT ({sql_curr.rstrip().rstrip(';')}) AS curr, ({sql_prev.rstrip().rstrip(';')}) AS prev")
+                    row = cur.fetchone()
+                    return row[0], row[1]
+                except sqlite3.OperationalError:
+                    # Multi-column formulas can't be scalar subqueries; run the windows separately
+                    cur.execute(sql_curr)
+                    curr_result = cur.fetchone()
+                    cur.execute(sql_prev)
+                    prev_result = cur.fetchone()
+                    if not (curr_result and prev_result):
+                        return None, None
+                    return curr_result[0], prev_result[0]
 
-            from datetime import datetime, timedelta
             end_curr = datetime.utcnow().date()
             start_curr = end_curr - timedelta(days=30)
             end_prev = start_curr - timedelta(days=1)
             start_prev = end_prev - timedelta(days=30)
-            fmt = lambda d: d.isoformat()
+            # Window bounds as ISO strings, computed once for every KPI
+            window_params = (start_curr.isoformat(), end_curr.isoformat(), start_prev.isoformat(), end_prev.isoformat())
+            s_curr, e_curr, s_prev, e_prev = window_params
 
             for kpi in kpis:
                 formula = kpi.get("formula")
                 kpi_id = kpi.get("id") or kpi.get("title", "kpi").lower().replace(" ", "_")
                 if formula:
                     try:
-                        # Get current value
-                        cur.execute(formula)
-                        result = cur.fetchone()
-                        if result:
+                        table = extract_table(formula)
+                        date_col = pick_date_column(table) if table else ""
+                        
+                        # Simple aggregates get their value and both windows
+                        # from one scan via conditional aggregation
+                        kpi_data = None
+                        combined_sql = window_comparison_sql(formula, table, date_col) if date_col else ""
+                        if combined_sql:
+                            try:
+                                cur.execute(combined_sql, window_params)
+                                row = cur.fetchone()
+                                kpi_data = {cur.description[0][0]: row[0]}
+                                curr_val, prev_val = row[1], row[2]
+                            except sqlite3.Error:
+                                kpi_data = None
+                        
+                        if kpi_data is None:
+                            # Get current value
+                            cur.execute(formula)
+                            result = cur.fetchone()
+                            if not result:
+                                continue
                             kpi_data = dict(result)
+                            curr_val = prev_val = None
                             
                             # Try to calculate change percentage
-                            table = extract_table(formula)
-                            date_col = pick_date_column(table)
                             if table and date_col:
                                 try:
-                                    sql_curr = add_time_window(formula, table, date_col, fmt(start_curr), fmt(end_curr))
-                                    sql_prev = add_time_window(formula, table, date_col, fmt(start_prev), fmt(end_prev))
+                                    sql_curr = add_time_window(formula, table, date_col, s_curr, e_curr)
+                                    sql_prev = add_time_window(formula, table, date_col, s_prev, e_prev)
                                     if sql_curr and sql_prev:
-                                        cur.execute(sql_curr)
-                                        curr_result = cur.fetchone()
-                                        cur.execute(sql_prev)
-                                        prev_result = cur.fetchone()
-                                        
-                                        if curr_result and prev_result:
-                                            curr_val = list(curr_result.values())[0]
-                                            prev_val = list(prev_result.values())[0]
-                                            if isinstance(curr_val, (int, float)) and isinstance(prev_val, (int, float)) and prev_val != 0:
-                                                change_pct = ((curr_val - prev_val) / prev_val) * 100
-                                                kpi_data['change_pct'] = round(change_pct, 1)
+                                        curr_val, prev_val = fetch_window_values(sql_curr, sql_prev)
                                 except Exception:
                                     pass  # If change calculation fails, just use the original value
-                            
-                            metrics[f"kpi_{kpi_id}"] = kpi_data
+                        
+                        if isinstance(curr_val, (int, float)) and isinstance(prev_val, (int, float)) and prev_val != 0:
+                            change_pct = ((curr_val - prev_val) / prev_val) * 100
+                            kpi_data['change_pct'] = round(change_pct, 1)
+                        
+                        metrics[f"kpi_{kpi_id}"] = kpi_data
                     except Exception:
                         pass
             
             # Execute chart queries
             charts = plan.get("charts") or []
+            chart_queries = []
             for ch in charts:
                 q = ch.get("query_sql")
                 chart_id = (ch.get("id") or ch.get("title") or "chart").lower().replace(" ", "_")
                 if not q:
                     continue
-                try:
-                    cur.execute(q)
-                    metrics[f"chart_{chart_id}"] = [dict(r) for r in cur.fetchall()]
-                except Exception:
-                    continue
+                chart_queries.append((f"chart_{chart_id}", q))
+            metrics.update(run_queries_concurrently(
+                functools.partial(open_untrusted_db, role_db), chart_queries, skip_errors=True,
+                materialize=rows_to_column_arrays,
+            ))
         except Exception:
             pass
     conn.close()
@@ -306,9 +344,9 @@ def api_custom_role_analyze():
         
         # Show sample data from one chart to verify it's correct
         for key, value in metrics.items():
-            if key.startswith('chart_') and isinstance(value, list) and len(value) > 0:
+            if key.startswith('chart_') and isinstance(value, dict) and value:
                 logging.info(f"Sample chart data from {key}:")
-                logging.info(f"  First row: {value[0]}")
+                logging.info(f"  First row: { {col: values[0] for col, values in value.items() if len(values)} }")
                 break
         
         # Get short-term analysis (last 2 weeks) - for custom roles, we'll use all available data
@@ -328,59 +366,7 @@ def api_custom_role_analyze():
         
         # Save analysis to database (similar to built-in roles)
         if analysis and isinstance(analysis, dict):
-            conn = get_db_connection()
-            cur = conn.cursor()
-            # Delete previous analysis for this role to ensure only latest is kept
-            cur.execute("DELETE FROM analysis_runs WHERE role = ?", (role_name,))
-            
-            # Store short-term analysis
-            short_prior = short_term_analysis.get("prioritized_issues", []) or []
-            def extract(i):
-                if i is None: return {"title":"","why":"","category":"","evidence":{}}
-                cat = ""
-                txt = f"{i.get('title','')} {i.get('why','')} {' '.join((i.get('evidence') or {}).keys())}".lower()
-                if any(x in txt for x in ["roas","ctr","cvr","campaign","creative","paid","social","display","email"]): cat = "marketing"
-                elif any(x in txt for x in ["lcp","fid","cls","perf","web","latency","page"]): cat = "performance"
-                elif any(x in txt for x in ["checkout","payment","decline","gateway","failure"]): cat = "checkout"
-                elif any(x in txt for x in ["search","zero result","query"]): cat = "search"
-                elif any(x in txt for x in ["return","rma"]): cat = "returns"
-                elif any(x in txt for x in ["sku","inventory","merch","pdp","plp"]): cat = "merch"
-                return {
-                    "title": i.get("title",""),
-                    "why": i.get("why",""),
-                    "category": cat,
-                    "evidence": i.get("evidence") or {}
-                }
-            
-            short_items = [extract(short_prior[0] if len(short_prior)>0 else None), extract(short_prior[1] if len(short_prior)>1 else None), extract(short_prior[2] if len(short_prior)>2 else None)]
-            
-            cur.execute(
-                """
-                INSERT INTO analysis_runs(role, summary,
-                  issue1_title, issue1_why, issue1_category, issue1_evidence_json,
-                  issue2_title, issue2_why, issue2_category, issue2_evidence_json,
-                  issue3_title, issue3_why, issue3_category, issue3_evidence_json,
-                  analysis_json)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    role_name, short_term_analysis.get("summary",""),
-                    short_items[0]["title"], short_items[0]["why"], short_items[0]["category"], json.dumps(short_items[0]["evidence"], ensure_ascii=False),
-                    short_items[1]["title"], short_items[1]["why"], short_items[1]["category"], json.dumps(short_items[1]["evidence"], ensure_ascii=False),
-                    short_items[2]["title"], short_items[2]["why"], short_items[2]["category"], json.dumps(short_items[2]["evidence"], ensure_ascii=False),
-                    json.dumps(analysis, ensure_ascii=False)
-                )
-            )
-            conn.commit()
-            conn.close()
-            
-            # Get the created timestamp for the new analysis
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute("SELECT created_ts FROM analysis_runs WHERE role = ? ORDER BY created_ts DESC LIMIT 1", (role_name,))
-            row = cur.fetchone()
-            conn.close()
-            analysis["created_ts"] = row["created_ts"] if row else None
+            analysis["created_ts"] = _save_analysis_run(role_name, short_term_analysis, analysis)
             
     except Exception as e:
         analysis_error = str(e)
@@ -415,7 +401,7 @@ def api_custom_role_analysis_latest():
     
     # Prefer the full saved JSON if present; fallback to columns
     try:
-        analysis = json.loads(row["analysis_json"]) if row["analysis_json"] else None
+        analysis = orjson.loads(row["analysis_json"]) if row["analysis_json"] else None
     except Exception:
         analysis = None
     
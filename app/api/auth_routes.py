@@ -4,9 +4,10 @@ Authentication API routes.
 This module contains Flask Blueprint for authentication-related API endpoints.
 """
 
-from flask import Blueprint, request, jsonify, session, redirect, send_from_directory
+from flask import Blueprint, Response, request, jsonify, session, redirect
 from app.auth import login_user, logout_user
 from pathlib import Path
+import hashlib
 
 # Define STATIC_DIR here since it's not available in app.database
 APP_ROOT = Path(__file__).parent.parent.parent.resolve()
@@ -14,11 +15,51 @@ STATIC_DIR = APP_ROOT / "static"
 
 auth_bp = Blueprint('auth', __name__)
 
+# Public pages may be reused by the browser for a while; dashboard pages
+# depend on the session, so they are always revalidated (cheap 304s)
+PUBLIC_PAGE_CACHE_CONTROL = "public, max-age=300"
+SESSION_PAGE_CACHE_CONTROL = "private, no-cache"
+
+
+def _load_static_html() -> dict:
+    """
+    Read the HTML shell pages once so they are served without disk IO.
+    
+    Returns:
+        dict: Mapping of file name to (body bytes, ETag) tuples
+    """
+    pages = {}
+    for name in ("index.html", "dashboard.html", "register.html"):
+        body = (STATIC_DIR / name).read_bytes()
+        pages[name] = (body, hashlib.sha1(body).hexdigest())
+    return pages
+
+
+_STATIC_HTML = _load_static_html()
+
+
+def _html_page(name: str, cache_control: str):
+    """
+    Serve a cached HTML page with an ETag, answering 304 when it matches.
+    
+    Args:
+        name (str): File name of the page in the static directory
+        cache_control (str): Cache-Control header value
+        
+    Returns:
+        Response: The page or an empty 304 response
+    """
+    body, etag = _STATIC_HTML[name]
+    response = Response(body, mimetype="text/html")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    return response.make_conditional(request)
+
 
 @auth_bp.route("/")
 def index():
     """Serve the main index page."""
-    return send_from_directory(str(STATIC_DIR), "index.html")
+    return _html_page("index.html", PUBLIC_PAGE_CACHE_CONTROL)
 
 
 @auth_bp.route("/dashboard")
@@ -26,13 +67,13 @@ def dashboard_page():
     """Serve the dashboard page if user is authenticated."""
     if "role" not in session:
         return redirect("/")
-    return send_from_directory(str(STATIC_DIR), "dashboard.html")
+    return _html_page("dashboard.html", SESSION_PAGE_CACHE_CONTROL)
 
 
 @auth_bp.route("/register")
 def register_page():
     """Serve the registration page."""
-    return send_from_directory(str(STATIC_DIR), "register.html")
+    return _html_page("register.html", PUBLIC_PAGE_CACHE_CONTROL)
 
 
 @auth_bp.route("/dashboard/<role_name>")
@@ -40,7 +81,7 @@ def custom_dashboard_page(role_name):
     """Serve a generic dashboard for custom roles."""
     # Set the session role for custom roles
     session["role"] = role_name
-    return send_from_directory(str(STATIC_DIR), "dashboard.html")
+    return _html_page("dashboard.html", SESSION_PAGE_CACHE_CONTROL)
 
 
 @auth_bp.route("/login", methods=["POST"]) 
@@ -63,9 +104,3 @@ def logout():
     """Handle user logout by clearing the session."""
     result = logout_user()
     return jsonify(result)
-
-
-@auth_bp.route('/static/<path:path>')
-def send_static(path):
-    """Serve static files."""
-    return send_from_directory(str(STATIC_DIR), path)
@@ -0,0 +1,19 @@
+"""
+URL converters for the API routes.
+
+Registered on the app in create_app(), before the blueprints, so route
+rules can use them.
+"""
+
+from werkzeug.routing import BaseConverter
+
+
+class ActionIdConverter(BaseConverter):
+    """
+    Match action IDs as generated by app.ids.new_action_id() ("action_<uuid>").
+
+    Malformed IDs fail to route (404) without touching the database. The
+    value is passed through as the same string stored in the action tables.
+    """
+
+    regex = r"action_[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
@@ -4,23 +4,254 @@ Custom role API routes.
 This module contains Flask Blueprint for custom role management API endpoints.
 """
 
-from flask import Blueprint, request, jsonify, session
-from app.models import CustomRoleManager
-from services.gemini_service import _generate_json_from_model, generate_chart_insights
+from flask import Blueprint, Response, request, jsonify, session
+from app.models import CustomRoleManager, json_file_exists, load_json_cached, read_json_file, write_json_file
+from app.database import get_db_connection, open_role_db, open_untrusted_db, set_query_timeout, rows_to_dicts, count_table_rows, estimate_table_rows, table_columns, quote_identifier, infer_column_type
+from app.database.role_db_schema import ensure_role_db_schema
+from services.gemini_service import _generate_json_from_model, generate_chart_insights, stream_chart_insights
+import hashlib
 import sqlite3
-import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import LRUCache
+import orjson
 import logging
 from pathlib import Path
 
 custom_role_bp = Blueprint('custom_role', __name__)
 
+# Seconds a model-generated chart query may run while being validated
+SQL_VALIDATION_TIMEOUT = 10
+
+# Validated chart-generation responses, keyed by a hash of role, request text
+# and schema, are reused for this many seconds
+CHART_PROMPT_CACHE_TTL = 24 * 3600
+_chart_cache_ready = False
+
+# Introspected schema per role database and kind of view, with the version
+# of the database it was built from
+_SCHEMA_CACHE = {}
+
+
+def _role_db_version(cur, role_db: Path) -> tuple:
+    """
+    Get a version stamp for a role database's schema and contents.
+    
+    PRAGMA schema_version changes with every schema change. Row counts and
+    sample rows also depend on the data, and re-importing into existing
+    tables leaves schema_version alone, so the mtimes of the database and
+    its WAL file are part of the stamp as well.
+    
+    Args:
+        cur (sqlite3.Cursor): Cursor on the role database
+        role_db (Path): Path to the role's .db file
+        
+    Returns:
+        tuple: (schema_version, db mtime, WAL mtime)
+    """
+    version = [cur.execute("PRAGMA schema_version").fetchone()[0]]
+    for path in (role_db, role_db.with_name(role_db.name + "-wal")):
+        try:
+            version.append(path.stat().st_mtime_ns)
+        except FileNotFoundError:
+            version.append(0)
+    return tuple(version)
+
+
+def _cached_schema_info(cur, role_db: Path, kind, build):
+    """
+    Return introspected schema info, rebuilding it only when the DB changed.
+    
+    Args:
+        cur (sqlite3.Cursor): Cursor on the role database
+        role_db (Path): Path to the role's .db file
+        kind: Hashable tag for the view being built (one entry is kept per kind)
+        build: Zero-argument callable doing the introspection and anything
+            derived from it
+        
+    Returns:
+        Whatever build returned, shared between requests and not to be modified
+    """
+    version = _role_db_version(cur, role_db)
+    key = (str(role_db), kind)
+    cached = _SCHEMA_CACHE.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+    schema_info = build()
+    _SCHEMA_CACHE[key] = (version, schema_info)
+    return schema_info
+
+
+# Rows returned by plan chart queries, keyed by role database, its version
+# stamp and the query text, so dashboard reloads skip re-running unchanged
+# aggregates
+CHART_RESULT_CACHE_SIZE = 256
+_chart_results = LRUCache(maxsize=CHART_RESULT_CACHE_SIZE)
+_chart_results_lock = threading.Lock()
+
+
+def _chart_query_rows(cur, role_db: Path, version: tuple, sql: str) -> list:
+    """
+    Run a plan chart query, reusing the rows from an earlier identical run.
+    
+    Args:
+        cur (sqlite3.Cursor): Cursor on the role database
+        role_db (Path): Path to the role's .db file
+        version (tuple): Version stamp from _role_db_version()
+        sql (str): Chart query
+        
+    Returns:
+        list: Result rows as dictionaries, shared between requests and not
+        to be modified
+    """
+    key = (str(role_db), version, sql)
+    with _chart_results_lock:
+        rows = _chart_results.get(key)
+    if rows is None:
+        cur.execute(sql)
+        rows = rows_to_dicts(cur)
+        with _chart_results_lock:
+            _chart_results[key] = rows
+    return rows
+
+
+def _chart_cache_connection():
+    """Open the shared DB, creating the chart prompt cache table on first use."""
+    global _chart_cache_ready
+    conn = get_db_connection()
+    if not _chart_cache_ready:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS gemini_chart_cache (
+                key TEXT PRIMARY KEY,
+                result_json TEXT NOT NULL,
+                ts INTEGER NOT NULL
+            )
+        """)
+        conn.commit()
+        _chart_cache_ready = True
+    return conn
+
+
+def _get_cached_chart_response(key: str):
+    """
+    Look up a cached chart-generation response.
+    
+    Args:
+        key (str): Hash of the full chart-generation prompt
+        
+    Returns:
+        dict or None: The cached model response if present and not expired
+    """
+    conn = _chart_cache_connection()
+    try:
+        row = conn.execute(
+            "SELECT result_json FROM gemini_chart_cache WHERE key = ? AND ts >= ?",
+            (key, int(time.time()) - CHART_PROMPT_CACHE_TTL),
+        ).fetchone()
+    finally:
+        conn.close()
+    return orjson.loads(row[0]) if row else None
+
+
+def _store_chart_response(key: str, response: dict):
+    """
+    Cache a chart-generation response whose SQL passed validation.
+    
+    Expired entries are purged at the same time.
+    
+    Args:
+        key (str): Hash of the full chart-generation prompt
+        response (dict): Model response to cache
+    """
+    now = int(time.time())
+    conn = _chart_cache_connection()
+    try:
+        conn.execute("DELETE FROM gemini_chart_cache WHERE ts < ?", (now - CHART_PROMPT_CACHE_TTL,))
+        conn.execute(
+            "INSERT OR REPLACE INTO gemini_chart_cache (key, result_json, ts) VALUES (?, ?, ?)",
+            (key, orjson.dumps(response).decode(), now),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# Role-independent part of the chart-generation prompt. It is kept as a
+# constant prefix so that Gemini can serve it from its context cache.
+CHART_SQL_INSTRUCTIONS = """You are an expert data analyst and SQL developer working on a dashboard for the role given below.
+
+INSTRUCTIONS:
+1. Analyze the user's request carefully in the context of the role
+2. If editing an existing chart, understand what changes they want to make
+3. Review the sample data to understand the actual values and data types
+4. Generate a SQL query that:
+   - Uses only the available tables and columns shown below
+   - Returns data suitable for visualization
+   - Includes appropriate aggregations (GROUP BY, SUM, COUNT, AVG, etc.)
+   - For time-series: Orders by date/time column
+   - For comparisons: Groups by category with aggregated metrics
+   - For distributions: Shows breakdown across dimensions
+   - Limits results to reasonable size (e.g., TOP 10 categories if many exist)
+5. Consider what visualization type would work best:
+   - LINE CHART: Time-based trends (requires date column + metric)
+   - BAR CHART: Comparisons across categories (requires category + metric)
+   - PIE CHART: Distribution/breakdown (requires category + percentage/count)
+   - TABLE: Detailed records with multiple columns
+
+RETURN FORMAT:
+Return a JSON object with exactly these fields:
+{
+  "sql_query": "SELECT ... FROM ... WHERE ... GROUP BY ... ORDER BY ...",
+  "suggested_chart_type": "line|bar|pie|table",
+  "chart_title": "Clear, descriptive title for the visualization",
+  "reasoning": "Brief explanation of your approach"
+}
+
+Remember: The SQL must be valid SQLite syntax and return meaningful, aggregated data for visualization."""
+
+# Runs chart insight generation alongside the rest of create_visualization
+_insights_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="chart-insights")
+
+# Background new-role analysis jobs, polled via /api/new_role/analyze_status.
+# Job state lives in this process's memory: the app is served by a single
+# process (app.run), so the start and status requests always reach the same
+# registry. Running several worker processes would need the state moved to
+# cfc.db, or status polls could land on a worker that never saw the job.
+_analysis_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="role-analysis")
+_analysis_jobs = {}
+_analysis_jobs_lock = threading.Lock()
+# Finished jobs are forgotten after this many seconds
+ANALYSIS_JOB_TTL = 3600
+
+# Serialized /api/custom_roles body, keyed on the custom_roles directory mtime
+# (role configs are only added or rewritten via CustomRoleManager, which bumps it)
+_ROLE_LIST_CACHE = {"entry": None}
+
 
 @custom_role_bp.route("/api/custom_roles")
 def api_custom_roles():
     """List all available custom roles for the homepage."""
     manager = CustomRoleManager()
-    custom_roles = manager.get_custom_roles()
-    return jsonify({"custom_roles": custom_roles})
+    try:
+        mtime_ns = manager.custom_dir.stat().st_mtime_ns
+    except FileNotFoundError:
+        mtime_ns = 0
+    
+    entry = _ROLE_LIST_CACHE["entry"]
+    if entry is None or entry[0] != mtime_ns:
+        custom_roles = manager.get_custom_roles()
+        entry = (mtime_ns, orjson.dumps({"custom_roles": custom_roles}))
+        _ROLE_LIST_CACHE["entry"] = entry
+    
+    response = Response(entry[1], mimetype="application/json")
+    response.set_etag(str(mtime_ns))
+    if mtime_ns:
+        response.last_modified = mtime_ns / 1e9
+    # Let browsers keep the list but revalidate it (304) on every load
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
 @custom_role_bp.route("/api/new_role/create", methods=["POST"])
@@ -59,15 +290,60 @@ def api_new_role_import():
         return jsonify({"ok": False, "error": f"A critical server error occurred: {str(e)}"}), 500
 
 
+def _run_analysis_job(job_id: str, role_name: str):
+    """
+    Run a role analysis in the background and record its outcome.
+    
+    Args:
+        job_id (str): Key of the job in _analysis_jobs
+        role_name (str): The role to analyze
+    """
+    try:
+        result = CustomRoleManager().analyze_role(role_name)
+        job = {"status": "done", "result": result}
+    except Exception as e:
+        logging.error(f"Background analysis failed for role {role_name}: {e}", exc_info=True)
+        job = {"status": "error", "result": {"ok": False, "error": str(e)}}
+    job["finished_at"] = time.time()
+    with _analysis_jobs_lock:
+        _analysis_jobs[job_id] = job
+
+
 @custom_role_bp.route("/api/new_role/analyze", methods=["POST"])
 def api_new_role_analyze():
-    """Analyze a custom role's data and generate KPIs and visualizations."""
+    """
+    Start analyzing a custom role's data to generate KPIs and visualizations.
+    
+    The analysis (several Gemini calls plus chart queries) runs in the
+    background; poll /api/new_role/analyze_status with the returned job_id.
+    """
     payload = request.get_json(force=True)
     role_name = (payload.get("role_name") or "").strip()
+    if not role_name:
+        return jsonify({"ok": False, "error": "Missing role_name"}), 400
     
-    manager = CustomRoleManager()
-    result = manager.analyze_role(role_name)
-    return jsonify(result)
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with _analysis_jobs_lock:
+        # Drop results nobody collected
+        for stale in [k for k, j in _analysis_jobs.items() if now - j.get("finished_at", now) > ANALYSIS_JOB_TTL]:
+            del _analysis_jobs[stale]
+        _analysis_jobs[job_id] = {"status": "running"}
+    _analysis_executor.submit(_run_analysis_job, job_id, role_name)
+    return jsonify({"ok": True, "job_id": job_id, "status": "running"}), 202
+
+
+@custom_role_bp.route("/api/new_role/analyze_status")
+def api_new_role_analyze_status():
+    """Report the status of a background role analysis, with its result once finished."""
+    job_id = request.args.get("job_id", "")
+    with _analysis_jobs_lock:
+        job = _analysis_jobs.get(job_id)
+    if job is None:
+        return jsonify({"ok": False, "error": "Unknown job_id"}), 404
+    if job["status"] == "running":
+        return jsonify({"ok": True, "status": "running"})
+    return jsonify({**job["result"], "status": job["status"]})
 
 
 @custom_role_bp.route("/api/new_role/finalize", methods=["POST"])
@@ -101,44 +377,38 @@ def api_custom_role_schema():
         return jsonify({"ok": False, "error": "Role DB not found"}), 404
     
     try:
-        import sqlite3
-        import json
-        from app.database import infer_column_type
-        from pathlib import Path
-
-        conn = sqlite3.connect(str(role_db))
-        conn.row_factory = sqlite3.Row
+        conn = open_role_db(role_db)
         cur = conn.cursor()
         
-        schema_info = {}
-        for table in tables:
-            cur.execute(f"PRAGMA table_info('{table}')")
-            columns = []
-            for row in cur.fetchall():
-                column_name = row[1]
-                sqlite_type = row[2]
+        def build_schema_info():
+            row_counts = count_table_rows(cur, tables)
+            columns_by_table = table_columns(cur, tables)
+            schema_info = {}
+            for table in tables:
+                columns = []
+                for row in columns_by_table[table]:
+                    column_name = row[1]
+                    sqlite_type = row[2]
                 
-                # Infer actual data type from column name and sample data
-                inferred_type = infer_column_type(column_name, sqlite_type, table, cur)
+                    # Infer actual data type from column name and sample data
+                    inferred_type = infer_column_type(column_name, sqlite_type, table, cur)
                 
-                columns.append({
-                    "name": column_name,
-                    "type": sqlite_type,
-                    "inferred_type": inferred_type,
-                    "nullable": not row[3],
-                    "default": row[4],
-                    "primary_key": bool(row[5])
-                })
+                    columns.append({
+                        "name": column_name,
+                        "type": sqlite_type,
+                        "inferred_type": inferred_type,
+                        "nullable": not row[3],
+                        "default": row[4],
+                        "primary_key": bool(row[5])
+                    })
             
-            # Get row count
-            cur.execute(f"SELECT COUNT(1) as cnt FROM '{table}'")
-            row_count = cur.fetchone()["cnt"]
-            
-            schema_info[table] = {
-                "columns": columns,
-                "row_count": row_count
-            }
+                schema_info[table] = {
+                    "columns": columns,
+                    "row_count": row_counts[table]
+                }
+            return schema_info
         
+        schema_info = _cached_schema_info(cur, role_db, ("schema", tuple(tables)), build_schema_info)
         conn.close()
         return jsonify({"ok": True, "schema": schema_info})
         
@@ -159,33 +429,36 @@ def api_custom_role_metrics():
         return jsonify({"error": "Role DB not found"}), 404
     
     # Build a lightweight metrics dict based on plan-generated SQL if present; otherwise row counts only
-    import re
-    from datetime import datetime, timedelta
-
     APP_ROOT = Path(__file__).parent.parent.parent.resolve()
     CUSTOM_DIR = APP_ROOT / "custom_roles"
     plan_path = CUSTOM_DIR / f"{role_name.replace(' ','_')}.plan.json"
     metrics = {}
     
-    conn = sqlite3.connect(str(role_db))
-    conn.row_factory = sqlite3.Row
+    # Private read-only connection, so plan SQL written by the model can
+    # neither modify the data nor leave state on a pooled connection
+    conn = open_untrusted_db(role_db)
     cur = conn.cursor()
+    # Run every KPI, chart and count query below in one read transaction
+    # instead of taking and releasing the shared lock per statement.
+    conn.execute("BEGIN")
     
-    if plan_path.exists():
+    # Parsed once (from the mtime-keyed cache) and reused for the response
+    plan = None
+    if json_file_exists(plan_path):
+        try:
+            plan = load_json_cached(plan_path)
+        except Exception:
+            pass
+    
+    if plan is not None:
         try:
-            plan = json.loads(plan_path.read_text())
-            
             # Execute KPI calculations with change percentage
             kpis = plan.get("kpis") or []
             
             # Helper functions for change calculation
-            def extract_table(sql: str) -> str:
-                m = re.search(r"FROM\s+`?\"?([a-zA-Z0-9_]+)`?\"?", sql, re.IGNORECASE)
-                return m.group(1) if m else ""
-            
             def pick_date_column(table: str) -> str:
                 try:
-                    cur.execute(f'PRAGMA table_info("{table}")')
+                    cur.execute("SELECT * FROM pragma_table_info(?)", (table,))
                     cols = [r[1] for r in cur.fetchall()]
                 except Exception:
                     cols = []
@@ -202,24 +475,6 @@ def api_custom_role_metrics():
                         return c
                 return ""
             
-            def add_time_window(sql: str, table: str, date_col: str, start_iso: str, end_iso: str) -> str:
-                if not table or not date_col:
-                    return ""
-                # Normalize SQL spacing
-                s = sql.strip()
-                has_where = re.search(r"\bWHERE\b", s, re.IGNORECASE) is not None
-                clause = f"{date_col} BETWEEN date('{start_iso}') AND date('{end_iso}')"
-                if has_where:
-                    return re.sub(r"\bWHERE\b", lambda m: m.group(0) + " " + clause + " AND ", s, count=1, flags=re.IGNORECASE)
-                else:
-                    return re.sub(r"\bFROM\s+`?\"?" + re.escape(table) + r"`?\"?", lambda m: m.group(0) + f" WHERE {clause}", s, count=1, flags=re.IGNORECASE)
-
-            end_curr = datetime.utcnow().date()
-            start_curr = end_curr - timedelta(days=30)
-            end_prev = start_curr - timedelta(days=1)
-            start_prev = end_prev - timedelta(days=30)
-            fmt = lambda d: d.isoformat()
-
             for kpi in kpis:
                 formula = kpi.get("formula")
                 kpi_id = kpi.get("id") or kpi.get("title", "kpi").lower().replace(" ", "_")
@@ -259,72 +514,53 @@ def api_custom_role_metrics():
             
             # Execute chart queries
             charts = plan.get("charts") or []
+            db_version = _role_db_version(cur, role_db)
             for ch in charts:
                 q = ch.get("query_sql")
-                chart_id = (ch.get("id") or ch.get("title") or "chart").lower().replace(" ", "_")
                 # Remove existing chart_ prefix if present to avoid double prefixing
-                if chart_id.startswith("chart_"):
-                    chart_id = chart_id[6:]  # Remove "chart_" prefix
+                chart_id = (ch.get("id") or ch.get("title") or "chart").lower().replace(" ", "_").removeprefix("chart_")
                 if not q:
                     continue
                 try:
-                    cur.execute(q)
-                    metrics[f"chart_{chart_id}"] = [dict(r) for r in cur.fetchall()]
+                    metrics[f"chart_{chart_id}"] = _chart_query_rows(cur, role_db, db_version, q)
                 except Exception:
                     # Skip invalid queries
                     continue
         except Exception:
             pass
     
-    # Always include table rowcounts
+    # Always include table rowcounts (counted once, also used for total_records below)
     cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
     tables = [r[0] for r in cur.fetchall()]
+    try:
+        row_counts = count_table_rows(cur, tables, from_sqlite_master=True)
+    except Exception:
+        row_counts = None
     # Filter out system tables that are not user data
     tables_to_count = [
         t for t in tables 
-        if t not in ['priority_insights', 'actions', 'chart_insights', 'analysis_runs', 'saved_analyses']
+        if t not in ['priority_insights', 'actions', 'chart_insights', 'analysis_runs', 'saved_analyses', 'ai_conversations']
     ]
     for t in tables_to_count:
-        try:
-            cur.execute(f"SELECT COUNT(1) as cnt FROM '{t}'")
-            row = cur.fetchone()
-            metrics[f"{t}_rowcount"] = row["cnt"] if row else 0
-        except Exception:
-            pass
+        if row_counts and t in row_counts:
+            metrics[f"{t}_rowcount"] = row_counts[t]
+    conn.rollback()
     conn.close()
     
     # Include plan data in response so frontend can access chart types
-    plan_data = None
-    if plan_path.exists():
-        try:
-            plan_data = json.loads(plan_path.read_text())
-        except Exception:
-            pass
+    plan_data = plan
     
     # Get role metadata (creation date and total records)
     config_path = CUSTOM_DIR / f"{role_name.replace(' ','_')}.json"
     role_metadata = {}
-    if config_path.exists():
+    if json_file_exists(config_path):
         try:
-            config = json.loads(config_path.read_text())
+            config = load_json_cached(config_path)
             
-            # Calculate actual total records from database
-            actual_total_records = 0
-            try:
-                conn = sqlite3.connect(str(role_db))
-                conn.row_factory = sqlite3.Row
-                cur = conn.cursor()
-                
-                # Get all tables and count their records
-                cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
-                tables = [r[0] for r in cur.fetchall()]
-                
-                for table in tables:
-                    cur.execute(f"SELECT COUNT(1) as cnt FROM '{table}'")
-                    actual_total_records += cur.fetchone()["cnt"]
-                
-                conn.close()
-            except Exception:
+            # Actual total records across all tables, from the counts above
+            if row_counts is not None:
+                actual_total_records = sum(row_counts.values())
+            else:
                 # Fallback to config value if database query fails
                 actual_total_records = config.get("total_records", 0)
             
@@ -363,13 +599,17 @@ def api_custom_role_create_visualization():
     CUSTOM_DIR = APP_ROOT / "custom_roles"
     plan_path = CUSTOM_DIR / f"{role_name.replace(' ','_')}.plan.json"
     
-    if not plan_path.exists():
+    if not json_file_exists(plan_path):
         return jsonify({"ok": False, "error": "Role plan not found"}), 404
     
     try:
         # Load existing plan
-        plan = json.loads(plan_path.read_text())
+        plan = read_json_file(plan_path)
         charts = plan.get("charts", [])
+        # Position of each chart by id, for the edit lookup and replacement below
+        chart_index = {}
+        for i, c in enumerate(charts):
+            chart_index.setdefault(str(c.get("id")), i)
         
         # Generate SQL query using Gemini
         manager = CustomRoleManager()
@@ -378,44 +618,63 @@ def api_custom_role_create_visualization():
             return jsonify({"ok": False, "error": "Role database not found"}), 404
         
         # Get schema information for context
-        conn = sqlite3.connect(str(role_db))
-        conn.row_factory = sqlite3.Row
+        conn = open_role_db(role_db)
         cur = conn.cursor()
         
         # Get table schemas with sample data
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' AND name NOT LIKE 'chart_%' AND name NOT LIKE 'analysis_%' AND name NOT IN ('actions', 'priority_insights', 'chart_insights', 'saved_analyses')")
+        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' AND name NOT LIKE 'chart_%' AND name NOT LIKE 'analysis_%' AND name NOT IN ('actions', 'priority_insights', 'chart_insights', 'saved_analyses', 'ai_conversations')")
         tables = [r[0] for r in cur.fetchall()]
         
-        schema_info = {}
-        for table in tables:
-            cur.execute(f"PRAGMA table_info('{table}')")
-            columns = []
-            for row in cur.fetchall():
-                columns.append({
-                    "name": row[1],
-                    "type": row[2],
-                    "nullable": not row[3]
-                })
+        def build_schema_prompt():
+            # Approximate row counts from the planner statistics and column
+            # definitions for every table, one query each
+            row_counts = estimate_table_rows(cur, tables)
+            columns_by_table = table_columns(cur, tables)
+            schema_info = {}
+            for table in tables:
+                columns = []
+                for row in columns_by_table[table]:
+                    columns.append({
+                        "name": row[1],
+                        "type": row[2],
+                        "nullable": not row[3]
+                    })
             
-            # Get sample data to help AI understand the table content
-            cur.execute(f"SELECT * FROM {table} LIMIT 3")
-            sample_rows = [dict(r) for r in cur.fetchall()]
+                # Get sample data to help AI understand the table content
+                cur.execute(f"SELECT * FROM {quote_identifier(table)} LIMIT 3")
+                sample_rows = rows_to_dicts(cur)
             
-            # Get row count
-            cur.execute(f"SELECT COUNT(*) FROM {table}")
-            row_count = cur.fetchone()[0]
+                schema_info[table] = {
+                    "columns": columns,
+                    "sample_data": sample_rows,
+                    "row_count": row_counts.get(table, 0)
+                }
             
-            schema_info[table] = {
-                "columns": columns,
-                "sample_data": sample_rows,
-                "row_count": row_count
+            # Render the schema part of the prompt once per schema version:
+            # static instructions first, then the per-role schema, so repeated
+            # calls share the longest possible prompt prefix, which Gemini's
+            # implicit context cache can reuse
+            schema_json = orjson.dumps(schema_info, option=orjson.OPT_INDENT_2).decode()
+            prompt_prefix = f"""{CHART_SQL_INSTRUCTIONS}
+
+CONTEXT:
+- Role: {role_name}
+
+DATABASE SCHEMA AND SAMPLE DATA:
+{schema_json}
+"""
+            return {
+                "schema_json": schema_json,
+                "prompt_prefix": prompt_prefix,
             }
         
+        schema_prompt = _cached_schema_info(cur, role_db, "chart_prompt", build_schema_prompt)
+        
         # Get current chart context for edits
         current_chart_context = ""
         if chart_id:
             clean_chart_id = chart_id.replace("chart_", "")
-            existing_chart = next((c for c in charts if str(c.get("id")) == clean_chart_id), None)
+            existing_chart = charts[chart_index[clean_chart_id]] if clean_chart_id in chart_index else None
             if existing_chart:
                 current_chart_context = f"""
 EDITING EXISTING CHART:
@@ -436,48 +695,26 @@ User wants to modify this chart. Interpret their request as a modification to th
         
         conn.close()
         
-        # Generate SQL query using Gemini with enhanced context
-        prompt = f"""You are an expert data analyst and SQL developer working on a dashboard for a {role_name} role.
-
-CONTEXT:
-- Role: {role_name}
-- User Request: {description}
+        # Generate SQL query using Gemini with enhanced context: the cached
+        # schema prefix followed by the per-request parts
+        schema_json = schema_prompt["schema_json"]
+        prompt = schema_prompt["prompt_prefix"] + f"""{existing_charts_summary}
 {current_chart_context}
-{existing_charts_summary}
-
-DATABASE SCHEMA AND SAMPLE DATA:
-{json.dumps(schema_info, indent=2)}
-
-INSTRUCTIONS:
-1. Analyze the user's request carefully in the context of the {role_name} role
-2. If editing an existing chart, understand what changes they want to make
-3. Review the sample data to understand the actual values and data types
-4. Generate a SQL query that:
-   - Uses only the available tables and columns shown above
-   - Returns data suitable for visualization
-   - Includes appropriate aggregations (GROUP BY, SUM, COUNT, AVG, etc.)
-   - For time-series: Orders by date/time column
-   - For comparisons: Groups by category with aggregated metrics
-   - For distributions: Shows breakdown across dimensions
-   - Limits results to reasonable size (e.g., TOP 10 categories if many exist)
-5. Consider what visualization type would work best:
-   - LINE CHART: Time-based trends (requires date column + metric)
-   - BAR CHART: Comparisons across categories (requires category + metric)
-   - PIE CHART: Distribution/breakdown (requires category + percentage/count)
-   - TABLE: Detailed records with multiple columns
-
-RETURN FORMAT:
-Return a JSON object with exactly these fields:
-{{
-  "sql_query": "SELECT ... FROM ... WHERE ... GROUP BY ... ORDER BY ...",
-  "suggested_chart_type": "line|bar|pie|table",
-  "chart_title": "Clear, descriptive title for the visualization",
-  "reasoning": "Brief explanation of your approach"
-}}
-
-Remember: The SQL must be valid SQLite syntax and return meaningful, aggregated data for visualization."""
+- User Request: {description}"""
         
-        response = _generate_json_from_model(prompt, json.dumps(schema_info, indent=2))
+        # The same prompt reuses the last validated response instead of calling
+        # Gemini again. The key covers the whole prompt (role, schema, the chart
+        # being edited and the existing charts), not just the request text, so
+        # an edit of one chart never gets back the SQL generated for another.
+        prompt_key = hashlib.sha256(prompt.encode()).hexdigest()
+        try:
+            response = _get_cached_chart_response(prompt_key)
+        except sqlite3.Error as e:
+            logging.warning(f"Chart prompt cache lookup failed: {e}")
+            response = None
+        from_cache = response is not None
+        if not from_cache:
+            response = _generate_json_from_model(prompt, schema_json)
         
         # Extract SQL query and metadata from the response
         sql_query = response.get('sql_query') or response.get('query') or response.get('sql')
@@ -498,23 +735,6 @@ Remember: The SQL must be valid SQLite syntax and return meaningful, aggregated
             sql_query = sql_query[:-3]
         sql_query = sql_query.strip()
         
-        # Test the query
-        try:
-            conn = sqlite3.connect(str(role_db))
-            conn.row_factory = sqlite3.Row
-            cur = conn.cursor()
-            cur.execute(sql_query)
-            results = [dict(r) for r in cur.fetchall()]
-            conn.close()
-            
-            if not results:
-                return jsonify({"ok": False, "error": "Query returned no results"}), 400
-                
-        except Exception as e:
-            logging.error(f"SQL query error: {str(e)}")
-            logging.error(f"Failed query: {sql_query}")
-            return jsonify({"ok": False, "error": f"Invalid SQL query: {str(e)}"}), 400
-        
         # Use AI-suggested chart type, with fallback to keyword detection
         chart_type = suggested_chart_type.lower() if suggested_chart_type else "table"
         
@@ -532,16 +752,53 @@ Remember: The SQL must be valid SQLite syntax and return meaningful, aggregated
             else:
                 chart_type = "table"
         
+        # Test the query on a read-only connection with a time budget. The
+        # full result is only needed when insights are generated from it;
+        # otherwise stepping to the first row proves the query works.
+        try:
+            conn = open_untrusted_db(role_db)
+            set_query_timeout(conn, SQL_VALIDATION_TIMEOUT)
+            try:
+                cur = conn.cursor()
+                cur.execute(sql_query)
+                if generate_insights:
+                    results = rows_to_dicts(cur)
+                    has_rows = bool(results)
+                else:
+                    results = None
+                    has_rows = cur.fetchone() is not None
+            finally:
+                conn.close()
+            
+            if not has_rows:
+                return jsonify({"ok": False, "error": "Query returned no results"}), 400
+                
+        except Exception as e:
+            logging.error(f"SQL query error: {str(e)}")
+            logging.error(f"Failed query: {sql_query}")
+            return jsonify({"ok": False, "error": f"Invalid SQL query: {str(e)}"}), 400
+        
+        # Start the insights model call now so it runs while the response
+        # cache and the plan are updated
+        insights_future = None
+        if generate_insights:
+            insights_future = _insights_executor.submit(generate_chart_insights, chart_title, results, chart_type)
+        
+        if not from_cache:
+            try:
+                _store_chart_response(prompt_key, response)
+            except sqlite3.Error as e:
+                logging.warning(f"Could not cache chart response: {e}")
+        
         # Generate or update chart ID
         if chart_id:
             # Editing existing chart - keep the same ID
             clean_chart_id = chart_id.replace("chart_", "")
         else:
             # Creating new chart - generate new ID
-            existing_ids = [str(c.get("id")) for c in charts]
             # Try to use a numeric ID
             next_id = 1
-            while str(next_id) in existing_ids:
+            while str(next_id) in chart_index:
                 next_id += 1
             clean_chart_id = str(next_id)
         
@@ -559,9 +816,9 @@ Remember: The SQL must be valid SQLite syntax and return meaningful, aggregated
             chart_obj["ai_reasoning"] = reasoning
         
         # Update or add chart to the plan
-        if clean_chart_id in [str(c.get("id")) for c in charts]:
+        if clean_chart_id in chart_index:
             # Update existing chart
-            charts = [c if str(c.get("id")) != clean_chart_id else chart_obj for c in charts]
+            charts[chart_index[clean_chart_id]] = chart_obj
         else:
             # Add new chart
             charts.append(chart_obj)
@@ -570,41 +827,14 @@ Remember: The SQL must be valid SQLite syntax and return meaningful, aggregated
         plan["charts"] = charts
         
         # Save updated plan
-        plan_path.write_text(json.dumps(plan, ensure_ascii=False, indent=2))
+        write_json_file(plan_path, plan)
         
         # Generate insights if requested
-        if generate_insights:
+        if insights_future is not None:
             try:
-                insights = generate_chart_insights(chart_title, results, chart_type)
+                insights = insights_future.result()
                 if insights:
-                    # Store insights in database
-                    conn = sqlite3.connect(str(role_db))
-                    cur = conn.cursor()
-                    
-                    # Create insights table if it doesn't exist
-                    cur.execute("""
-                        CREATE TABLE IF NOT EXISTS chart_insights (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            chart_id TEXT NOT NULL UNIQUE,
-                            chart_title TEXT NOT NULL,
-                            insights_json TEXT NOT NULL,
-                            created_at TEXT NOT NULL DEFAULT (datetime('now')),
-                            updated_at TEXT NOT NULL DEFAULT (datetime('now'))
-                        )
-                    """)
-                    
-                    # Insert or update insights (using clean_chart_id and chart_title)
-                    cur.execute("""
-                        INSERT INTO chart_insights (chart_id, chart_title, insights_json, updated_at)
-                        VALUES (?, ?, ?, datetime('now'))
-                        ON CONFLICT(chart_id) DO UPDATE SET
-                            chart_title = excluded.chart_title,
-                            insights_json = excluded.insights_json,
-                            updated_at = excluded.updated_at;
-                    """, (clean_chart_id, chart_title, json.dumps(insights)))
-                    
-                    conn.commit()
-                    conn.close()
+                    _save_chart_insights(role_db, clean_chart_id, chart_title, insights)
             except Exception as e:
                 logging.warning(f"Failed to generate insights: {e}")
         
@@ -644,26 +874,25 @@ def api_custom_role_delete_chart(role_name_from_path=None, chart_id_from_path=No
     APP_ROOT = Path(__file__).parent.parent.parent.resolve()
     CUSTOM_DIR = APP_ROOT / "custom_roles"
     plan_path = CUSTOM_DIR / f"{role_name.replace(' ','_')}.plan.json"
-    if not plan_path.exists():
+    if not json_file_exists(plan_path):
         return jsonify({"ok": False, "error": "Role plan not found"}), 404
     
     try:
         # Load existing plan
-        plan = json.loads(plan_path.read_text())
+        plan = read_json_file(plan_path)
         charts = plan.get("charts", [])
         
-        # Find and remove the chart
-        original_count = len(charts)
-        charts = [chart for chart in charts if chart.get("id") != chart_id]
-        
-        if len(charts) == original_count:
+        # Find and remove the chart in place
+        index = next((i for i, chart in enumerate(charts) if chart.get("id") == chart_id), None)
+        if index is None:
             return jsonify({"ok": False, "error": "Chart not found"}), 404
+        del charts[index]
         
         # Update the plan
         plan["charts"] = charts
         
         # Save updated plan
-        plan_path.write_text(json.dumps(plan, ensure_ascii=False, indent=2))
+        write_json_file(plan_path, plan)
         
         return jsonify({"ok": True, "message": "Chart deleted successfully"})
         
@@ -680,8 +909,7 @@ def api_get_chart_insights(role_name, chart_id):
         if not role_db.exists():
             return jsonify({"ok": False, "error": "Role database not found"}), 404
         
-        conn = sqlite3.connect(str(role_db))
-        conn.row_factory = sqlite3.Row
+        conn = open_role_db(role_db)
         cur = conn.cursor()
         
         # Get latest insights for this chart
@@ -699,7 +927,7 @@ def api_get_chart_insights(role_name, chart_id):
         if not result:
             return jsonify({"ok": False, "error": "No insights found for this chart"}), 404
         
-        insights = json.loads(result["insights_json"])
+        insights = orjson.loads(result["insights_json"])
         
         return jsonify({
             "ok": True,
@@ -713,9 +941,34 @@ def api_get_chart_insights(role_name, chart_id):
         return jsonify({"ok": False, "error": f"Failed to fetch insights: {str(e)}"}), 500
 
 
+def _save_chart_insights(role_db: Path, chart_id: str, chart_title: str, insights):
+    """Insert or update the stored insights for a chart, in one transaction."""
+    ensure_role_db_schema(role_db)
+    conn = open_role_db(role_db)
+    try:
+        with conn:
+            conn.execute("""
+                INSERT INTO chart_insights (chart_id, chart_title, insights_json, updated_at)
+                VALUES (?, ?, ?, datetime('now'))
+                ON CONFLICT(chart_id) DO UPDATE SET
+                    chart_title = excluded.chart_title,
+                    insights_json = excluded.insights_json,
+                    updated_at = excluded.updated_at;
+            """, (chart_id, chart_title, orjson.dumps(insights).decode()))
+    finally:
+        conn.close()
+
+
 @custom_role_bp.route("/api/chart/insights", methods=["POST"])
 def api_generate_chart_insights():
-    """Generate and save new insights for a chart."""
+    """
+    Generate and save new insights for a chart.
+    
+    Clients that send ``Accept: application/x-ndjson`` get the insights
+    streamed as they are generated: one ``{"insight": ...}`` line each,
+    followed by a final ``{"ok": ..., "insights": [...]}`` line once they
+    have been saved (or ``{"ok": false, "error": ...}``).
+    """
     try:
         payload = request.get_json(force=True)
         chart_title = payload.get("chart_title")
@@ -727,44 +980,33 @@ def api_generate_chart_insights():
         if not all([chart_title, chart_data, chart_type, role_name, chart_id]):
             return jsonify({"ok": False, "error": "Missing required payload fields"}), 400
 
-        # Generate insights using Gemini
-        insights = generate_chart_insights(chart_data, chart_title, chart_type)
-        if not insights:
-            return jsonify({"ok": False, "error": "Failed to generate insights from the model"}), 500
-
-        # Save insights to the role's database
         manager = CustomRoleManager()
         role_db = manager.get_role_db_path(role_name)
         if not role_db.exists():
             return jsonify({"ok": False, "error": "Role database not found"}), 404
 
-        conn = sqlite3.connect(str(role_db))
-        cur = conn.cursor()
-        
-        # Ensure the table exists
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS chart_insights (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chart_id TEXT NOT NULL UNIQUE,
-                chart_title TEXT NOT NULL,
-                insights_json TEXT NOT NULL,
-                created_at TEXT NOT NULL DEFAULT (datetime('now')),
-                updated_at TEXT NOT NULL DEFAULT (datetime('now'))
-            )
-        """)
+        if request.accept_mimetypes.best == "application/x-ndjson":
+            def stream():
+                insights = []
+                try:
+                    for insight in stream_chart_insights(chart_title, chart_data, chart_type):
+                        insights.append(insight)
+                        yield orjson.dumps({"insight": insight}) + b"\n"
+                    _save_chart_insights(role_db, chart_id, chart_title, insights)
+                    yield orjson.dumps({"ok": True, "insights": insights}) + b"\n"
+                except Exception as e:
+                    logging.error(f"Error streaming chart insights: {e}")
+                    yield orjson.dumps({"ok": False, "error": f"Failed to generate insights: {str(e)}"}) + b"\n"
+            
+            return Response(stream(), mimetype="application/x-ndjson")
 
-        # Insert or update insights for the chart
-        cur.execute("""
-            INSERT INTO chart_insights (chart_id, chart_title, insights_json, updated_at)
-            VALUES (?, ?, ?, datetime('now'))
-            ON CONFLICT(chart_id) DO UPDATE SET
-                chart_title = excluded.chart_title,
-                insights_json = excluded.insights_json,
-                updated_at = excluded.updated_at;
-        """, (chart_id, chart_title, json.dumps(insights)))
-        
-        conn.commit()
-        conn.close()
+        # Generate insights using Gemini
+        insights = generate_chart_insights(chart_title, chart_data, chart_type)
+        if not insights:
+            return jsonify({"ok": False, "error": "Failed to generate insights from the model"}), 500
+
+        # Save insights to the role's database
+        _save_chart_insights(role_db, chart_id, chart_title, insights)
 
         return jsonify({"ok": True, "insights": insights})
 
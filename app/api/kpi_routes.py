@@ -8,15 +8,28 @@ Handles CRUD operations for KPIs including AI-assisted generation.
 import json
 import logging
 import os
-import sqlite3
+import re
 from pathlib import Path
 from flask import Blueprint, request, jsonify, session
+from app.models import json_file_exists, read_json_file, write_json_file
+from app.database import get_db_connection, open_role_db, open_untrusted_db, set_query_timeout, table_columns, DB_PATH
 from services.gemini_service import _generate_text_from_model
 
 kpi_bp = Blueprint('kpi', __name__)
 
 logger = logging.getLogger(__name__)
 
+# Seconds a user- or model-supplied KPI formula may run while being tested
+KPI_TEST_TIMEOUT = 10
+
+
+@kpi_bp.before_request
+def _require_role():
+    """Reject KPI requests without a logged-in role before they reach a handler."""
+    if "role" not in session:
+        logger.warning(f"{request.method} {request.path} - No role in session")
+        return jsonify({"error": "Unauthorized"}), 401
+
 
 def get_role_plan_path(role_name: str) -> str:
     """Get the path to the role's plan.json file."""
@@ -30,29 +43,53 @@ def get_role_db_path(role_name: str) -> Path:
     return Path('custom_roles') / f'{safe_role}.db'
 
 
+def connect_kpi_db(db_path: Path):
+    """Get a pooled connection to the shared database or a role database."""
+    if db_path.resolve() == DB_PATH:
+        return get_db_connection()
+    return open_role_db(db_path)
+
+
+def run_kpi_formula(db_path: Path, formula: str):
+    """
+    Run a KPI formula that has not been vetted yet and return its first row.
+    
+    The formula runs on a private read-only connection with a time budget, so
+    it cannot modify the data, run forever, or leave PRAGMAs and ATTACHed
+    databases behind on a pooled connection.
+    
+    Args:
+        db_path (Path): Database the formula runs against
+        formula (str): SQL to run
+        
+    Returns:
+        sqlite3.Row: The first result row, or None if there is none
+    """
+    conn = open_untrusted_db(db_path)
+    try:
+        set_query_timeout(conn, KPI_TEST_TIMEOUT)
+        return conn.execute(formula).fetchone()
+    finally:
+        conn.close()
+
+
 def load_role_plan(role_name: str) -> dict:
     """Load the role's plan from JSON file."""
     plan_path = get_role_plan_path(role_name)
-    if os.path.exists(plan_path):
-        with open(plan_path, 'r') as f:
-            return json.load(f)
+    if json_file_exists(plan_path):
+        return read_json_file(plan_path)
     return {"kpis": [], "charts": [], "insights": []}
 
 
 def save_role_plan(role_name: str, plan: dict):
     """Save the role's plan to JSON file."""
     plan_path = get_role_plan_path(role_name)
-    with open(plan_path, 'w') as f:
-        json.dump(plan, f, indent=2)
+    write_json_file(plan_path, plan)
 
 
 @kpi_bp.route("/api/kpis", methods=["GET"])
 def get_kpis():
     """Get all KPIs for the current role."""
-    if "role" not in session:
-        logger.warning("GET /api/kpis - No role in session")
-        return jsonify({"error": "Unauthorized"}), 401
-    
     role = session["role"]
     logger.info(f"GET /api/kpis - Role: {role}")
     
@@ -71,9 +108,6 @@ def get_kpis():
 @kpi_bp.route("/api/kpis/<kpi_id>", methods=["GET"])
 def get_kpi(kpi_id):
     """Get a specific KPI by ID."""
-    if "role" not in session:
-        return jsonify({"error": "Unauthorized"}), 401
-    
     role = session["role"]
     plan = load_role_plan(role)
     
@@ -87,9 +121,6 @@ def get_kpi(kpi_id):
 @kpi_bp.route("/api/kpis", methods=["POST"])
 def create_kpi():
     """Create a new KPI."""
-    if "role" not in session:
-        return jsonify({"error": "Unauthorized"}), 401
-    
     role = session["role"]
     
     # Only allow custom roles to modify KPIs
@@ -135,9 +166,6 @@ def create_kpi():
 @kpi_bp.route("/api/kpis/<kpi_id>", methods=["PUT"])
 def update_kpi(kpi_id):
     """Update an existing KPI."""
-    if "role" not in session:
-        return jsonify({"error": "Unauthorized"}), 401
-    
     role = session["role"]
     
     # Only allow custom roles to modify KPIs
@@ -175,9 +203,6 @@ def update_kpi(kpi_id):
 @kpi_bp.route("/api/kpis/<kpi_id>", methods=["DELETE"])
 def delete_kpi(kpi_id):
     """Delete a KPI."""
-    if "role" not in session:
-        return jsonify({"error": "Unauthorized"}), 401
-    
     role = session["role"]
     
     # Only allow custom roles to modify KPIs
@@ -205,9 +230,6 @@ def delete_kpi(kpi_id):
 @kpi_bp.route("/api/kpis/test", methods=["POST"])
 def test_kpi():
     """Test a KPI formula and return the result."""
-    if "role" not in session:
-        return jsonify({"error": "Unauthorized"}), 401
-    
     role = session["role"]
     data = request.get_json()
     
@@ -225,12 +247,7 @@ def test_kpi():
         return jsonify({"error": "Database not found"}), 404
     
     try:
-        conn = sqlite3.connect(str(db_path))
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        cur.execute(formula)
-        result = cur.fetchone()
-        conn.close()
+        result = run_kpi_formula(db_path, formula)
         
         if result:
             result_dict = dict(result)
@@ -250,9 +267,6 @@ def test_kpi():
 @kpi_bp.route("/api/kpis/generate", methods=["POST"])
 def generate_kpi_with_ai():
     """Generate a KPI using Gemini AI."""
-    if "role" not in session:
-        return jsonify({"error": "Unauthorized"}), 401
-    
     role = session["role"]
     data = request.get_json()
     
@@ -271,20 +285,19 @@ def generate_kpi_with_ai():
     
     try:
         # Get table schema
-        conn = sqlite3.connect(str(db_path))
-        conn.row_factory = sqlite3.Row
+        conn = connect_kpi_db(db_path)
         cur = conn.cursor()
         
         # Get all tables
         cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
         tables = [row[0] for row in cur.fetchall()]
         
-        # Get schema for each table
-        schema_info = {}
-        for table in tables:
-            cur.execute(f"PRAGMA table_info(\"{table}\")")
-            columns = cur.fetchall()
-            schema_info[table] = [{"name": col[1], "type": col[2]} for col in columns]
+        # Get schema for each table, in one query
+        columns_by_table = table_columns(cur, tables)
+        schema_info = {
+            table: [{"name": col[1], "type": col[2]} for col in columns_by_table[table]]
+            for table in tables
+        }
         
         conn.close()
         
@@ -334,18 +347,12 @@ Return ONLY the JSON object, no additional text."""
             return jsonify({"error": "AI generated incomplete KPI definition"}), 500
         
         # Test the formula
-        conn = sqlite3.connect(str(db_path))
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
         try:
-            cur.execute(kpi_definition["formula"])
-            result = cur.fetchone()
+            result = run_kpi_formula(db_path, kpi_definition["formula"])
             test_value = dict(result) if result else None
         except Exception as test_error:
             logger.warning(f"Generated KPI formula failed test: {test_error}")
             test_value = None
-        finally:
-            conn.close()
         
         return jsonify({
             "kpi": kpi_definition,
@@ -363,9 +370,6 @@ Return ONLY the JSON object, no additional text."""
 @kpi_bp.route("/api/kpis/<kpi_id>/improve", methods=["POST"])
 def improve_kpi_with_ai(kpi_id):
     """Improve an existing KPI using Gemini AI."""
-    if "role" not in session:
-        return jsonify({"error": "Unauthorized"}), 401
-    
     role = session["role"]
     data = request.get_json()
     
@@ -385,12 +389,11 @@ def improve_kpi_with_ai(kpi_id):
     
     try:
         # Get table schema
-        conn = sqlite3.connect(str(db_path))
-        conn.row_factory = sqlite3.Row
+        conn = connect_kpi_db(db_path)
         cur = conn.cursor()
         
         # Get schema for the KPI's table
-        cur.execute(f"PRAGMA table_info(\"{kpi['table']}\")")
+        cur.execute("SELECT * FROM pragma_table_info(?)", (kpi['table'],))
         columns = cur.fetchall()
         schema_info = {kpi['table']: [{"name": col[1], "type": col[2]} for col in columns]}
         
@@ -449,9 +452,6 @@ Return ONLY the JSON object, no additional text."""
 @kpi_bp.route("/api/kpis/<kpi_id>/columns", methods=["GET"])
 def get_kpi_columns(kpi_id):
     """Analyze and return the columns used in a KPI formula."""
-    if "role" not in session:
-        return jsonify({"error": "Unauthorized"}), 401
-    
     role = session["role"]
     
     # Load current KPI
@@ -462,8 +462,6 @@ def get_kpi_columns(kpi_id):
         return jsonify({"error": "KPI not found"}), 404
     
     # Parse SQL to extract columns (simple regex-based extraction)
-    import re
-    
     formula = kpi["formula"]
     
     # Extract column names from the formula (simplified approach)
@@ -4,13 +4,51 @@ Metrics API routes.
 This module contains Flask Blueprint for metrics-related API endpoints.
 """
 
-from flask import Blueprint, request, jsonify, session
-from app.models import build_metrics_for_role
-from app.database import get_db_connection
+from flask import Blueprint, Response, request, jsonify, session
+import hashlib
+import orjson
+import zlib
+from app.models import build_columnar_metrics_for_role
+from app.database import get_db_connection, rows_to_dicts
 
 metrics_bp = Blueprint('metrics', __name__)
 
 
+@metrics_bp.before_request
+def _require_role():
+    """Reject metrics requests without a logged-in role before they reach a handler."""
+    if "role" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+
+
+# Version of the last metrics build per role, reused for as long as that
+# build is served from the metrics cache
+_metrics_versions = {}
+
+
+def _metrics_version(role: str, data: dict) -> str:
+    """
+    Get a version stamp for a role's metrics.
+    
+    The stamp is a digest of the metrics themselves, so it only changes when
+    the data behind the views does. Writes to unrelated tables in cfc.db
+    (analytics actions, model response caches) leave it alone.
+    
+    Args:
+        role (str): Role the metrics were built for
+        data (dict): Result of build_columnar_metrics_for_role(role)
+        
+    Returns:
+        str: Hex digest of the metrics
+    """
+    cached = _metrics_versions.get(role)
+    if cached is not None and cached[0] is data:
+        return cached[1]
+    version = hashlib.blake2b(orjson.dumps(data, option=orjson.OPT_SORT_KEYS), digest_size=8).hexdigest()
+    _metrics_versions[role] = (data, version)
+    return version
+
+
 @metrics_bp.route("/api/insights")
 def get_insights():
     """
@@ -18,9 +56,6 @@ def get_insights():
     
     Returns recent sales, low inventory, and recommendations based on the user's role.
     """
-    if "role" not in session:
-        return jsonify({"error": "Unauthorized"}), 401
-    
     role = session["role"]
     conn = get_db_connection()
     cur = conn.cursor()
@@ -36,7 +71,7 @@ def get_insights():
         LIMIT 10
         """
     )
-    recent_sales = [dict(row) for row in cur.fetchall()]
+    recent_sales = rows_to_dicts(cur)
 
     cur.execute(
         """
@@ -49,7 +84,7 @@ def get_insights():
         LIMIT 10
         """
     )
-    low_inventory = [dict(row) for row in cur.fetchall()]
+    low_inventory = rows_to_dicts(cur)
 
     conn.close()
 
@@ -71,15 +106,27 @@ def api_metrics():
     """
     Get metrics data for the current user's role.
     
-    Returns role-specific metrics data including KPIs and chart data.
+    Returns role-specific metrics data including KPIs and chart data. Each
+    series is columnar: {"cols": [...], "rows": [[...], ...]}.
     """
-    if "role" not in session:
-        return jsonify({"error": "Unauthorized"}), 401
-    
     role = session["role"]
-    data = build_metrics_for_role(role)
-    data["user"] = session.get("user", "Henrik Warfvinge")
-    return jsonify(data)
+    user = session.get("user", "Henrik Warfvinge")
+    
+    # The build is cached, and so is its version, so repeat loads of unchanged
+    # metrics are answered with a 304 without serializing them again
+    metrics = build_columnar_metrics_for_role(role)
+    etag = f"{_metrics_version(role, metrics)}-{zlib.crc32(f'{role}|{user}'.encode()):08x}"
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        # Copy the cached result so the per-user field never leaks into the cache
+        data = dict(metrics)
+        data["user"] = user
+        response = Response(orjson.dumps(data), mimetype="application/json")
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.max_age = 30
+    return response
 
 
 @metrics_bp.route("/api/action", methods=["POST"]) 
@@ -89,18 +136,16 @@ def record_action():
     
     Stores action data in the database for tracking user behavior.
     """
-    if "role" not in session:
-        return jsonify({"error": "Unauthorized"}), 401
-    
     payload = request.get_json(force=True)
     action_type = payload.get("action_type")
     details = payload.get("details", {})
     
     conn = get_db_connection()
     cur = conn.cursor()
+    # Stored as JSON text so it can be read back and queried with json_extract()
     cur.execute(
         "INSERT INTO actions(role, action_type, details_json, created_ts) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
-        (session["role"], action_type, str(details)),
+        (session["role"], action_type, orjson.dumps(details).decode()),
     )
     conn.commit()
     conn.close()
@@ -5,15 +5,15 @@ This module provides REST API endpoints for managing priority insights,
 notes, and action recommendations.
 """
 
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, g, request, jsonify, session
 from app.database.connection import get_db_connection, get_role_db_connection
+from app.database.rows import rows_to_dicts
+from app.ids import new_action_id
 from services.gemini_service import _generate_json_from_model, generate_chart_insights
-import json
+import orjson
 import logging
-import uuid
 import sqlite3
 from datetime import datetime
-import traceback
 
 
 logger = logging.getLogger(__name__)
@@ -30,10 +30,16 @@ def _get_user_role() -> str:
     return session.get("role") or request.headers.get("X-Role") or "Customer Analyst"
 
 
+@priority_insights_bp.before_request
+def _resolve_user_role():
+    """Resolve the caller's role once per request, for handlers to read from g.user_role."""
+    g.user_role = _get_user_role()
+
+
 @priority_insights_bp.route('/api/priority-insights/summary', methods=['POST'])
 def api_priority_summary():
     """Get summary of all data for a priority."""
-    user_role = _get_user_role()
+    user_role = g.user_role
     
     try:
         data = request.get_json()
@@ -61,9 +67,7 @@ def api_priority_summary():
 @priority_insights_bp.route('/api/priority-insights/generate', methods=['POST'])
 def api_generate_insights():
     """Generate insights for a priority using Gemini."""
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    user_role = g.user_role
     
     try:
         data = request.get_json()
@@ -82,7 +86,7 @@ def api_generate_insights():
         4.  **Data-Driven Next Steps**: What specific data points or metrics should be investigated next to validate the analysis and recommendations?
 
         The priority data is:
-        {json.dumps(priority_data, indent=2)}
+        {orjson.dumps(priority_data, option=orjson.OPT_INDENT_2).decode()}
 
         Based on this, generate a detailed analysis.
         The output should be a single JSON object with one key: "insights_content", which contains the textual analysis as a string.
@@ -112,7 +116,7 @@ def api_generate_insights():
 @priority_insights_bp.route('/api/priority-insights/actions', methods=['POST'])
 def api_generate_actions():
     """Generate action recommendations for a priority."""
-    user_role = _get_user_role()
+    user_role = g.user_role
     
     try:
         data = request.get_json()
@@ -181,26 +185,25 @@ def api_generate_actions():
                     actions_list = value
                     break
 
-        cursor.execute("DELETE FROM proposed_actions WHERE priority_id = ? AND grid_type = ?", (priority_id, grid_type))
+        action_rows = [
+            (
+                priority_id,
+                grid_type,
+                new_action_id(),
+                action.get('action_title', 'Untitled Action'),
+                action.get('action_description', ''),
+                orjson.dumps(action).decode()
+            )
+            for action in actions_list
+        ]
 
-        for action in actions_list:
-            action_id = f"action_{uuid.uuid4()}"
-            action_title = action.get('action_title', 'Untitled Action')
-            action_description = action.get('action_description', '')
-            
-            cursor.execute("""
+        # Replace the proposed actions for this priority in one transaction
+        with conn:
+            cursor.execute("DELETE FROM proposed_actions WHERE priority_id = ? AND grid_type = ?", (priority_id, grid_type))
+            cursor.executemany("""
                 INSERT INTO proposed_actions (priority_id, grid_type, action_id, action_title, action_description, action_json)
                 VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                priority_id,
-                grid_type,
-                action_id,
-                action_title,
-                action_description,
-                json.dumps(action)
-            ))
-        
-        conn.commit()
+            """, action_rows)
 
         cursor.execute("SELECT * FROM proposed_actions WHERE priority_id = ? AND grid_type = ?", (priority_id, grid_type))
         rows = cursor.fetchall()
@@ -223,7 +226,7 @@ def api_generate_actions():
 @priority_insights_bp.route('/api/priority-insights/proposed-actions', methods=['GET'])
 def api_get_proposed_actions():
     """Get all proposed actions for a given priority."""
-    user_role = _get_user_role()
+    user_role = g.user_role
     priority_id = request.args.get('priority_id')
     grid_type = request.args.get('grid_type')
 
@@ -232,13 +235,10 @@ def api_get_proposed_actions():
 
     try:
         conn = get_role_db_connection(user_role)
-        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
 
         cursor.execute("SELECT * FROM proposed_actions WHERE priority_id = ? AND grid_type = ?", (priority_id, grid_type))
-        rows = cursor.fetchall()
-        
-        actions = [dict(row) for row in rows]
+        actions = rows_to_dicts(cursor)
         conn.close()
 
         return jsonify({
@@ -254,9 +254,7 @@ def api_get_proposed_actions():
 @priority_insights_bp.route('/api/priority-insights/save', methods=['POST'])
 def api_save_priority_analysis():
     """Save a complete priority analysis to the role-specific DB."""
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    user_role = g.user_role
     
     try:
         data = request.get_json()
@@ -268,8 +266,6 @@ def api_save_priority_analysis():
             return jsonify({"error": "Missing required fields"}), 400
         
         conn = get_role_db_connection(user_role)
-        # Set row_factory here to get dict-like rows
-        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
         # This is a placeholder for insights. The generation logic needs to be
@@ -277,9 +273,8 @@ def api_save_priority_analysis():
         insights_content = data.get('insights_content', None)
         
         cursor.execute("SELECT * FROM proposed_actions WHERE priority_id = ? AND grid_type = ?", (priority_id, grid_type))
-        rows = cursor.fetchall()
-        actions = [dict(row) for row in rows]
-        actions_json = json.dumps(actions) if actions else None
+        actions = rows_to_dicts(cursor)
+        actions_json = orjson.dumps(actions).decode() if actions else None
 
         cursor.execute("""
             INSERT OR REPLACE INTO saved_analyses (priority_id, grid_type, priority_title, priority_data, insights_content, actions_json)
@@ -288,7 +283,7 @@ def api_save_priority_analysis():
             priority_id,
             grid_type,
             priority_data.get('title', 'Unknown Priority'),
-            json.dumps(priority_data),
+            orjson.dumps(priority_data).decode(),
             insights_content,
             actions_json
         ))
@@ -310,19 +305,14 @@ def api_save_priority_analysis():
 @priority_insights_bp.route('/api/priority-insights/saved', methods=['GET'])
 def api_get_saved_analyses():
     """Get all saved priority analyses for the current user."""
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    user_role = g.user_role
     
     try:
         conn = get_role_db_connection(user_role)
-        # Set row_factory here to get dict-like rows
-        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
         cursor.execute("SELECT * FROM saved_analyses ORDER BY updated_ts DESC")
-        rows = cursor.fetchall()
-        analyses = [dict(row) for row in rows]
+        analyses = rows_to_dicts(cursor)
         
         conn.close()
         
@@ -339,9 +329,7 @@ def api_get_saved_analyses():
 @priority_insights_bp.route('/api/priority-insights/saved/<int:analysis_id>', methods=['GET'])
 def api_get_saved_analysis(analysis_id):
     """Get a specific saved priority analysis from the role-specific DB."""
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    user_role = g.user_role
     
     try:
         conn = get_role_db_connection(user_role)
@@ -360,13 +348,13 @@ def api_get_saved_analysis(analysis_id):
         # Parse JSON fields
         if analysis.get('priority_data'):
             try:
-                analysis['priority_data'] = json.loads(analysis['priority_data'])
+                analysis['priority_data'] = orjson.loads(analysis['priority_data'])
             except:
                 pass
         
         if analysis.get('actions_json'):
             try:
-                analysis['actions'] = json.loads(analysis['actions_json'])
+                analysis['actions'] = orjson.loads(analysis['actions_json'])
             except:
                 analysis['actions'] = []
         
@@ -380,9 +368,7 @@ def api_get_saved_analysis(analysis_id):
 @priority_insights_bp.route('/api/priority-insights/saved/<int:analysis_id>', methods=['PUT'])
 def api_update_saved_analysis(analysis_id):
     """Update a saved priority analysis in the role-specific DB."""
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    user_role = g.user_role
     
     try:
         data = request.get_json()
@@ -419,9 +405,7 @@ def api_update_saved_analysis(analysis_id):
 @priority_insights_bp.route('/api/priority-insights/saved/<int:analysis_id>', methods=['DELETE'])
 def api_delete_saved_analysis(analysis_id):
     """Delete a saved priority analysis from the role-specific DB."""
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    user_role = g.user_role
     
     try:
         conn = get_role_db_connection(user_role)
@@ -449,9 +433,7 @@ def api_delete_saved_analysis(analysis_id):
 @priority_insights_bp.route('/api/priority-insights/notes', methods=['POST'])
 def api_add_priority_note():
     """Add a note to a saved priority analysis."""
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    user_role = g.user_role
 
     try:
         data = request.get_json()
@@ -468,14 +450,11 @@ def api_add_priority_note():
         cursor = conn.cursor()
 
         cursor.execute(
-            "INSERT INTO priority_notes (priority_id, grid_type, note_text) VALUES (?, ?, ?)",
+            "INSERT INTO priority_notes (priority_id, grid_type, note_text) VALUES (?, ?, ?) RETURNING *",
             (priority_id, grid_type, note_text)
         )
-        conn.commit()
-
-        note_id = cursor.lastrowid
-        cursor.execute("SELECT * FROM priority_notes WHERE id = ?", (note_id,))
         new_note = cursor.fetchone()
+        conn.commit()
 
         conn.close()
 
@@ -486,20 +465,17 @@ def api_add_priority_note():
              conn.close()
              logger.error(f"Database schema is out of date for role '{user_role}'. Missing 'priority_notes' table.")
              return jsonify({"error": "Database schema is out of date. Please run the migration script."}), 500
-        logger.error(f"Database error adding priority note: {e}\n{traceback.format_exc()}")
+        logger.exception(f"Database error adding priority note: {e}")
         return jsonify({"error": "Failed to add note due to a database error"}), 500
     except Exception as e:
-        import traceback
-        logger.error(f"Error adding priority note: {e}\n{traceback.format_exc()}")
+        logger.exception(f"Error adding priority note: {e}")
         return jsonify({"error": "Failed to add note"}), 500
 
 
 @priority_insights_bp.route('/api/priority-insights/notes', methods=['GET'])
 def api_get_priority_notes():
     """Get all notes for a saved priority analysis."""
-    user_role = _get_user_role()
-    if not user_role:
-        return jsonify({"error": "Unauthorized"}), 401
+    user_role = g.user_role
         
     priority_id = request.args.get('priority_id')
     grid_type = request.args.get('grid_type')
@@ -509,14 +485,13 @@ def api_get_priority_notes():
 
     try:
         conn = get_role_db_connection(user_role)
-        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
 
         cursor.execute(
             "SELECT * FROM priority_notes WHERE priority_id = ? AND grid_type = ? ORDER BY created_ts ASC",
             (priority_id, grid_type)
         )
-        notes = [dict(row) for row in cursor.fetchall()]
+        notes = rows_to_dicts(cursor)
 
         conn.close()
 
@@ -530,6 +505,5 @@ def api_get_priority_notes():
         logger.error(f"Database error getting priority notes: {e}")
         return jsonify({"error": "Failed to get notes due to a database error"}), 500
     except Exception as e:
-        import traceback
-        logger.error(f"Error getting priority notes: {e}\n{traceback.format_exc()}")
+        logger.exception(f"Error getting priority notes: {e}")
         return jsonify({"error": "Failed to get notes"}), 500
@@ -6,8 +6,12 @@ and session management.
 """
 
 import os
+from functools import lru_cache
 from flask import session, jsonify
 
+# Maps hyphen-like characters (hyphen, dashes, minus sign) to a plain hyphen
+_HYPHENS = str.maketrans({ch: "-" for ch in "\u2010\u2011\u2012\u2013\u2014\u2212"})
+
 
 def normalize_role(role: str) -> str:
     """
@@ -22,10 +26,7 @@ def normalize_role(role: str) -> str:
     if not role:
         return ""
     # Normalize whitespace and hyphen-like characters
-    v = role.strip()
-    for ch in ["\u2010", "\u2011", "\u2012", "\u2013", "\u2014", "\u2212"]:
-        v = v.replace(ch, "-")
-    return v
+    return role.strip().translate(_HYPHENS)
 
 
 def get_canonical_roles():
@@ -57,6 +58,20 @@ def clean_key(v: str) -> str:
     return v.lower().replace("-", "").replace(" ", "")
 
 
+@lru_cache(maxsize=None)
+def get_role_lookup() -> dict:
+    """
+    Get the mapping of cleaned role keys to canonical role names.
+    
+    Built on first use (after the environment has been loaded) and reused
+    for every later login.
+    
+    Returns:
+        dict: Dictionary mapping clean_key() output to canonical role names
+    """
+    return {clean_key(k): v for k, v in get_canonical_roles().items()}
+
+
 def login_user(role: str) -> dict:
     """
     Authenticate a user with the given role and set up their session.
@@ -70,8 +85,7 @@ def login_user(role: str) -> dict:
     role = normalize_role(role)
     
     # Accept current and previous role labels; compare with aggressive normalization
-    canonical = get_canonical_roles()
-    lookup = {clean_key(k): v for k, v in canonical.items()}
+    lookup = get_role_lookup()
     key = clean_key(role)
     
     if key not in lookup:
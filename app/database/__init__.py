@@ -4,7 +4,8 @@ Database module for the data-driven application.
 This module provides database connection utilities and configuration.
 """
 
-from .connection import get_db_connection, DB_PATH, DATA_DIR
-from .schema import infer_column_type
+from .connection import get_db_connection, open_role_db, open_untrusted_db, set_query_timeout, run_queries_concurrently, DB_PATH, DATA_DIR
+from .schema import infer_column_type, quote_identifier, count_table_rows, estimate_table_rows, table_columns
+from .rows import rows_to_dicts, dicts_to_columnar, rows_to_column_arrays
 
-__all__ = ['get_db_connection', 'DB_PATH', 'DATA_DIR', 'infer_column_type']
+__all__ = ['get_db_connection', 'open_role_db', 'open_untrusted_db', 'set_query_timeout', 'run_queries_concurrently', 'DB_PATH', 'DATA_DIR', 'infer_column_type', 'quote_identifier', 'count_table_rows', 'estimate_table_rows', 'table_columns', 'rows_to_dicts', 'dicts_to_columnar', 'rows_to_column_arrays']
@@ -4,40 +4,383 @@ Database connection utilities.
 This module handles SQLite database connections and configuration.
 """
 
+import atexit
+import logging
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from .role_db_schema import ensure_role_db_schema
+from .rows import rows_to_dicts
+
+logger = logging.getLogger(__name__)
+
 # Database configuration
 APP_ROOT = Path(__file__).parent.parent.parent.resolve()
 DATA_DIR = APP_ROOT / "data"
 DB_PATH = DATA_DIR / "cfc.db"
 
+# Shared worker pool for running independent read queries side by side
+_query_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="sqlite-query")
+
+# Pragmas applied once to each pooled connection to the shared database
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+)
+# Idle connections kept open for reuse; extra ones are closed on release
+DB_POOL_SIZE = 16
+# Prepared statements kept per connection (sqlite3 default is 128)
+STATEMENT_CACHE_SIZE = 256
+
+_idle_connections = []
+_pool_lock = threading.Lock()
+
+# Applied to every per-role database connection when it is opened.
+# synchronous=NORMAL avoids an fsync per commit while staying crash-safe in
+# WAL mode; the larger page cache and mmap help the many small reads.
+ROLE_DB_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA trusted_schema=OFF",
+)
+# journal_mode=WAL is persistent in the database file, so it is only set the
+# first time this process opens a given role database.
+_wal_initialized = set()
+_wal_lock = threading.Lock()
+# How often every role database gets a PRAGMA optimize pass in the background
+ROLE_DB_OPTIMIZE_INTERVAL = 3600
+_optimizer_started = False
+# Idle connections kept open per role database (and access mode) for reuse
+ROLE_DB_POOL_SIZE = 4
+
+_idle_role_connections = {}
+_role_pool_lock = threading.Lock()
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    Connection to the shared database that returns to the pool on close().
+    
+    Callers keep the usual open/close pattern; close() rolls back any
+    uncommitted transaction and parks the connection for the next request,
+    so the pragmas and the page cache survive between requests. Closing an
+    already parked connection again does nothing. Pooled connections only
+    run the app's own SQL; user- or model-supplied SQL goes through
+    open_untrusted_db() so it cannot leave state behind for the next user.
+    """
+    
+    released = False
+    
+    def close(self):
+        _release_connection(self)
+    
+    def close_for_good(self):
+        super().close()
+
+
+class RoleConnection(sqlite3.Connection):
+    """
+    Connection to a per-role database that returns to the pool on close().
+    
+    Like PooledConnection, close() parks the connection for the next request
+    on the same database so the pragmas, schema and page cache are reused.
+    As there, a second close() is ignored and untrusted SQL never runs on a
+    pooled connection. The role databases are queried with ad-hoc KPI and chart SQL, so when a
+    connection is closed for good SQLite gets to refresh its statistics with
+    PRAGMA optimize, giving later connections better query plans.
+    """
+    
+    pool_key = None
+    optimize_on_close = True
+    released = False
+    
+    def close(self):
+        _release_role_connection(self)
+    
+    def optimize(self):
+        """Run PRAGMA optimize unless read-only or inside a transaction."""
+        if self.optimize_on_close and not self.in_transaction:
+            try:
+                self.execute("PRAGMA analysis_limit=400")
+                self.execute("PRAGMA optimize")
+            except sqlite3.Error as e:
+                logger.debug(f"PRAGMA optimize skipped: {e}")
+    
+    def close_for_good(self):
+        self.optimize()
+        super().close()
+
+
+def _open_pooled_connection() -> PooledConnection:
+    conn = sqlite3.connect(
+        str(DB_PATH),
+        factory=PooledConnection,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _release_connection(conn: PooledConnection):
+    # A second close() must not park the connection twice, or two requests
+    # would be handed the same connection
+    with _pool_lock:
+        if conn.released:
+            return
+        conn.released = True
+    if conn.in_transaction:
+        conn.rollback()
+    conn.row_factory = sqlite3.Row
+    with _pool_lock:
+        if len(_idle_connections) < DB_POOL_SIZE:
+            _idle_connections.append(conn)
+            return
+    conn.close_for_good()
+
+
+@atexit.register
+def close_pooled_connections():
+    """Close every idle pooled connection to the shared database."""
+    with _pool_lock:
+        conns = list(_idle_connections)
+        _idle_connections.clear()
+    for conn in conns:
+        conn.close_for_good()
+
 
 def get_db_connection():
     """
     Get a database connection to the SQLite database.
     
-    Creates the data directory if it doesn't exist and returns a connection
-    with row factory set to sqlite3.Row for easier data access.
+    Creates the data directory if it doesn't exist and returns a pooled
+    connection with row factory set to sqlite3.Row for easier data access.
+    Calling close() on it hands it back to the pool.
     
     Returns:
         sqlite3.Connection: Database connection with row factory configured
     """
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(str(DB_PATH))
+    with _pool_lock:
+        conn = _idle_connections.pop() if _idle_connections else None
+    if conn is None:
+        DATA_DIR.mkdir(parents=True, exist_ok=True)
+        conn = _open_pooled_connection()
+    conn.released = False
     conn.row_factory = sqlite3.Row
     return conn
 
 
-def get_role_db_connection(user_role: str):
+def _open_role_connection(path: str, read_only: bool) -> RoleConnection:
+    if read_only:
+        uri = Path(path).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(
+            uri, uri=True, factory=RoleConnection,
+            check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.optimize_on_close = False
+    else:
+        conn = sqlite3.connect(
+            path, factory=RoleConnection,
+            check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        if path not in _wal_initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with _wal_lock:
+                _wal_initialized.add(path)
+    conn.pool_key = (path, read_only)
+    for pragma in ROLE_DB_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _release_role_connection(conn: RoleConnection):
+    with _role_pool_lock:
+        if conn.released:
+            return
+        conn.released = True
+    if conn.in_transaction:
+        conn.rollback()
+    # Drop any deadline installed by set_query_timeout
+    conn.set_progress_handler(None, 0)
+    conn.row_factory = sqlite3.Row
+    with _role_pool_lock:
+        idle = _idle_role_connections.setdefault(conn.pool_key, [])
+        if len(idle) < ROLE_DB_POOL_SIZE:
+            idle.append(conn)
+            return
+    conn.close_for_good()
+
+
+@atexit.register
+def close_role_connections():
+    """Close every idle pooled connection to the role databases."""
+    with _role_pool_lock:
+        conns = [conn for idle in _idle_role_connections.values() for conn in idle]
+        _idle_role_connections.clear()
+    for conn in conns:
+        conn.close_for_good()
+
+
+def open_role_db(db_path, read_only: bool = False) -> sqlite3.Connection:
     """
-    Get a database connection to the role-specific SQLite database.
-    If the role DB does not exist, it will be created.
+    Open a per-role SQLite database with the role DB pragmas applied.
+    
+    Connections are pooled per database file: calling close() hands the
+    connection back for reuse, so repeat requests skip opening the file and
+    re-reading its schema. The first call starts a background thread that
+    runs PRAGMA optimize hourly for every role database.
+    
+    Args:
+        db_path: Path to the role's .db file
+        read_only (bool): Open with mode=ro so statements cannot modify the
+            database, e.g. for running model-generated SQL
+        
+    Returns:
+        sqlite3.Connection: Database connection with row factory configured
     """
-    safe_role = (user_role or "Customer Analyst").replace(" ", "_")
-    role_dir = APP_ROOT / "custom_roles"
-    role_dir.mkdir(parents=True, exist_ok=True)
-    role_db_path = role_dir / f"{safe_role}.db"
-    conn = sqlite3.connect(str(role_db_path))
+    _start_role_db_optimizer()
+    path = str(db_path)
+    key = (path, read_only)
+    with _role_pool_lock:
+        idle = _idle_role_connections.get(key)
+        conn = idle.pop() if idle else None
+    if conn is None:
+        conn = _open_role_connection(path, read_only)
+    conn.released = False
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def open_untrusted_db(db_path) -> sqlite3.Connection:
+    """
+    Open a database read-only for running user- or model-supplied SQL.
+    
+    The connection is opened with mode=ro and is not pooled: close() really
+    closes it, so whatever the SQL changes on the connection (PRAGMAs,
+    ATTACHed databases, temp objects) is discarded with it instead of
+    reaching the next request.
+    
+    Args:
+        db_path: Path to the .db file
+        
+    Returns:
+        sqlite3.Connection: Read-only connection with row factory configured
+    """
+    uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.execute("PRAGMA trusted_schema=OFF")
     conn.row_factory = sqlite3.Row
     return conn
+
+
+def set_query_timeout(conn: sqlite3.Connection, seconds: float):
+    """
+    Abort statements on a connection once they run past a deadline.
+    
+    A progress handler checks the clock every 100k VM instructions; once the
+    deadline has passed the running statement fails with
+    sqlite3.OperationalError ("interrupted").
+    
+    Args:
+        conn (sqlite3.Connection): Connection to guard
+        seconds (float): Time budget, counted from now
+    """
+    deadline = time.monotonic() + seconds
+    conn.set_progress_handler(lambda: time.monotonic() > deadline, 100000)
+
+
+def _optimize_role_dbs():
+    role_dir = APP_ROOT / "custom_roles"
+    while True:
+        time.sleep(ROLE_DB_OPTIMIZE_INTERVAL)
+        for db_path in role_dir.glob("*.db"):
+            try:
+                conn = open_role_db(db_path)
+                conn.optimize()
+                conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"Could not optimize {db_path.name}: {e}")
+
+
+def _start_role_db_optimizer():
+    global _optimizer_started
+    if _optimizer_started:
+        return
+    with _wal_lock:
+        if _optimizer_started:
+            return
+        _optimizer_started = True
+    threading.Thread(target=_optimize_role_dbs, name="role-db-optimize", daemon=True).start()
+
+
+def role_db_file(user_role: str) -> Path:
+    """
+    Get the path of the role-specific database get_role_db_connection() opens.
+    
+    Args:
+        user_role (str): Session role name (defaults to "Customer Analyst")
+        
+    Returns:
+        Path: Path to the role's .db file
+    """
+    safe_role = (user_role or "Customer Analyst").replace(" ", "_")
+    return APP_ROOT / "custom_roles" / f"{safe_role}.db"
+
+
+def get_role_db_connection(user_role: str):
+    """
+    Get a database connection to the role-specific SQLite database.
+    If the role DB does not exist, it will be created, and its tables are
+    created the first time this process opens it.
+    """
+    role_db_path = role_db_file(user_role)
+    role_db_path.parent.mkdir(parents=True, exist_ok=True)
+    ensure_role_db_schema(role_db_path)
+    return open_role_db(role_db_path)
+
+
+def run_queries_concurrently(connect, queries, skip_errors: bool = False,
+                             materialize=rows_to_dicts) -> dict:
+    """
+    Run independent read queries concurrently, each on its own connection.
+    
+    SQLite connections cannot be shared across threads, so every worker opens
+    a connection via ``connect``, runs a single statement and closes it again.
+    
+    Args:
+        connect: Zero-argument callable returning a new sqlite3.Connection
+        queries: Iterable of (key, sql) pairs
+        skip_errors (bool): Log and drop failing queries instead of raising
+        materialize: Callable turning an executed cursor into the result value
+            (defaults to rows_to_dicts)
+        
+    Returns:
+        dict: Mapping of key to materialized rows, in the order the queries
+        were given
+    """
+    def run(sql):
+        conn = connect()
+        try:
+            return materialize(conn.execute(sql))
+        finally:
+            conn.close()
+    
+    futures = {key: _query_executor.submit(run, sql) for key, sql in queries}
+    results = {}
+    for key, future in futures.items():
+        try:
+            results[key] = future.result()
+        except Exception as e:
+            if not skip_errors:
+                raise
+            logger.warning(f"Skipping query '{key}': {e}")
+    return results
@@ -7,10 +7,15 @@ database associated with each custom role.
 
 import sqlite3
 import logging
+import threading
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+# Role databases whose schema has been created or checked by this process
+_initialized_dbs = set()
+_init_lock = threading.Lock()
+
 def initialize_role_db(db_path: Path):
     """
     Initializes the database for a custom role, creating all necessary tables.
@@ -92,6 +97,11 @@ def initialize_role_db(db_path: Path):
                         created_at TEXT NOT NULL DEFAULT (datetime('now')),
                         updated_at TEXT NOT NULL DEFAULT (datetime('now'))
                     )        """)
+        # Older databases created chart_insights without a chart_title column
+        cursor.execute("SELECT 1 FROM pragma_table_info('chart_insights') WHERE name = 'chart_title'")
+        if cursor.fetchone() is None:
+            cursor.execute("ALTER TABLE chart_insights ADD COLUMN chart_title TEXT NOT NULL DEFAULT 'Untitled Chart'")
+            logger.info("Patched chart_insights table with chart_title column.")
         
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS action_notes (
@@ -113,6 +123,63 @@ def initialize_role_db(db_path: Path):
             )
         """)
 
+        # AI assistant questions and answers, one row per exchange, keyed by
+        # the step or context section they belong to ("step_<id>" / "context_<key>")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ai_conversations (
+                id TEXT PRIMARY KEY,
+                action_id TEXT NOT NULL,
+                target_key TEXT NOT NULL,
+                question TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_ts TEXT NOT NULL
+            )
+        """)
+        # Older databases kept each action's conversations as one JSON blob in
+        # an ai_conversations column; move them into the table. Missing fields
+        # get defaults and entries without an id get a stable one, so every
+        # entry can be moved. A blob is only emptied once all of its entries
+        # are in the table.
+        for table in ("saved_actions", "proposed_actions"):
+            cursor.execute(f"SELECT 1 FROM pragma_table_info('{table}') WHERE name = 'ai_conversations'")
+            if cursor.fetchone() is None:
+                continue
+            entry_id = f"COALESCE(json_extract(c.value, '$.id'), {table}.action_id || ':' || t.key || ':' || c.key)"
+            entries = f"""
+                json_each({table}.ai_conversations) AS t, json_each(t.value) AS c
+                WHERE t.type = 'array' AND c.type = 'object'
+            """
+            cursor.execute(f"""
+                INSERT OR IGNORE INTO ai_conversations (id, action_id, target_key, question, response, created_ts)
+                SELECT {entry_id}, {table}.action_id, t.key,
+                       COALESCE(json_extract(c.value, '$.question'), ''),
+                       COALESCE(json_extract(c.value, '$.response'), ''),
+                       COALESCE(json_extract(c.value, '$.timestamp'), {table}.updated_ts, CURRENT_TIMESTAMP)
+                FROM {table}, {entries}
+                AND json_valid({table}.ai_conversations)
+            """)
+            if cursor.rowcount > 0:
+                logger.info(f"Moved {cursor.rowcount} AI conversations out of {table}.")
+            cursor.execute(f"""
+                UPDATE {table} SET ai_conversations = '{{}}'
+                WHERE ai_conversations IS NOT NULL AND ai_conversations != '{{}}'
+                  AND json_valid(ai_conversations)
+                  AND NOT EXISTS (
+                      SELECT 1 FROM {entries}
+                      AND NOT EXISTS (
+                          SELECT 1 FROM ai_conversations AS m
+                          WHERE m.id = {entry_id} AND m.action_id = {table}.action_id))
+            """)
+
+        # Indexes for the per-priority and per-action lookups the routes run
+        # on every request. chart_insights needs none: its UNIQUE chart_id
+        # already has one.
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_proposed_actions_priority ON proposed_actions (priority_id, grid_type)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_saved_analyses_updated ON saved_analyses (updated_ts)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_action_notes_action ON action_notes (action_id, created_ts)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_priority_notes_priority ON priority_notes (priority_id, grid_type, created_ts)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_ai_conversations_action ON ai_conversations (action_id, target_key, created_ts)")
+
         # Drop legacy/deprecated tables if they exist. This is safe.
         cursor.execute("DROP TABLE IF EXISTS actions")
         cursor.execute("DROP TABLE IF EXISTS priority_insights")
@@ -120,6 +187,7 @@ def initialize_role_db(db_path: Path):
         # cursor.execute("DROP TABLE IF EXISTS priority_notes") - This was an error
 
         conn.commit()
+        _initialized_dbs.add(str(db_path))
         logger.info(f"Successfully initialized and migrated schema for database: {db_path}")
 
     except Exception as e:
@@ -128,3 +196,21 @@ def initialize_role_db(db_path: Path):
     finally:
         if conn:
             conn.close()
+
+
+def ensure_role_db_schema(db_path: Path):
+    """
+    Initialize a role database once per process.
+    
+    Request handlers call this before using a role database; only the first
+    call for a given path runs initialize_role_db, later calls return
+    immediately without touching SQLite.
+    
+    Args:
+        db_path (Path): Path to the role's .db file
+    """
+    if str(db_path) in _initialized_dbs:
+        return
+    with _init_lock:
+        if str(db_path) not in _initialized_dbs:
+            initialize_role_db(db_path)
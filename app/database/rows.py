@@ -0,0 +1,78 @@
+"""
+Row materialization utilities.
+
+This module converts SQLite cursor results into JSON-ready Python structures.
+"""
+
+import numpy as np
+
+
+def rows_to_dicts(cursor) -> list:
+    """
+    Fetch all remaining rows from a cursor as a list of dictionaries.
+    
+    Column names are read once from the cursor description and zipped with each
+    row, which avoids the per-row key lookups of calling dict() on sqlite3.Row.
+    
+    Args:
+        cursor: Database cursor with an executed SELECT statement
+        
+    Returns:
+        list: One dictionary per row, keyed by column name
+    """
+    if cursor.description is None:
+        return []
+    cols = [d[0] for d in cursor.description]
+    return [dict(zip(cols, row)) for row in cursor.fetchall()]
+
+
+def dicts_to_columnar(rows: list) -> dict:
+    """
+    Convert a list of row dictionaries into a columnar table.
+    
+    Column names are sent once instead of being repeated in every row, which
+    roughly halves the JSON size of wide series. All rows are assumed to share
+    the keys of the first row, as rows from one query do.
+    
+    Args:
+        rows (list): Row dictionaries, e.g. from rows_to_dicts()
+        
+    Returns:
+        dict: {"cols": [column names], "rows": [[values], ...]}
+    """
+    if not rows:
+        return {"cols": [], "rows": []}
+    cols = list(rows[0].keys())
+    return {"cols": cols, "rows": [list(row.values()) for row in rows]}
+
+
+def rows_to_column_arrays(cursor) -> dict:
+    """
+    Fetch all remaining rows from a cursor as a mapping of column to values.
+    
+    Purely numeric columns are packed into numpy arrays so they can be
+    aggregated without Python-level loops and serialized directly by orjson
+    (with ``orjson.OPT_SERIALIZE_NUMPY``). Columns holding text, NULLs or
+    mixed types stay plain lists.
+    
+    Args:
+        cursor: Database cursor with an executed SELECT statement
+        
+    Returns:
+        dict: Column name to numpy array (numeric columns) or list of values
+    """
+    if cursor.description is None:
+        return {}
+    cols = [d[0] for d in cursor.description]
+    rows = cursor.fetchall()
+    if not rows:
+        return {col: [] for col in cols}
+    columns = {}
+    for col, values in zip(cols, zip(*rows)):
+        if all(type(v) is int for v in values):
+            columns[col] = np.array(values, dtype=np.int64)
+        elif all(type(v) in (int, float) for v in values):
+            columns[col] = np.array(values, dtype=np.float64)
+        else:
+            columns[col] = list(values)
+    return columns
@@ -4,7 +4,7 @@ Database schema utilities.
 This module provides functions for analyzing and inferring database schema information.
 """
 
-from datetime import datetime
+import sqlite3
 
 
 def infer_column_type(column_name, sqlite_type, table_name, cursor):
@@ -39,45 +39,33 @@ def infer_column_type(column_name, sqlite_type, table_name, cursor):
     elif any(keyword in column_lower for keyword in ['is_', 'has_', 'active', 'enabled', 'visible', 'public']):
         return 'BOOLEAN'
     
-    # If name-based inference fails, sample some data to determine type
+    # If name-based inference fails, classify a sample of values in SQLite:
+    # a single aggregate over the first 10 non-null values counts the numeric,
+    # integral, date-shaped and boolean-shaped ones.
+    col = quote_identifier(column_name)
     try:
-        cursor.execute(f"SELECT {column_name} FROM '{table_name}' WHERE {column_name} IS NOT NULL LIMIT 10")
-        sample_data = cursor.fetchall()
+        cursor.execute(f"""
+            SELECT COUNT(*) AS n,
+                   SUM(is_num) AS nums,
+                   SUM(is_num AND CAST(v AS REAL) = CAST(CAST(v AS REAL) AS INTEGER)) AS ints,
+                   SUM(length(s) > 8 AND s GLOB '[0-9][0-9][0-9][0-9][-/][0-9][0-9][-/][0-9][0-9]*') AS dates,
+                   SUM(lower(s) IN ('true', 'false', '1', '0', 'yes', 'no', 'y', 'n')) AS bools
+            FROM (
+                SELECT v, s,
+                       typeof(v) IN ('integer', 'real')
+                       OR (s GLOB '*[0-9]*' AND s NOT GLOB '*[^0-9.eE+-]*'
+                           AND (s NOT GLOB '?*[+-]*' OR s GLOB '*[eE][+-][0-9]*')) AS is_num
+                FROM (SELECT {col} AS v, trim({col}) AS s FROM {quote_identifier(table_name)}
+                      WHERE {col} IS NOT NULL LIMIT 10)
+            )
+        """)
+        total_samples, numeric_count, integer_count, date_count, boolean_count = (
+            value or 0 for value in cursor.fetchone()
+        )
         
-        if not sample_data:
+        if not total_samples:
             return 'TEXT'  # Default if no data
         
-        # Check if all values are numeric
-        numeric_count = 0
-        date_count = 0
-        boolean_count = 0
-        
-        for row in sample_data:
-            value = str(row[0]).strip()
-            if not value:
-                continue
-                
-            # Check for numeric
-            try:
-                float(value)
-                numeric_count += 1
-            except ValueError:
-                pass
-            
-            # Check for date patterns
-            if any(pattern in value for pattern in ['-', '/', ':']) and len(value) > 8:
-                try:
-                    datetime.fromisoformat(value.replace('/', '-').replace(' ', 'T'))
-                    date_count += 1
-                except:
-                    pass
-            
-            # Check for boolean patterns
-            if value.lower() in ['true', 'false', '1', '0', 'yes', 'no', 'y', 'n']:
-                boolean_count += 1
-        
-        total_samples = len(sample_data)
-        
         # Determine type based on sample analysis
         if date_count / total_samples > 0.7:
             return 'DATETIME'
@@ -85,15 +73,6 @@ def infer_column_type(column_name, sqlite_type, table_name, cursor):
             return 'BOOLEAN'
         elif numeric_count / total_samples > 0.7:
             # Check if they're integers or decimals
-            integer_count = 0
-            for row in sample_data:
-                value = str(row[0]).strip()
-                try:
-                    if float(value).is_integer():
-                        integer_count += 1
-                except ValueError:
-                    pass
-            
             if integer_count / numeric_count > 0.8:
                 return 'INTEGER'
             else:
@@ -103,3 +82,116 @@ def infer_column_type(column_name, sqlite_type, table_name, cursor):
             
     except Exception:
         return 'TEXT'  # Default fallback
+
+
+def quote_identifier(name: str) -> str:
+    """
+    Quote a table or column name for use in SQL text.
+    
+    Args:
+        name (str): The identifier to quote
+        
+    Returns:
+        str: The identifier wrapped in double quotes, with embedded quotes doubled
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+
+def count_table_rows(cursor, tables, from_sqlite_master: bool = False) -> dict:
+    """
+    Count the rows of several tables with a single compound query.
+    
+    Names are checked against sqlite_master and quoted rather than interpolated
+    raw, so unknown names are simply left out of the result. All counts run in
+    one statement, i.e. one read transaction over a shared page cache.
+    
+    Args:
+        cursor: Database cursor for executing queries
+        tables: Iterable of table names to count
+        from_sqlite_master (bool): The names were just read from sqlite_master,
+            so the existence check can be skipped
+        
+    Returns:
+        dict: Mapping of table name to row count for the tables that exist
+    """
+    if from_sqlite_master:
+        names = list(tables)
+    else:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        existing = {r[0] for r in cursor.fetchall()}
+        names = [t for t in tables if t in existing]
+    if not names:
+        return {}
+    sql = " UNION ALL ".join(
+        f"SELECT ? AS name, COUNT(*) AS cnt FROM {quote_identifier(t)}" for t in names
+    )
+    cursor.execute(sql, names)
+    return {r[0]: r[1] for r in cursor.fetchall()}
+
+
+def estimate_table_rows(cursor, tables) -> dict:
+    """
+    Get approximate row counts from the planner statistics in sqlite_stat1.
+    
+    ANALYZE records each table's row count as the first number of its stat
+    entries, so reading them is a metadata lookup instead of a full scan per
+    table. Tables without statistics (or databases never analyzed) fall back
+    to count_table_rows.
+    
+    Args:
+        cursor: Database cursor for executing queries
+        tables: Iterable of table names read from sqlite_master
+        
+    Returns:
+        dict: Mapping of table name to (approximate) row count
+    """
+    names = list(tables)
+    if not names:
+        return {}
+    counts = {}
+    placeholders = ",".join("?" * len(names))
+    try:
+        cursor.execute(
+            f"""SELECT tbl, MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1
+                WHERE tbl IN ({placeholders}) GROUP BY tbl""",
+            names,
+        )
+        counts = {r[0]: r[1] for r in cursor.fetchall()}
+    except sqlite3.OperationalError:
+        pass  # no sqlite_stat1 until the database is analyzed
+    missing = [t for t in names if t not in counts]
+    if missing:
+        counts.update(count_table_rows(cursor, missing, from_sqlite_master=True))
+    return counts
+
+
+def table_columns(cursor, tables) -> dict:
+    """
+    Fetch the column definitions of several tables with a single query.
+    
+    Joins sqlite_master with the pragma_table_info() table-valued function
+    instead of issuing one PRAGMA table_info per table.
+    
+    Args:
+        cursor: Database cursor for executing queries
+        tables: Iterable of table names
+        
+    Returns:
+        dict: Mapping of table name to its PRAGMA table_info rows
+        (cid, name, type, notnull, dflt_value, pk); unknown tables map to []
+    """
+    names = list(tables)
+    columns = {t: [] for t in names}
+    if not names:
+        return columns
+    placeholders = ",".join("?" * len(names))
+    cursor.execute(
+        f"""SELECT m.name, p.cid, p.name, p.type, p."notnull", p.dflt_value, p.pk
+            FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p
+            WHERE m.type = 'table' AND m.name IN ({placeholders})
+            ORDER BY m.name, p.cid""",
+        names,
+    )
+    for row in cursor.fetchall():
+        columns[row[0]].append(tuple(row[1:]))
+    return columns
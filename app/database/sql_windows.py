@@ -0,0 +1,122 @@
+"""
+KPI formula rewriting utilities.
+
+This module rewrites plan-generated KPI SQL so the same formula can be
+evaluated over a specific date window (e.g. current vs previous period).
+"""
+
+import functools
+import re
+
+# Patterns used by the KPI change-percentage helpers, compiled once
+_RE_FROM_TABLE = re.compile(r"FROM\s+`?\"?([a-zA-Z0-9_]+)`?\"?", re.IGNORECASE)
+_RE_WHERE = re.compile(r"\bWHERE\b", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=256)
+def _from_table_pattern(table: str):
+    return re.compile(r"\bFROM\s+`?\"?" + re.escape(table) + r"`?\"?", re.IGNORECASE)
+
+
+def extract_table(sql: str) -> str:
+    """
+    Get the first table named in a FROM clause.
+
+    Args:
+        sql (str): SQL query text
+
+    Returns:
+        str: Table name, or an empty string if none was found
+    """
+    m = _RE_FROM_TABLE.search(sql)
+    return m.group(1) if m else ""
+
+
+@functools.lru_cache(maxsize=256)
+def add_time_window(sql: str, table: str, date_col: str, start_iso: str, end_iso: str) -> str:
+    """
+    Restrict a KPI query to rows whose date column falls inside a window.
+
+    The clause is merged into an existing WHERE or added after the FROM
+    table. The same formulas and windows recur on every request, so the
+    rewrite is memoized.
+
+    Args:
+        sql (str): KPI query to rewrite
+        table (str): Table the query reads from
+        date_col (str): Date column to filter on
+        start_iso (str): Window start as an ISO date
+        end_iso (str): Window end as an ISO date
+
+    Returns:
+        str: Rewritten query, or an empty string if table or date_col is missing
+    """
+    if not table or not date_col:
+        return ""
+    # Normalize SQL spacing
+    s = sql.strip()
+    has_where = _RE_WHERE.search(s) is not None
+    clause = f"{date_col} BETWEEN date('{start_iso}') AND date('{end_iso}')"
+    if has_where:
+        return _RE_WHERE.sub(lambda m: m.group(0) + " " + clause + " AND ", s, count=1)
+    else:
+        return _from_table_pattern(table).sub(lambda m: m.group(0) + f" WHERE {clause}", s, count=1)
+
+
+# A single aggregate over one table, optionally filtered: the KPI shape that
+# can be split into date windows with conditional aggregation
+_RE_SIMPLE_AGGREGATE = re.compile(
+    r"^\s*SELECT\s+(?P<expr>(?P<func>SUM|AVG|COUNT|MIN|MAX)\s*\(\s*(?P<distinct>DISTINCT\s+)?"
+    r"(?P<arg>\*|[`\"]?\w+[`\"]?)\s*\)(?:\s+AS\s+[`\"]?\w+[`\"]?)?)"
+    r"\s+FROM\s+[`\"]?(?P<table>\w+)[`\"]?(?:\s+WHERE\s+(?P<where>.+?))?\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+_RE_COMPLEX_CLAUSE = re.compile(r"\b(?:SELECT|GROUP|HAVING|ORDER|LIMIT|JOIN|UNION|OFFSET)\b", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=256)
+def window_comparison_sql(sql: str, table: str, date_col: str) -> str:
+    """
+    Rewrite a simple aggregate KPI so one scan returns it for two date windows.
+
+    ``SELECT SUM(x) FROM t WHERE ...`` becomes
+    ``SELECT SUM(x), SUM(CASE WHEN <current window> THEN x END),
+    SUM(CASE WHEN <previous window> THEN x END) FROM t WHERE ...``. The first
+    column keeps the original expression text and therefore its name. The
+    window bounds are bound as parameters, in the order current start,
+    current end, previous start, previous end.
+
+    Args:
+        sql (str): KPI query to rewrite
+        table (str): Table the query reads from
+        date_col (str): Date column to split the windows on
+
+    Returns:
+        str: Rewritten query, or an empty string if the formula is not a
+        single SUM/AVG/COUNT/MIN/MAX over ``table``
+    """
+    m = _RE_SIMPLE_AGGREGATE.match(sql)
+    if not m or not date_col or m.group("table").lower() != table.lower():
+        return ""
+    where = m.group("where")
+    if where and _RE_COMPLEX_CLAUSE.search(where):
+        return ""
+    func = m.group("func").upper()
+    arg = m.group("arg")
+    if arg == "*":
+        if func != "COUNT":
+            return ""
+        arg = "1"
+    distinct = "DISTINCT " if m.group("distinct") else ""
+    date_ref = '"' + date_col.replace('"', '""') + '"'
+
+    def windowed(alias: str) -> str:
+        return f"{func}({distinct}CASE WHEN {date_ref} BETWEEN date(?) AND date(?) THEN {arg} END) AS {alias}"
+
+    query = (
+        f"SELECT {m.group('expr')}, {windowed('__window_curr')}, {windowed('__window_prev')} "
+        f'FROM "{m.group("table")}"'
+    )
+    if where:
+        query += f" WHERE {where}"
+    return query
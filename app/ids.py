@@ -0,0 +1,38 @@
+"""
+Identifier generation shared across the app.
+
+Action ids are stored in the action tables and matched by ActionIdConverter
+(app/api/converters.py), so both go through new_action_id() here.
+"""
+
+import os
+import time
+import uuid
+
+
+def uuid7() -> uuid.UUID:
+    """
+    Generate a time-ordered UUID (version 7, RFC 9562).
+
+    The leading 48 bits are the Unix time in milliseconds, so new action ids
+    sort after older ones and inserts land at the end of the action_id index
+    instead of at random positions. The remaining 74 bits are random.
+
+    Returns:
+        uuid.UUID: A version 7 UUID
+    """
+    value = (time.time_ns() // 1_000_000) << 80
+    value |= int.from_bytes(os.urandom(10), "big") & ((1 << 80) - 1)
+    value = (value & ~(0xF << 76)) | (0x7 << 76)
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)
+    return uuid.UUID(int=value)
+
+
+def new_action_id() -> str:
+    """
+    Generate an id for a proposed action, in the "action_<uuid>" form.
+
+    Returns:
+        str: The new action id
+    """
+    return f"action_{uuid7()}"
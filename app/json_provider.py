@@ -0,0 +1,64 @@
+"""
+orjson-backed JSON provider for Flask.
+
+Installed on the app so that jsonify(), request.get_json() and the rest of
+Flask's JSON handling go through orjson instead of the stdlib json module.
+"""
+
+import decimal
+import sqlite3
+import uuid
+
+import orjson
+from flask.json.provider import JSONProvider
+
+
+def _default(o):
+    """
+    Serialize the types orjson does not handle natively.
+
+    Args:
+        o: Object orjson could not serialize
+
+    Returns:
+        A JSON-serializable replacement value
+    """
+    if isinstance(o, sqlite3.Row):
+        return dict(o)
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if isinstance(o, (set, frozenset, tuple)):
+        return list(o)
+    if hasattr(o, "__html__"):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(JSONProvider):
+    """
+    Flask JSON provider using orjson for dumps/loads.
+
+    Keys are sorted like Flask's default provider so response bodies keep the
+    same layout the frontend has always received.
+    """
+
+    sort_keys = True
+
+    def _option(self):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return option
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=_default, option=self._option()).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=_default, option=self._option()),
+            mimetype="application/json",
+        )
@@ -4,12 +4,19 @@ Models module for the data-driven application.
 This module contains data models and business logic for metrics, roles, and analysis.
 """
 
-from .metrics import build_metrics_for_role, filter_data_for_short_term
-from .roles import CustomRoleManager, get_role_db_path
+from .metrics import build_metrics_for_role, build_columnar_metrics_for_role, filter_data_for_short_term
+from .roles import (
+    CustomRoleManager, get_role_db_path, json_file_exists, load_json_cached, read_json_file, write_json_file
+)
 
 __all__ = [
     'build_metrics_for_role', 
+    'build_columnar_metrics_for_role',
     'filter_data_for_short_term',
     'CustomRoleManager',
-    'get_role_db_path'
+    'get_role_db_path',
+    'json_file_exists',
+    'load_json_cached',
+    'read_json_file',
+    'write_json_file'
 ]
@@ -4,41 +4,101 @@ Metrics models and business logic.
 This module contains functions for building and processing metrics data for different roles.
 """
 
-from datetime import datetime, timedelta
-from app.database import get_db_connection
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from cachetools.func import ttl_cache
+from app.database import get_db_connection, run_queries_concurrently, dicts_to_columnar
+
+# Seconds a role's metrics stay cached. The metric views only change when the
+# seed data is reloaded, so repeat dashboard loads can skip the view queries.
+METRICS_CACHE_TTL = 60
+
+# (key, sql) pairs for the metric views. Each query is independent, so they are
+# run concurrently and the results keyed in this order.
+METRIC_QUERIES = [
+    # E-commerce metrics (up to ~90 days) - ORDER BY day ASC for chronological analysis
+    ("ecom_funnel", "SELECT * FROM vw_ecom_daily_funnel ORDER BY day ASC LIMIT 90"),
+    ("payment_failures", "SELECT * FROM vw_payment_failures ORDER BY day ASC LIMIT 90"),
+    ("zero_result_search", "SELECT * FROM vw_zero_result_search ORDER BY day ASC LIMIT 90"),
+    ("plp_perf", "SELECT * FROM vw_plp_perf ORDER BY day ASC LIMIT 90"),
+    ("product_conv", "SELECT * FROM vw_product_conv WHERE product IN ('Sneakers','Denim Jacket','Graphic Tee','Chino Pants','Hoodie') ORDER BY day ASC LIMIT 120"),
+
+    # Advanced e-com
+    ("ecom_rates_by_day", "SELECT * FROM vw_ecom_rates_by_day ORDER BY day ASC LIMIT 180"),
+    ("ecom_mobile_desktop_delta", "SELECT * FROM vw_ecom_mobile_desktop_delta ORDER BY day ASC LIMIT 90"),
+    ("zero_result_top_share", "SELECT * FROM vw_zero_result_top_share ORDER BY day ASC LIMIT 90"),
+    ("sku_efficiency", "SELECT * FROM vw_sku_efficiency ORDER BY day ASC LIMIT 500"),
+    ("return_rate_trend", "SELECT * FROM vw_return_rate_trend ORDER BY day ASC LIMIT 180"),
+
+    # Marketing metrics
+    ("mkt_roas_campaign", "SELECT * FROM vw_mkt_roas_campaign ORDER BY day ASC, roas ASC LIMIT 180"),
+    ("creative_ctr", "SELECT * FROM vw_creative_ctr ORDER BY day ASC"),
+    ("budget_pacing", "SELECT * FROM vw_budget_pacing_var ORDER BY day ASC LIMIT 220"),
+    ("disapprovals", "SELECT * FROM vw_disapprovals ORDER BY day ASC LIMIT 180"),
+    ("brand_health", "SELECT * FROM vw_brand_health ORDER BY day ASC LIMIT 90"),
+
+    # Advanced mkt
+    ("campaign_kpis", "SELECT * FROM vw_campaign_kpis ORDER BY day ASC LIMIT 400"),
+    ("disapproval_rate", "SELECT * FROM vw_disapproval_rate ORDER BY day ASC LIMIT 180"),
+    ("brand_lift_proxy", "SELECT * FROM vw_brand_lift_proxy ORDER BY day ASC LIMIT 90"),
+    ("sentiment_social_roas", "SELECT * FROM vw_sentiment_social_roas ORDER BY day ASC LIMIT 90"),
+]
+
+# Metric keys hidden from each built-in role
+ROLE_EXCLUDED_METRICS = {
+    "E-commerce Manager": {
+        "mkt_roas_campaign","creative_ctr","budget_pacing","disapprovals","brand_health",
+        "campaign_kpis","disapproval_rate","brand_lift_proxy","sentiment_social_roas"
+    },
+    "Marketing Lead": {
+        "ecom_funnel","payment_failures","zero_result_search","plp_perf","product_conv",
+        "ecom_rates_by_day","ecom_mobile_desktop_delta","zero_result_top_share","sku_efficiency","return_rate_trend"
+    },
+}
+
+
+def _day_of(row) -> str:
+    return row.get('day') or ''
 
 
 def filter_data_for_short_term(data: dict) -> dict:
     """
     Filter data to only include the last 2 weeks for short-term analysis.
     
+    Series are expected in ascending 'day' order (as every METRIC_QUERIES view
+    is), so the cut-off is found by bisection and the tail sliced off. Since
+    'day' is an ISO YYYY-MM-DD string, a plain string compare is a date compare.
+    
     Args:
         data (dict): Dictionary containing metrics data
         
     Returns:
         dict: Filtered data containing only the last 2 weeks of data
     """
-    # Calculate 2 weeks ago
-    two_weeks_ago = (datetime.now() - timedelta(days=14)).strftime('%Y-%m-%d')
+    # Calculate 2 weeks ago (UTC, matching the day buckets in the views)
+    two_weeks_ago = (datetime.now(timezone.utc).date() - timedelta(days=14)).isoformat()
     
     filtered_data = {}
     for key, values in data.items():
         if isinstance(values, list) and len(values) > 0:
-            # Filter to only include data from last 2 weeks
-            filtered_values = [item for item in values if item.get('day', '') >= two_weeks_ago]
-            filtered_data[key] = filtered_values
+            # Keep only rows from the last 2 weeks
+            start = bisect_left(values, two_weeks_ago, key=_day_of)
+            filtered_data[key] = values[start:]
         else:
             filtered_data[key] = values
     
     return filtered_data
 
 
+@ttl_cache(maxsize=16, ttl=METRICS_CACHE_TTL)
 def build_metrics_for_role(role: str) -> dict:
     """
     Build metrics data for a specific role.
     
     This function queries the database and builds a comprehensive metrics dictionary
     tailored to the specific role (E-commerce Manager, Marketing Lead, etc.).
+    Results are cached per role for METRICS_CACHE_TTL seconds, so callers must
+    treat the returned dictionary as read-only (copy before adding keys).
     
     Args:
         role (str): The role name to build metrics for
@@ -46,70 +106,30 @@ def build_metrics_for_role(role: str) -> dict:
     Returns:
         dict: Dictionary containing role-specific metrics data
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    resp = {}
-    
-    # E-commerce metrics (up to ~90 days) - ORDER BY day ASC for chronological analysis
-    cur.execute("SELECT * FROM vw_ecom_daily_funnel ORDER BY day ASC LIMIT 90")
-    resp["ecom_funnel"] = [dict(r) for r in cur.fetchall()]
-    cur.execute("SELECT * FROM vw_payment_failures ORDER BY day ASC LIMIT 90")
-    resp["payment_failures"] = [dict(r) for r in cur.fetchall()]
-    cur.execute("SELECT * FROM vw_zero_result_search ORDER BY day ASC LIMIT 90")
-    resp["zero_result_search"] = [dict(r) for r in cur.fetchall()]
-    cur.execute("SELECT * FROM vw_plp_perf ORDER BY day ASC LIMIT 90")
-    resp["plp_perf"] = [dict(r) for r in cur.fetchall()]
-    cur.execute("SELECT * FROM vw_product_conv WHERE product IN ('Sneakers','Denim Jacket','Graphic Tee','Chino Pants','Hoodie') ORDER BY day ASC LIMIT 120")
-    resp["product_conv"] = [dict(r) for r in cur.fetchall()]
+    # Filter by role before querying so excluded views are never run
+    excluded = ROLE_EXCLUDED_METRICS.get(role, ())
+    queries = [(key, sql) for key, sql in METRIC_QUERIES if key not in excluded]
+    resp = run_queries_concurrently(get_db_connection, queries)
     
-    # Advanced e-com
-    cur.execute("SELECT * FROM vw_ecom_rates_by_day ORDER BY day ASC LIMIT 180")
-    resp["ecom_rates_by_day"] = [dict(r) for r in cur.fetchall()]
-    cur.execute("SELECT * FROM vw_ecom_mobile_desktop_delta ORDER BY day ASC LIMIT 90")
-    resp["ecom_mobile_desktop_delta"] = [dict(r) for r in cur.fetchall()]
-    cur.execute("SELECT * FROM vw_zero_result_top_share ORDER BY day ASC LIMIT 90")
-    resp["zero_result_top_share"] = [dict(r) for r in cur.fetchall()]
-    cur.execute("SELECT * FROM vw_sku_efficiency ORDER BY day ASC LIMIT 500")
-    resp["sku_efficiency"] = [dict(r) for r in cur.fetchall()]
-    cur.execute("SELECT * FROM vw_return_rate_trend ORDER BY day ASC LIMIT 180")
-    resp["return_rate_trend"] = [dict(r) for r in cur.fetchall()]
-    
-    # Marketing metrics
-    cur.execute("SELECT * FROM vw_mkt_roas_campaign ORDER BY day ASC, roas ASC LIMIT 180")
-    resp["mkt_roas_campaign"] = [dict(r) for r in cur.fetchall()]
-    cur.execute("SELECT * FROM vw_creative_ctr ORDER BY day ASC")
-    resp["creative_ctr"] = [dict(r) for r in cur.fetchall()]
-    cur.execute("SELECT * FROM vw_budget_pacing_var ORDER BY day ASC LIMIT 220")
-    resp["budget_pacing"] = [dict(r) for r in cur.fetchall()]
-    cur.execute("SELECT * FROM vw_disapprovals ORDER BY day ASC LIMIT 180")
-    resp["disapprovals"] = [dict(r) for r in cur.fetchall()]
-    cur.execute("SELECT * FROM vw_brand_health ORDER BY day ASC LIMIT 90")
-    resp["brand_health"] = [dict(r) for r in cur.fetchall()]
-    
-    # Advanced mkt
-    cur.execute("SELECT * FROM vw_campaign_kpis ORDER BY day ASC LIMIT 400")
-    resp["campaign_kpis"] = [dict(r) for r in cur.fetchall()]
-    cur.execute("SELECT * FROM vw_disapproval_rate ORDER BY day ASC LIMIT 180")
-    resp["disapproval_rate"] = [dict(r) for r in cur.fetchall()]
-    cur.execute("SELECT * FROM vw_brand_lift_proxy ORDER BY day ASC LIMIT 90")
-    resp["brand_lift_proxy"] = [dict(r) for r in cur.fetchall()]
-    cur.execute("SELECT * FROM vw_sentiment_social_roas ORDER BY day ASC LIMIT 90")
-    resp["sentiment_social_roas"] = [dict(r) for r in cur.fetchall()]
-    
-    conn.close()
+    return {"role": role, "metrics": resp}
+
+
+@ttl_cache(maxsize=16, ttl=METRICS_CACHE_TTL)
+def build_columnar_metrics_for_role(role: str) -> dict:
+    """
+    Build the metrics for a role with every series in columnar form.
     
-    # Filter by role
-    if role == "E-commerce Manager":
-        for k in [
-            "mkt_roas_campaign","creative_ctr","budget_pacing","disapprovals","brand_health",
-            "campaign_kpis","disapproval_rate","brand_lift_proxy","sentiment_social_roas"
-        ]:
-            resp.pop(k, None)
-    elif role == "Marketing Lead":
-        for k in [
-            "ecom_funnel","payment_failures","zero_result_search","plp_perf","product_conv",
-            "ecom_rates_by_day","ecom_mobile_desktop_delta","zero_result_top_share","sku_efficiency","return_rate_trend"
-        ]:
-            resp.pop(k, None)
+    Same content as build_metrics_for_role, but each series is a
+    {"cols": [...], "rows": [[...]]} table so column names are not repeated
+    per row in the /api/metrics payload. Cached like build_metrics_for_role;
+    treat the result as read-only.
     
-    return {"role": role, "metrics": resp}
+    Args:
+        role (str): The role name to build metrics for
+        
+    Returns:
+        dict: Dictionary containing role-specific metrics in columnar form
+    """
+    data = build_metrics_for_role(role)
+    metrics = {key: dicts_to_columnar(rows) for key, rows in data["metrics"].items()}
+    return {"role": data["role"], "metrics": metrics}
@@ -4,18 +4,24 @@ Custom role management models and utilities.
 This module handles custom role creation, management, and database operations.
 """
 
-import sqlite3
+import atexit
+import os
+import queue
+import threading
+import time
+from contextlib import closing
 import json
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from datetime import datetime
 from typing import Dict, Any, List, Optional
 
-from app.database import get_db_connection
-from app.database.role_db_schema import initialize_role_db
+from app.database import get_db_connection, open_role_db, open_untrusted_db, set_query_timeout, rows_to_dicts, quote_identifier
+from app.database.role_db_schema import initialize_role_db, ensure_role_db_schema
 from services.bigquery_loader import import_tables_to_sqlite
 from services.gemini_service import _generate_json_from_model, generate_chart_insights
-from google.cloud import bigquery
-from google.oauth2 import service_account
 import logging
 
 
@@ -23,6 +29,11 @@ import logging
 APP_ROOT = Path(__file__).parent.parent.parent.resolve()
 CUSTOM_DIR = APP_ROOT / "custom_roles"
 
+# Upper bound on concurrent Gemini chart-insight calls during role analysis
+CHART_INSIGHT_WORKERS = 6
+# Seconds each model-generated KPI or chart query may run while validated
+ANALYSIS_QUERY_TIMEOUT = 10
+
 def get_role_db_path(role_name: str) -> Path:
     """
     Get the database path for a custom role.
@@ -36,9 +47,168 @@ def get_role_db_path(role_name: str) -> Path:
     safe = "".join(ch for ch in role_name if ch.isalnum() or ch in ("-","_"," ")).strip().replace(" ", "_")
     return CUSTOM_DIR / f"{safe}.db"
 
+@lru_cache(maxsize=256)
+def _load_json_file(path_str: str, mtime_ns: int, size: int):
+    return orjson.loads(Path(path_str).read_bytes())
+
+def load_json_cached(path: Path):
+    """
+    Load a role config or plan JSON file, reusing the parsed result.
+    
+    The cache key includes the file's mtime and size, so any rewrite of the
+    file is picked up on the next call. Content queued by write_json_file()
+    but not yet on disk is returned instead of the stale file. The returned
+    object is shared between callers and must be treated as read-only; code
+    that edits and saves the file should use read_json_file().
+    
+    Args:
+        path (Path): Path to the JSON file
+        
+    Returns:
+        The parsed JSON content
+    """
+    pending = _pending_json_write(path)
+    if pending is not None:
+        return orjson.loads(pending)
+    st = path.stat()
+    return _load_json_file(str(path), st.st_mtime_ns, st.st_size)
+
+def read_json_file(path) -> Any:
+    """
+    Parse a role config or plan JSON file into a private, mutable object.
+    
+    Args:
+        path: Path to the JSON file
+        
+    Returns:
+        The parsed JSON content, including any write still queued for it
+    """
+    pending = _pending_json_write(path)
+    if pending is not None:
+        return orjson.loads(pending)
+    return orjson.loads(Path(path).read_bytes())
+
+# Rewrites of existing config and plan files are written by a background
+# thread so request handlers do not wait on the disk. Only the latest content
+# per path is kept; readers in this process see it through _pending_json_write().
+_json_write_queue = queue.Queue()
+# Each rewrite waits this long after being queued so that bursts of saves to
+# the same file (e.g. bulk chart edits) reach the disk once
+JSON_WRITE_DEBOUNCE = 0.5
+_pending_json_writes = {}
+_pending_json_lock = threading.Lock()
+# Serializes the tmp-file + os.replace of the writer thread and flushes
+_json_file_lock = threading.Lock()
+
+def _pending_json_write(path):
+    with _pending_json_lock:
+        return _pending_json_writes.get(os.path.abspath(path))
+
+def json_file_exists(path) -> bool:
+    """
+    Check whether a role config or plan JSON file exists.
+    
+    Args:
+        path: Path to the JSON file
+        
+    Returns:
+        bool: True if the file is on disk or a write for it is still queued
+    """
+    return _pending_json_write(path) is not None or os.path.exists(path)
+
+def _write_json_now(key, data):
+    """
+    Atomically replace the file at key with data, then drop it from the
+    pending writes. Does nothing if data is no longer the latest content
+    queued for key: a newer write owns the file then, and writing the old
+    content after it has been flushed would leave the file stale.
+    """
+    with _json_file_lock:
+        with _pending_json_lock:
+            if _pending_json_writes.get(key) is not data:
+                return
+        tmp = key + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, key)
+        with _pending_json_lock:
+            if _pending_json_writes.get(key) is data:
+                del _pending_json_writes[key]
+
+def write_json_file(path, obj):
+    """
+    Write a role config or plan JSON file.
+    
+    The object is serialized immediately, so later changes to it do not leak
+    into the file. A file that is not on disk yet is written straight away,
+    so it is visible to existence checks, directory listings and other
+    worker processes as soon as this returns. Rewrites of an existing file
+    are queued: the writer waits JSON_WRITE_DEBOUNCE seconds so that
+    repeated saves collapse into one write. Either way the file is replaced
+    atomically via os.replace, which also bumps the directory mtime the role
+    listing is cached on.
+    
+    Args:
+        path: Destination path of the JSON file
+        obj: JSON-serializable object to write
+    """
+    key = os.path.abspath(path)
+    data = orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    with _pending_json_lock:
+        _pending_json_writes[key] = data
+    if not os.path.exists(key):
+        _write_json_now(key, data)
+        return
+    _json_write_queue.put((key, time.monotonic()))
+
+def _json_writer():
+    while True:
+        key, queued_at = _json_write_queue.get()
+        try:
+            delay = queued_at + JSON_WRITE_DEBOUNCE - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with _pending_json_lock:
+                data = _pending_json_writes.get(key)
+            # A newer write for the same path may already have been flushed;
+            # _write_json_now checks again once it holds the file lock
+            if data is not None:
+                _write_json_now(key, data)
+        except Exception as e:
+            logging.error(f"Failed to write {key}: {e}")
+        finally:
+            _json_write_queue.task_done()
+
+threading.Thread(target=_json_writer, name="json-writer", daemon=True).start()
+
+@atexit.register
+def flush_json_writes(path=None):
+    """
+    Write queued config/plan content to disk now, without waiting for the
+    debounce delay.
+    
+    Args:
+        path: Only flush this file; all queued files if omitted
+    """
+    with _pending_json_lock:
+        if path is None:
+            pending = list(_pending_json_writes.items())
+        else:
+            key = os.path.abspath(path)
+            pending = [(key, _pending_json_writes[key])] if key in _pending_json_writes else []
+    for key, data in pending:
+        try:
+            _write_json_now(key, data)
+        except Exception as e:
+            logging.error(f"Failed to write {key}: {e}")
+
 # Helper to get BQ client from service account
 def get_bq_client(role_name: str, sa_info: Optional[Dict[str, Any]] = None):
     """Initializes a BigQuery client from service account info (dictionary)."""
+    # The Google Cloud client libraries are slow to import and only needed
+    # when a role's data is imported, so they are loaded here
+    from google.cloud import bigquery
+    from google.oauth2 import service_account
     if not sa_info:
         logging.warning(f"Service account info not provided for role: {role_name}. Falling back to default credentials.")
         try:
@@ -115,7 +285,8 @@ class CustomRoleManager:
         }
         
         config_path = self.custom_dir / f"{role_name.replace(' ','_')}.json"
-        config_path.write_text(json.dumps(config, ensure_ascii=False, indent=2))
+        write_json_file(config_path, config)
+        flush_json_writes(config_path)
         
         # Optionally stash service account JSON (avoid mixing with repo)
         if sa_json.strip():
@@ -148,14 +319,14 @@ class CustomRoleManager:
 
         cfg_path = self.custom_dir / f"{role_name.replace(' ','_')}.json"
         logging.info(f"Looking for config file at: {cfg_path}")
-        if not cfg_path.exists():
+        if not json_file_exists(cfg_path):
             logging.error(f"Config file not found for role: {role_name}")
             return {"ok": False, "error": "Role configuration not found."}
 
         try:
-            cfg = json.loads(cfg_path.read_text())
+            cfg = read_json_file(cfg_path)
             logging.info("Successfully loaded role configuration.")
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             logging.error(f"Failed to parse config file for role: {role_name}")
             return {"ok": False, "error": "Role configuration file is corrupted."}
 
@@ -164,9 +335,9 @@ class CustomRoleManager:
         if sa_path.exists():
             logging.info("Service account file found, attempting to load.")
             try:
-                sa_info = json.loads(sa_path.read_text())
+                sa_info = orjson.loads(sa_path.read_bytes())
                 logging.info("Successfully loaded service account file.")
-            except json.JSONDecodeError:
+            except orjson.JSONDecodeError:
                 logging.error(f"Failed to parse service account file for role: {role_name}")
                 return {"ok": False, "error": "Service account file is corrupted and not valid JSON."}
         else:
@@ -186,10 +357,6 @@ class CustomRoleManager:
         total_records_imported = 0
         schema_descriptions = {}
 
-        # Prepare SQLite connection once
-        conn = sqlite3.connect(str(get_role_db_path(role_name)))
-        cur = conn.cursor()
-
         # Simple BigQuery->SQLite type mapping
         def map_bq_type_to_sqlite(field_type: str) -> str:
             t = (field_type or "").upper()
@@ -199,58 +366,73 @@ class CustomRoleManager:
             if t in ("TIMESTAMP", "DATETIME", "DATE", "TIME"): return "TEXT"
             return "TEXT"
 
-        for table_name in cfg.get("bq_tables", []):
+        # Load every table over one connection and commit once at the end. The
+        # import can simply be re-run if interrupted, so skip fsyncs as well.
+        with closing(open_role_db(get_role_db_path(role_name))) as conn:
+            conn.execute("PRAGMA synchronous=OFF")
             try:
-                logging.info(f"Importing table: {table_name}")
-                # Fetch table and column metadata (descriptions)
-                table_ref = client.get_table(f'{cfg['gcp_project']}.{cfg['bq_dataset']}.{table_name}')
-                schema_descriptions[table_name] = {
-                    "table_description": table_ref.description,
-                    "columns": {field.name: field.description for field in table_ref.schema}
-                }
-
-                # Create SQLite table with mapped schema
-                columns_sql = ", ".join(
-                    [f'"{f.name}" {map_bq_type_to_sqlite(str(f.field_type))}' for f in table_ref.schema]
-                )
-                cur.execute(f'CREATE TABLE IF NOT EXISTS "{table_name}" ({columns_sql})')
-
-                # Fetch data from BigQuery
-                full_table_name = f"`{cfg['gcp_project']}.{cfg['bq_dataset']}.{table_name}`"
-                query = f"SELECT * FROM {full_table_name}"
-                rows = client.query(query).result()
-
-                # Insert rows into SQLite in batches
-                placeholders = ",".join(["?"] * len(table_ref.schema))
-                insert_sql = f'INSERT INTO "{table_name}" VALUES ({placeholders})'
-                batch = []
-                batch_size = 500
-                for row in rows:
-                    # Preserve BigQuery field order
-                    values = [row[f.name] for f in table_ref.schema]
-                    batch.append(values)
-                    if len(batch) >= batch_size:
-                        cur.executemany(insert_sql, batch)
-                        conn.commit()
-                        total_records_imported += len(batch)
-                        batch.clear()
-                if batch:
-                    cur.executemany(insert_sql, batch)
-                    conn.commit()
-                    total_records_imported += len(batch)
-                logging.info(f"Successfully imported {total_records_imported} records for table {table_name}.")
+                cur = conn.cursor()
+
+                for table_name in cfg.get("bq_tables", []):
+                    try:
+                        logging.info(f"Importing table: {table_name}")
+                        # Fetch table and column metadata (descriptions)
+                        table_ref = client.get_table(f'{cfg['gcp_project']}.{cfg['bq_dataset']}.{table_name}')
+                        schema_descriptions[table_name] = {
+                            "table_description": table_ref.description,
+                            "columns": {field.name: field.description for field in table_ref.schema}
+                        }
+
+                        # Create SQLite table with mapped schema
+                        columns_sql = ", ".join(
+                            [f"{quote_identifier(f.name)} {map_bq_type_to_sqlite(str(f.field_type))}" for f in table_ref.schema]
+                        )
+                        cur.execute(f"CREATE TABLE IF NOT EXISTS {quote_identifier(table_name)} ({columns_sql})")
+
+                        # Fetch data from BigQuery
+                        full_table_name = f"`{cfg['gcp_project']}.{cfg['bq_dataset']}.{table_name}`"
+                        query = f"SELECT * FROM {full_table_name}"
+                        rows = client.query(query).result()
+
+                        # Insert rows into SQLite in batches
+                        placeholders = ",".join(["?"] * len(table_ref.schema))
+                        insert_sql = f"INSERT INTO {quote_identifier(table_name)} VALUES ({placeholders})"
+                        batch = []
+                        batch_size = 500
+                        for row in rows:
+                            # Preserve BigQuery field order
+                            values = [row[f.name] for f in table_ref.schema]
+                            batch.append(values)
+                            if len(batch) >= batch_size:
+                                cur.executemany(insert_sql, batch)
+                                total_records_imported += len(batch)
+                                batch.clear()
+                        if batch:
+                            cur.executemany(insert_sql, batch)
+                            total_records_imported += len(batch)
+                        logging.info(f"Successfully imported {total_records_imported} records for table {table_name}.")
+
+                    except Exception as e:
+                        conn.rollback()
+                        logging.error(f"Error importing table {table_name}: {e}")
+                        return {"ok": False, "error": f"Error importing table {table_name}: {str(e)}"}
+
+                conn.commit()
+                # Refresh planner statistics for the freshly loaded tables
+                conn.execute("ANALYZE")
+            finally:
+                # The connection goes back to the pool, so restore the default
+                # even when the import, commit or ANALYZE failed
+                if conn.in_transaction:
+                    conn.rollback()
+                conn.execute("PRAGMA synchronous=NORMAL")
 
-            except Exception as e:
-                conn.rollback()
-                logging.error(f"Error importing table {table_name}: {e}")
-                return {"ok": False, "error": f"Error importing table {table_name}: {str(e)}"}
-        
-        conn.close()
         # Update config file with total records and schema descriptions
         try:
             cfg["total_records"] = total_records_imported
             cfg["schema_descriptions"] = schema_descriptions
-            cfg_path.write_text(json.dumps(cfg, ensure_ascii=False, indent=2))
+            write_json_file(cfg_path, cfg)
+            flush_json_writes(cfg_path)
         except Exception as e:
             # This is not a fatal error, so we just log it and continue
             logging.warning(f"Could not update config file for {role_name}: {str(e)}")
@@ -269,161 +451,176 @@ class CustomRoleManager:
         if not role_db.exists():
             return {"ok": False, "error": "Role DB not found"}
 
-        # --- 1. GATHER CONTEXT & PATCH SCHEMA ---
-        conn = sqlite3.connect(str(role_db))
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
+        # Creates chart_insights (and patches older layouts) once per process
+        ensure_role_db_schema(role_db)
 
-        # Patch: Add chart_title column to chart_insights if it doesn't exist
-        try:
-            cur.execute("ALTER TABLE chart_insights ADD COLUMN chart_title TEXT NOT NULL DEFAULT 'Untitled Chart'")
-            conn.commit()
-            logging.info("Patched chart_insights table with chart_title column.")
-        except sqlite3.OperationalError as e:
-            if "duplicate column name" not in str(e):
-                raise # Re-raise if it's not the error we expect
-
-        internal_tables = {
-            'proposed_actions', 'saved_analyses', 'saved_actions', 
-            'chart_insights', 'action_notes', 'priority_notes',
-            'priority_insights', 'analysis_runs'
-        }
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
-        all_tables = [r[0] for r in cur.fetchall()]
-        tables = [t for t in all_tables if t not in internal_tables]
+        # One connection covers schema inspection, query validation and the
+        # insight writes, which are committed together at the end.
+        with closing(open_role_db(role_db)) as conn:
+            # --- 1. GATHER CONTEXT ---
+            cur = conn.cursor()
 
-        if not tables:
-            return {"ok": False, "error": "No data tables found in database"}
-        table_name = tables[0] # Focus on the single imported table
+            internal_tables = {
+                'proposed_actions', 'saved_analyses', 'saved_actions', 
+                'chart_insights', 'action_notes', 'priority_notes',
+                'ai_conversations', 'priority_insights', 'analysis_runs'
+            }
+            cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
+            all_tables = [r[0] for r in cur.fetchall()]
+            tables = [t for t in all_tables if t not in internal_tables]
+
+            if not tables:
+                return {"ok": False, "error": "No data tables found in database"}
+            table_name = tables[0] # Focus on the single imported table
+
+            # Load schema descriptions from config file
+            cfg_path = self.custom_dir / f"{role_name.replace(' ','_')}.json"
+            schema_descriptions = {}
+            if json_file_exists(cfg_path):
+                try:
+                    cfg = load_json_cached(cfg_path)
+                    schema_descriptions = cfg.get("schema_descriptions", {})
+                except Exception: pass
 
-        # Load schema descriptions from config file
-        cfg_path = self.custom_dir / f"{role_name.replace(' ','_')}.json"
-        schema_descriptions = {}
-        if cfg_path.exists():
+            # Build the data analysis context object
+            data_analysis = {"role_name": role_name, "schema_descriptions": schema_descriptions, "tables": {}}
             try:
-                cfg = json.loads(cfg_path.read_text())
-                schema_descriptions = cfg.get("schema_descriptions", {})
-            except Exception: pass
-
-        # Build the data analysis context object
-        data_analysis = {"role_name": role_name, "schema_descriptions": schema_descriptions, "tables": {}}
-        try:
-            cur.execute(f'PRAGMA table_info("{table_name}")')
-            columns = [{"name": r[1], "type": r[2], "nullable": not r[3]} for r in cur.fetchall()]
-            column_names_list = [c['name'] for c in columns]
-            cur.execute(f'SELECT COUNT(1) as cnt FROM "{table_name}"')
-            row_count = cur.fetchone()["cnt"]
-            cur.execute(f'SELECT * FROM "{table_name}" LIMIT 5')
-            sample_data = [dict(r) for r in cur.fetchall()]
-            data_analysis["tables"][table_name] = {
-                "row_count": row_count,
-                "columns": columns,
-                "sample_data": sample_data
-            }
-        except Exception as e:
-            conn.close()
-            return {"ok": False, "error": f"Failed to analyze table schema: {e}"}
+                cur.execute("SELECT * FROM pragma_table_info(?)", (table_name,))
+                columns = [{"name": r[1], "type": r[2], "nullable": not r[3]} for r in cur.fetchall()]
+                column_names_list = [c['name'] for c in columns]
+                cur.execute(f"SELECT COUNT(1) as cnt FROM {quote_identifier(table_name)}")
+                row_count = cur.fetchone()["cnt"]
+                cur.execute(f"SELECT * FROM {quote_identifier(table_name)} LIMIT 5")
+                sample_data = rows_to_dicts(cur)
+                data_analysis["tables"][table_name] = {
+                    "row_count": row_count,
+                    "columns": columns,
+                    "sample_data": sample_data
+                }
+            except Exception as e:
+                return {"ok": False, "error": f"Failed to analyze table schema: {e}"}
         
-        context_json = json.dumps(data_analysis, ensure_ascii=False, indent=2)
-        logging.info(f"--- PROMPT CONTEXT ---\n{context_json}")
+            context_json = orjson.dumps(data_analysis, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+            logging.info(f"--- PROMPT CONTEXT ---\n{context_json}")
 
-        try:
-            # --- 2. STEP 1: Identify Key Concepts ---
-            concepts_prompt = f"""You are a data analyst. Analyze the schema and data for the table '{table_name}'. 
-            Identify the key business concepts, primary metrics, and important dimensions available in this table. 
-            Return a JSON object with three keys: 'key_concepts' (list of strings), 'key_metrics' (list of strings), and 'key_dimensions' (list of strings)."""
-            concepts = _generate_json_from_model(concepts_prompt, context_json)
-
-            # --- 3. STEP 2: Generate KPIs (with dynamic examples) ---
-            numeric_col_example = "some_column"
-            for col in reversed(column_names_list):
-                if any(kw in col.lower() for kw in ['sales', 'amount', 'price', 'qty', 'count']):
-                    numeric_col_example = col
-                    break
-            else:
-                if column_names_list:
-                    numeric_col_example = column_names_list[-1]
-
-            kpis_prompt = f"""You are a SQL expert generating SQLite queries for a table named '{table_name}'.
-            The available columns are: {json.dumps(column_names_list)}.
-            CRITICAL RULE: You MUST use ONLY these column names in your queries. Any other column name is invalid.
-            For example, a correct query is 'SELECT SUM("{numeric_col_example}") FROM "{table_name}"'. An INCORRECT query is 'SELECT SUM(revenue) FROM "{table_name}"' because 'revenue' is not in the list of available columns.
-            Given these rules, generate a list of relevant KPIs. Each KPI must be a JSON object with 'id', 'title', 'description', and a 'formula'. The 'formula' must be a complete, valid SQLite SELECT statement."""
-            kpis_response = _generate_json_from_model(kpis_prompt, context_json)
-            kpis = kpis_response.get("kpis", []) if isinstance(kpis_response, dict) else kpis_response
-
-            # --- 4. STEP 3: Generate Charts (with dynamic examples) ---
-            text_col_example = "some_category"
-            for col in column_names_list:
-                if any(kw in col.lower() for kw in ['name', 'area', 'category', 'product', 'region']):
-                    text_col_example = col
-                    break
-            else:
-                if column_names_list:
-                    text_col_example = column_names_list[0]
-
-            charts_prompt = f"""You are a SQL expert generating SQLite queries for a table named '{table_name}'.
-            The available columns are: {json.dumps(column_names_list)}.
-            CRITICAL RULE: You MUST use ONLY these column names in your queries. Any other column name is invalid.
-            For example, a correct query is 'SELECT "{text_col_example}", SUM("{numeric_col_example}") FROM "{table_name}" GROUP BY "{text_col_example}"'. An INCORRECT query is 'SELECT product, SUM(sales) FROM "{table_name}" GROUP BY product' because 'product' and 'sales' are not in the list of available columns.
-            Given these rules, generate a list of relevant visualizations. Each chart must be a JSON object with 'id', 'title', 'description', a 'type' ('bar', 'line', 'pie', or 'table'), and a 'query_sql'. The 'query_sql' must be a complete, valid SQLite query."""
-            charts_response = _generate_json_from_model(charts_prompt, context_json)
-            charts = charts_response.get("charts", []) if isinstance(charts_response, dict) else charts_response
-
-            # --- 5. VALIDATE & ENHANCE ---
-            validated_kpis = []
-            for kpi in kpis:
-                try:
-                    cur.execute(kpi['formula'])
-                    cur.fetchone()
-                    kpi['table'] = table_name # Add table name for frontend
-                    validated_kpis.append(kpi)
-                except Exception as e:
-                    logging.warning(f"Discarding invalid KPI '{kpi.get('title')}': {e}")
-
-            validated_charts = []
-            for chart in charts:
-                try:
-                    cur.execute(chart['query_sql'])
-                    chart_data = [dict(r) for r in cur.fetchall()]
-                    if chart_data:
-                        validated_charts.append(chart)
-                        # Generate and store enhanced insights for the valid chart
-                        insights = generate_chart_insights(chart.get('title'), chart_data, chart.get('type'))
+            try:
+                # --- 2. STEP 1: Identify Key Concepts ---
+                concepts_prompt = f"""You are a data analyst. Analyze the schema and data for the table '{table_name}'. 
+                Identify the key business concepts, primary metrics, and important dimensions available in this table. 
+                Return a JSON object with three keys: 'key_concepts' (list of strings), 'key_metrics' (list of strings), and 'key_dimensions' (list of strings)."""
+                concepts = _generate_json_from_model(concepts_prompt, context_json)
+
+                # --- 3. STEP 2: Generate KPIs (with dynamic examples) ---
+                numeric_col_example = "some_column"
+                for col in reversed(column_names_list):
+                    if any(kw in col.lower() for kw in ['sales', 'amount', 'price', 'qty', 'count']):
+                        numeric_col_example = col
+                        break
+                else:
+                    if column_names_list:
+                        numeric_col_example = column_names_list[-1]
+
+                kpis_prompt = f"""You are a SQL expert generating SQLite queries for a table named '{table_name}'.
+                The available columns are: {json.dumps(column_names_list)}.
+                CRITICAL RULE: You MUST use ONLY these column names in your queries. Any other column name is invalid.
+                For example, a correct query is 'SELECT SUM("{numeric_col_example}") FROM "{table_name}"'. An INCORRECT query is 'SELECT SUM(revenue) FROM "{table_name}"' because 'revenue' is not in the list of available columns.
+                Given these rules, generate a list of relevant KPIs. Each KPI must be a JSON object with 'id', 'title', 'description', and a 'formula'. The 'formula' must be a complete, valid SQLite SELECT statement."""
+                kpis_response = _generate_json_from_model(kpis_prompt, context_json)
+                kpis = kpis_response.get("kpis", []) if isinstance(kpis_response, dict) else kpis_response
+
+                # --- 4. STEP 3: Generate Charts (with dynamic examples) ---
+                text_col_example = "some_category"
+                for col in column_names_list:
+                    if any(kw in col.lower() for kw in ['name', 'area', 'category', 'product', 'region']):
+                        text_col_example = col
+                        break
+                else:
+                    if column_names_list:
+                        text_col_example = column_names_list[0]
+
+                charts_prompt = f"""You are a SQL expert generating SQLite queries for a table named '{table_name}'.
+                The available columns are: {json.dumps(column_names_list)}.
+                CRITICAL RULE: You MUST use ONLY these column names in your queries. Any other column name is invalid.
+                For example, a correct query is 'SELECT "{text_col_example}", SUM("{numeric_col_example}") FROM "{table_name}" GROUP BY "{text_col_example}"'. An INCORRECT query is 'SELECT product, SUM(sales) FROM "{table_name}" GROUP BY product' because 'product' and 'sales' are not in the list of available columns.
+                Given these rules, generate a list of relevant visualizations. Each chart must be a JSON object with 'id', 'title', 'description', a 'type' ('bar', 'line', 'pie', or 'table'), and a 'query_sql'. The 'query_sql' must be a complete, valid SQLite query."""
+                charts_response = _generate_json_from_model(charts_prompt, context_json)
+                charts = charts_response.get("charts", []) if isinstance(charts_response, dict) else charts_response
+
+                # --- 5. VALIDATE & ENHANCE ---
+                # The model-written SQL runs on a private read-only connection,
+                # so it can neither modify the data nor leave state on a
+                # pooled connection
+                validated_kpis = []
+                validated_charts = []
+                chart_datasets = []
+                with closing(open_untrusted_db(role_db)) as sandbox:
+                    for kpi in kpis:
+                        try:
+                            set_query_timeout(sandbox, ANALYSIS_QUERY_TIMEOUT)
+                            sandbox.execute(kpi['formula']).fetchone()
+                            kpi['table'] = table_name # Add table name for frontend
+                            validated_kpis.append(kpi)
+                        except Exception as e:
+                            logging.warning(f"Discarding invalid KPI '{kpi.get('title')}': {e}")
+
+                    for chart in charts:
+                        try:
+                            set_query_timeout(sandbox, ANALYSIS_QUERY_TIMEOUT)
+                            chart_data = rows_to_dicts(sandbox.execute(chart['query_sql']))
+                            if chart_data:
+                                validated_charts.append(chart)
+                                chart_datasets.append(chart_data)
+                        except Exception as e:
+                            logging.warning(f"Discarding invalid chart '{chart.get('title')}': {e}")
+
+                # Generate enhanced insights for the valid charts. Each is an
+                # independent Gemini call, so they run concurrently; rows are
+                # stored in one batch below.
+                def chart_insights(chart, chart_data):
+                    try:
+                        return generate_chart_insights(chart.get('title'), chart_data, chart.get('type'))
+                    except Exception as e:
+                        logging.warning(f"Could not generate insights for chart '{chart.get('title')}': {e}")
+                        return None
+
+                insight_rows = []
+                if validated_charts:
+                    with ThreadPoolExecutor(max_workers=min(CHART_INSIGHT_WORKERS, len(validated_charts))) as pool:
+                        all_insights = list(pool.map(chart_insights, validated_charts, chart_datasets))
+                    for chart, insights in zip(validated_charts, all_insights):
                         if insights and chart.get('id'):
-                            cur.execute("""CREATE TABLE IF NOT EXISTS chart_insights (id INTEGER PRIMARY KEY, chart_id TEXT NOT NULL UNIQUE, chart_title TEXT, insights_json TEXT, created_at TEXT, updated_at TEXT)""")
-                            cur.execute("""INSERT INTO chart_insights (chart_id, chart_title, insights_json, updated_at) VALUES (?, ?, ?, datetime('now'))
-                                       ON CONFLICT(chart_id) DO UPDATE SET insights_json=excluded.insights_json, chart_title=excluded.chart_title, updated_at=excluded.updated_at;""", 
-                                       (chart['id'], chart['title'], json.dumps(insights)))
-                except Exception as e:
-                    logging.warning(f"Discarding invalid chart '{chart.get('title')}': {e}")
-
-            # --- 6. FINALIZE PLAN ---
-            final_plan = {
-                "kpis": validated_kpis,
-                "charts": validated_charts,
-                "insights": concepts.get('key_concepts', []) if isinstance(concepts, dict) else []
-            }
-            conn.commit()
+                            insight_rows.append((chart['id'], chart['title'], orjson.dumps(insights).decode()))
+
+                if insight_rows:
+                    cur.executemany("""INSERT INTO chart_insights (chart_id, chart_title, insights_json, updated_at) VALUES (?, ?, ?, datetime('now'))
+                                    ON CONFLICT(chart_id) DO UPDATE SET insights_json=excluded.insights_json, chart_title=excluded.chart_title, updated_at=excluded.updated_at;""",
+                                    insight_rows)
+
+                # --- 6. FINALIZE PLAN ---
+                final_plan = {
+                    "kpis": validated_kpis,
+                    "charts": validated_charts,
+                    "insights": concepts.get('key_concepts', []) if isinstance(concepts, dict) else []
+                }
+                conn.commit()
 
-        except Exception as e:
-            return {"ok": False, "error": f"Failed during analysis generation: {str(e)}"}
-        finally:
-            conn.close()
+            except Exception as e:
+                return {"ok": False, "error": f"Failed during analysis generation: {str(e)}"}
 
         # Save the final validated plan
         plan_path = self.custom_dir / f"{role_name.replace(' ','_')}.plan.json"
-        plan_path.write_text(json.dumps(final_plan, ensure_ascii=False, indent=2))
+        write_json_file(plan_path, final_plan)
+        flush_json_writes(plan_path)
         
         return {"ok": True, "plan": final_plan}
     
     def get_role_config(self, role_name: str) -> Optional[Dict[str, Any]]:
-        """Gets the configuration for a single role."""
+        """Gets the configuration for a single role (shared cached copy; do not mutate)."""
         safe_role_name = "".join(ch for ch in role_name if ch.isalnum() or ch in ("-","_"," ")).strip().replace(" ", "_")
         config_path = self.custom_dir / f"{safe_role_name}.json"
-        if config_path.exists():
+        if json_file_exists(config_path):
             try:
-                return json.loads(config_path.read_text())
+                return load_json_cached(config_path)
             except Exception:
                 return None
         return None
@@ -445,7 +642,7 @@ class CustomRoleManager:
                 if config_file.name.endswith(".plan.json") or config_file.name.endswith(".sa.json"):
                     continue
                 try:
-                    config = json.loads(config_file.read_text())
+                    config = load_json_cached(config_file)
                     role_name = config.get("role_name", "")
                     if role_name:
                         custom_roles.append({
@@ -52,7 +52,7 @@ cur.executescript(
         id INTEGER PRIMARY KEY,
         role TEXT NOT NULL,
         action_type TEXT NOT NULL,
-        details_json TEXT,
+        details_json TEXT CHECK (details_json IS NULL OR json_valid(details_json)),
         created_ts TEXT NOT NULL DEFAULT (datetime('now'))
     );
 
@@ -1,3 +1,5 @@
+import ast
+import json
 import sqlite3
 import os
 from pathlib import Path
@@ -32,5 +34,35 @@ def migrate():
         except Exception as e:
             print(f"Error migrating {db_path}: {e}")
 
+def migrate_action_details():
+    """
+    Rewrites actions.details_json rows in the shared database as valid JSON.
+    
+    Older versions stored str(details), a Python repr that json_extract() and
+    json.loads() cannot read. Rows that don't parse as either are left alone.
+    """
+    db_path = Path('data') / 'cfc.db'
+    if not db_path.exists():
+        return
+    
+    print(f"Migrating action details in {db_path}...")
+    conn = sqlite3.connect(str(db_path))
+    try:
+        rows = conn.execute(
+            "SELECT id, details_json FROM actions WHERE details_json IS NOT NULL AND NOT json_valid(details_json)"
+        ).fetchall()
+        fixed = []
+        for action_id, details in rows:
+            try:
+                fixed.append((json.dumps(ast.literal_eval(details)), action_id))
+            except (ValueError, SyntaxError):
+                print(f"  - Could not parse details of action {action_id}. Skipping.")
+        with conn:
+            conn.executemany("UPDATE actions SET details_json = ? WHERE id = ?", fixed)
+        print(f"  - Rewrote {len(fixed)} action details as JSON")
+    finally:
+        conn.close()
+
 if __name__ == '__main__':
     migrate()
+    migrate_action_details()
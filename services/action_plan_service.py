@@ -6,9 +6,11 @@ and interacting with the structured "Next Steps" which are treated as
 an action plan. This includes generating sub-tasks via AI and
 updating the completion status of tasks.
 """
-import json
-import sqlite3
+import orjson
+from contextlib import closing
 from app.database.connection import get_role_db_connection
+from app.database.schema import table_columns
+from services.gemini_service import _generate_json_from_model, _generate_content_from_model
 import logging
 
 logger = logging.getLogger(__name__)
@@ -27,105 +29,115 @@ def update_task_status_in_db(user_role, action_id, task_id, new_status):
     Returns:
         dict: The updated action object, or None if not found.
     """
-    conn = get_role_db_connection(user_role)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    return update_task_statuses_in_db(user_role, action_id, [(task_id, new_status)])
 
-    logger.info(f"Attempting to update task. action_id='{action_id}', task_id='{task_id}', new_status='{new_status}'")
 
-    # The action could be in either 'saved_actions' or 'proposed_actions'
-    tables_to_check = ["saved_actions", "proposed_actions"]
-    action_data = None
-    target_table = None
+def _set_task_status(next_steps, task_id, new_status):
+    """
+    Set the status of the step or sub-task with the given ID.
 
-    for table in tables_to_check:
-        cursor.execute(f"SELECT * FROM {table} WHERE action_id = ?", (action_id,))
-        action_data = cursor.fetchone()
-        if action_data:
-            target_table = table
-            break
-    
-    if not action_data or 'next_steps' not in action_data.keys() or not action_data['next_steps']:
-        logger.warning(f"Action not found or no next_steps for action_id='{action_id}'")
-        conn.close()
-        return None
+    Args:
+        next_steps (list): Parsed next_steps of an action, updated in place
+        task_id (str): ID of the step or sub-task (case-insensitive)
+        new_status (str): The new status for the task
 
-    try:
-        next_steps = json.loads(action_data['next_steps'])
-        task_found = False
-        logger.debug(f"Searching for task_id='{task_id}' in next_steps for action '{action_id}': {next_steps}")
+    Returns:
+        bool: True if the task was found
+    """
+    for step in next_steps:
+        step_id = str(step.get('id', 'N/A'))
+        logger.debug(f"Comparing incoming task_id='{task_id.lower()}' with step_id='{step_id.lower()}'")
+        if step_id.lower() == task_id.lower():
+            step['status'] = new_status
+            return True
+        for sub_task in step.get('sub_tasks') or []:
+            sub_task_id = str(sub_task.get('id', 'N/A'))
+            logger.debug(f"Comparing incoming task_id='{task_id.lower()}' with sub_task_id='{sub_task_id.lower()}'")
+            if sub_task_id.lower() == task_id.lower():
+                sub_task['status'] = new_status
+                return True
+    return False
+
+
+def update_task_statuses_in_db(user_role, action_id, updates):
+    """
+    Updates the status of several tasks of one action in a single write.
 
-        for step in next_steps:
-            step_id = str(step.get('id', 'N/A'))
-            logger.debug(f"Comparing incoming task_id='{task_id.lower()}' with step_id='{step_id.lower()}'")
-            if step_id.lower() == task_id.lower():
-                step['status'] = new_status
-                task_found = True
-                break
-            if 'sub_tasks' in step and step['sub_tasks']:
-                for sub_task in step['sub_tasks']:
-                    sub_task_id = str(sub_task.get('id', 'N/A'))
-                    logger.debug(f"Comparing incoming task_id='{task_id.lower()}' with sub_task_id='{sub_task_id.lower()}'")
-                    if str(sub_task.get('id')).lower() == task_id.lower():
-                        sub_task['status'] = new_status
-                        task_found = True
-                        break
-            if task_found:
+    The action's next_steps are read and written back inside one IMMEDIATE
+    transaction, so the whole batch costs one commit and concurrent updates
+    to the same action cannot overwrite each other.
+
+    Args:
+        user_role (str): The role of the user, used to connect to the correct DB.
+        action_id (str): The ID of the action to update.
+        updates (list): (task_id, new_status) pairs, applied in order.
+
+    Returns:
+        dict: The updated action object, or None if the action or any of the
+        tasks was not found (nothing is saved in that case).
+    """
+    logger.info(f"Attempting to update {len(updates)} task(s) for action_id='{action_id}': {updates}")
+
+    with closing(get_role_db_connection(user_role)) as conn:
+        cursor = conn.cursor()
+        # Take the write lock before reading, so the read-modify-write is atomic
+        cursor.execute("BEGIN IMMEDIATE")
+
+        # The action could be in either 'saved_actions' or 'proposed_actions'
+        action_data = None
+        target_table = None
+        for table in ("saved_actions", "proposed_actions"):
+            cursor.execute(f"SELECT next_steps FROM {table} WHERE action_id = ?", (action_id,))
+            action_data = cursor.fetchone()
+            if action_data:
+                target_table = table
                 break
-        
-        if not task_found:
-            logger.warning(f"Task with id='{task_id}' not found in action='{action_id}'")
-            conn.close()
-            return None # Or raise an error that the task_id was not found
 
-        # Save the updated JSON back to the database
+        if not action_data or not action_data['next_steps']:
+            logger.warning(f"Action not found or no next_steps for action_id='{action_id}'")
+            return None
+
+        try:
+            next_steps = orjson.loads(action_data['next_steps'])
+            for task_id, new_status in updates:
+                if not _set_task_status(next_steps, str(task_id), new_status):
+                    logger.warning(f"Task with id='{task_id}' not found in action='{action_id}'")
+                    return None
+        except (orjson.JSONDecodeError, TypeError, AttributeError):
+            return None
+
+        # Save the updated JSON back to the database and get the updated action
         cursor.execute(
-            f"UPDATE {target_table} SET next_steps = ?, updated_ts = CURRENT_TIMESTAMP WHERE action_id = ?",
-            (json.dumps(next_steps), action_id)
+            f"UPDATE {target_table} SET next_steps = ?, updated_ts = CURRENT_TIMESTAMP WHERE action_id = ? RETURNING *",
+            (orjson.dumps(next_steps).decode(), action_id)
         )
+        updated_action = cursor.fetchone()
         conn.commit()
 
-        # Fetch the updated action to return
-        cursor.execute(f"SELECT * FROM {target_table} WHERE action_id = ?", (action_id,))
-        updated_action = cursor.fetchone()
-        
-        conn.close()
-        
-        return dict(updated_action) if updated_action else None
+    return dict(updated_action) if updated_action else None
 
-    except (json.JSONDecodeError, TypeError):
-        conn.close()
-        return None
-    except Exception as e:
-        conn.close()
-        raise e
-
-def _get_db_schema(user_role):
+def _get_db_schema(cursor):
     """
     Retrieves the database schema (table and column names).
     
     Args:
-        user_role (str): The user's role to connect to the correct DB.
+        cursor (sqlite3.Cursor): Cursor on the role's database, so the caller's
+            pooled connection is reused instead of checking out a second one.
         
     Returns:
         str: A string representation of the database schema.
     """
-    conn = get_role_db_connection(user_role)
-    cursor = conn.cursor()
-    
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    tables = cursor.fetchall()
+    tables = [row[0] for row in cursor.fetchall()]
+    # Column definitions for every table in one prepared statement
+    columns_by_table = table_columns(cursor, tables)
     
     schema_str = ""
     for table_name in tables:
-        table_name = table_name[0]
         schema_str += f"Table '{table_name}':\n"
-        cursor.execute(f"PRAGMA table_info({table_name});")
-        columns = cursor.fetchall()
-        for column in columns:
+        for column in columns_by_table[table_name]:
             schema_str += f"  - {column[1]} ({column[2]})\n"
     
-    conn.close()
     return schema_str
 
 def generate_sql_query_for_task(user_role, action_id, task_id):
@@ -140,30 +152,31 @@ def generate_sql_query_for_task(user_role, action_id, task_id):
     Returns:
         dict: The generated query data, or None if the task is not found.
     """
-    conn = get_role_db_connection(user_role)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
     logger.info(f"Attempting to generate query for task. action_id='{action_id}', task_id='{task_id}'")
 
     tables_to_check = ["saved_actions", "proposed_actions"]
     action_data = None
     target_table = None
 
-    for table in tables_to_check:
-        cursor.execute(f"SELECT * FROM {table} WHERE action_id = ?", (action_id,))
-        action_data = cursor.fetchone()
-        if action_data:
-            target_table = table
-            break
-    
-    if not action_data or not action_data['next_steps']:
-        logger.warning(f"Action not found or no next_steps for action_id='{action_id}'")
-        conn.close()
-        return None
+    # Read what the prompt needs, then hand the connection back to the pool
+    # rather than holding it through the model call
+    with closing(get_role_db_connection(user_role)) as conn:
+        cursor = conn.cursor()
+        for table in tables_to_check:
+            cursor.execute(f"SELECT * FROM {table} WHERE action_id = ?", (action_id,))
+            action_data = cursor.fetchone()
+            if action_data:
+                target_table = table
+                break
+        
+        if not action_data or not action_data['next_steps']:
+            logger.warning(f"Action not found or no next_steps for action_id='{action_id}'")
+            return None
+
+        db_schema = _get_db_schema(cursor)
 
     try:
-        next_steps = json.loads(action_data['next_steps'])
+        next_steps = orjson.loads(action_data['next_steps'])
         task_to_query = None
         logger.debug(f"Searching for task_id='{task_id}' in next_steps for action '{action_id}': {next_steps}")
 
@@ -178,7 +191,6 @@ def generate_sql_query_for_task(user_role, action_id, task_id):
             logger.warning(f"Task with id='{task_id}' not found in action='{action_id}'")
             return None
 
-        db_schema = _get_db_schema(user_role)
         prompt = f"""
         Based on the following database schema and task, generate a JSON object with two keys: "explanation" and "sql_query".
 
@@ -198,7 +210,6 @@ def generate_sql_query_for_task(user_role, action_id, task_id):
         Return only a single, minified JSON object. Do not include any markdown, backticks, or any text other than the JSON object itself.
         """
         
-        from services.gemini_service import _generate_json_from_model
         query_data = _generate_json_from_model(prompt, "{{}}")
 
         if not query_data or 'sql_query' not in query_data:
@@ -215,23 +226,21 @@ def generate_sql_query_for_task(user_role, action_id, task_id):
                 break
         
         if task_found_for_update:
-            cursor.execute(
-                f"UPDATE {target_table} SET next_steps = ? WHERE action_id = ?",
-                (json.dumps(next_steps), action_id)
-            )
-            conn.commit()
+            with closing(get_role_db_connection(user_role)) as conn:
+                conn.execute(
+                    f"UPDATE {target_table} SET next_steps = ? WHERE action_id = ?",
+                    (orjson.dumps(next_steps).decode(), action_id)
+                )
+                conn.commit()
             logger.info(f"Saved generated query for task_id='{task_id}' in action_id='{action_id}'")
         else:
             logger.warning(f"Could not find task with id='{task_id}' to save the generated query.")
         
         return query_data
 
-    except (json.JSONDecodeError, TypeError) as e:
+    except (orjson.JSONDecodeError, TypeError) as e:
         logger.error(f"JSON error in generate_sql_query_for_task: {e}")
         return None
-    finally:
-        if conn:
-            conn.close()
 
 def generate_communication_for_task(user_role, action_id, task_id, communication_type):
     """
@@ -246,31 +255,30 @@ def generate_communication_for_task(user_role, action_id, task_id, communication
     Returns:
         str: The generated communication content, or None if not found.
     """
-    conn = get_role_db_connection(user_role)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
     try:
-        # Fetch the action and join with priority to get context
-        cursor.execute("""
-            SELECT sa.*, p.priority_title
-            FROM saved_actions sa
-            LEFT JOIN saved_analyses p ON sa.priority_id = p.priority_id
-            WHERE sa.action_id = ?
-        """, (action_id,))
-        action_data = cursor.fetchone()
-        target_table = "saved_actions"
-        
-        if not action_data:
-            cursor.execute("SELECT * FROM proposed_actions WHERE action_id = ?", (action_id,))
+        # Fetch the action and join with priority to get context; the
+        # connection goes back to the pool before the model call
+        with closing(get_role_db_connection(user_role)) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT sa.*, p.priority_title
+                FROM saved_actions sa
+                LEFT JOIN saved_analyses p ON sa.priority_id = p.priority_id
+                WHERE sa.action_id = ?
+            """, (action_id,))
             action_data = cursor.fetchone()
-            target_table = "proposed_actions"
+            target_table = "saved_actions"
+            
+            if not action_data:
+                cursor.execute("SELECT * FROM proposed_actions WHERE action_id = ?", (action_id,))
+                action_data = cursor.fetchone()
+                target_table = "proposed_actions"
 
         if not action_data or not action_data['next_steps']:
             logger.warning(f"Action not found or no next_steps for action_id='{action_id}'")
             return None
 
-        next_steps = json.loads(action_data['next_steps'])
+        next_steps = orjson.loads(action_data['next_steps'])
         task = next((step for step in next_steps if str(step.get('id')).lower() == task_id.lower()), None)
 
         if not task:
@@ -329,7 +337,6 @@ def generate_communication_for_task(user_role, action_id, task_id, communication
             logger.warning(f"Invalid communication type: {communication_type}")
             return None
         
-        from services.gemini_service import _generate_content_from_model
         generated_content = _generate_content_from_model(prompt, "")
 
         if generated_content:
@@ -344,11 +351,12 @@ def generate_communication_for_task(user_role, action_id, task_id, communication
                     break
             
             if task_found_for_update:
-                cursor.execute(
-                    f"UPDATE {target_table} SET next_steps = ? WHERE action_id = ?",
-                    (json.dumps(next_steps), action_id)
-                )
-                conn.commit()
+                with closing(get_role_db_connection(user_role)) as conn:
+                    conn.execute(
+                        f"UPDATE {target_table} SET next_steps = ? WHERE action_id = ?",
+                        (orjson.dumps(next_steps).decode(), action_id)
+                    )
+                    conn.commit()
                 logger.info(f"Saved generated {communication_type} for task_id='{task_id}' in action_id='{action_id}'")
 
         return generated_content
@@ -356,6 +364,3 @@ def generate_communication_for_task(user_role, action_id, task_id, communication
     except Exception as e:
         logger.error(f"Error generating communication for task '{task_id}': {e}")
         return None
-    finally:
-        if conn:
-            conn.close()
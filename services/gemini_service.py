@@ -1,7 +1,13 @@
 import os
 import json
+import functools
+import hashlib
+import threading
+import orjson
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator
+
+from cachetools import TTLCache
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -14,6 +20,11 @@ MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-2.5-pro")
 # Prefer service account if project is set; otherwise use API key if provided
 AUTH_MODE = "service_account" if PROJECT_ID else ("api_key" if API_KEY else "none")
 
+# Chart insights keyed by a hash of title, type and the data sent to the model
+CHART_INSIGHTS_CACHE_TTL = 3600
+_chart_insights_cache = TTLCache(maxsize=2048, ttl=CHART_INSIGHTS_CACHE_TTL)
+_chart_insights_lock = threading.Lock()
+
 
 def gemini_status() -> Dict[str, Any]:
 	return {
@@ -24,13 +35,38 @@ def gemini_status() -> Dict[str, Any]:
 	}
 
 
+@functools.lru_cache(maxsize=None)
+def _vertex_model(model_name: str):
+	"""
+	Get the shared Vertex AI model object for a model name.
+
+	Each GenerativeModel opens its own prediction client on first use, so
+	reusing one per model keeps its channel (and TLS session) alive across
+	calls instead of reconnecting on every request.
+
+	Args:
+		model_name (str): Gemini model name
+
+	Returns:
+		GenerativeModel: Model bound to the configured project and location
+	"""
+	from vertexai import init as vertex_init
+	from vertexai.preview.generative_models import GenerativeModel
+	vertex_init(project=PROJECT_ID, location=LOCATION)
+	return GenerativeModel(model_name)
+
+
+@functools.lru_cache(maxsize=1)
+def _genai_client():
+	"""Get the shared google.genai client, so its HTTP connections are reused."""
+	from google import genai
+	return genai.Client(api_key=API_KEY)
+
+
 def _generate_text_from_model(prompt: str) -> str:
 	"""Generate text using either google.genai (API key) or Vertex AI (service account)."""
 	if AUTH_MODE == "service_account":
-		from vertexai import init as vertex_init
-		from vertexai.preview.generative_models import GenerativeModel
-		vertex_init(project=PROJECT_ID, location=LOCATION)
-		model = GenerativeModel(MODEL_NAME)
+		model = _vertex_model(MODEL_NAME)
 		resp = model.generate_content(prompt)
 		text = getattr(resp, "text", None)
 		if text is None and hasattr(resp, "candidates") and resp.candidates:
@@ -42,18 +78,38 @@ def _generate_text_from_model(prompt: str) -> str:
 				text = ""
 		return (text or "").strip()
 	elif AUTH_MODE == "api_key":
-		from google import genai
-		client = genai.Client(api_key=API_KEY)
+		client = _genai_client()
 		resp = client.models.generate_content(model=MODEL_NAME, contents=prompt)
 		return (resp.text or "").strip()
 	else:
 		raise RuntimeError("Gemini not configured. Set GOOGLE_CLOUD_PROJECT (service account) or GOOGLE_GENAI_API_KEY (API key).")
 
 
+def _stream_text_from_model(prompt: str) -> Iterator[str]:
+	"""Like _generate_text_from_model, but yield the text chunks as the model produces them."""
+	if AUTH_MODE == "service_account":
+		model = _vertex_model(MODEL_NAME)
+		for chunk in model.generate_content(prompt, stream=True):
+			try:
+				text = chunk.text
+			except (AttributeError, ValueError):
+				# Chunks without text parts (e.g. the final usage metadata)
+				text = ""
+			if text:
+				yield text
+	elif AUTH_MODE == "api_key":
+		client = _genai_client()
+		for chunk in client.models.generate_content_stream(model=MODEL_NAME, contents=prompt):
+			if chunk.text:
+				yield chunk.text
+	else:
+		raise RuntimeError("Gemini not configured. Set GOOGLE_CLOUD_PROJECT (service account) or GOOGLE_GENAI_API_KEY (API key).")
+
+
 """
 This module contains the Gemini service client for generating content.
 """
-from vertexai.preview.generative_models import GenerativeModel, GenerationConfig
+from vertexai.preview.generative_models import GenerationConfig
 import json
 import logging
 
@@ -62,7 +118,7 @@ logger = logging.getLogger(__name__)
 def _generate_content_from_model(prompt_text, default_response=""):
     """Generates content from a generative model."""
     try:
-        model = GenerativeModel("gemini-2.5-pro")
+        model = _vertex_model("gemini-2.5-pro")
         response = model.generate_content(prompt_text)
         return response.text
     except Exception as e:
@@ -74,7 +130,7 @@ def _generate_json_from_model(prompt_text, default_json="{}"):
     Generates a JSON object from a generative model, ensuring the output is valid JSON.
     """
     try:
-        model = GenerativeModel("gemini-2.5-pro")
+        model = _vertex_model("gemini-2.5-pro")
         config = GenerationConfig(response_mime_type="application/json")
         response = model.generate_content(prompt_text, generation_config=config)
         return json.loads(response.text)
@@ -83,6 +139,23 @@ def _generate_json_from_model(prompt_text, default_json="{}"):
         return json.loads(default_json)
 
 
+def _stream_json_from_model(prompt_text):
+    """
+    Like _generate_json_from_model, but yields the JSON text chunks as the
+    model produces them. The caller parses the joined text; errors propagate.
+    """
+    model = _vertex_model("gemini-2.5-pro")
+    config = GenerationConfig(response_mime_type="application/json")
+    for chunk in model.generate_content(prompt_text, generation_config=config, stream=True):
+        try:
+            text = chunk.text
+        except (AttributeError, ValueError):
+            # Chunks without text parts (e.g. the final usage metadata)
+            text = ""
+        if text:
+            yield text
+
+
 def analyze_metrics_short_term(role: str, metrics: Dict[str, Any]) -> Dict[str, Any]:
 	"""Use Gemini to analyze LAST 2 WEEKS of metrics for immediate tactical actions."""
 	schema_hint = (
@@ -90,7 +163,7 @@ def analyze_metrics_short_term(role: str, metrics: Dict[str, Any]) -> Dict[str,
 		"Each item in prioritized_issues must be an object: {priority (integer; 1 is highest), title (string), why (string), evidence (object; include relevant metric slices), suggested_actions (array of strings)}.\n"
 		"Focus on IMMEDIATE, TACTICAL actions that can be implemented within 1-2 weeks."
 	)
-	contents_json = json.dumps(metrics, ensure_ascii=False)
+	contents_json = orjson.dumps(metrics, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode()
 	prompt = (
 		"You are Gemini 2.5 Pro. Analyze the following role-specific METRICS JSON (LAST 2 WEEKS ONLY) and produce a structured JSON with prioritized issues.\n"
 		f"Role: {role}\n"
@@ -121,7 +194,7 @@ def analyze_metrics_long_term(role: str, metrics: Dict[str, Any]) -> Dict[str, A
 		"Each item in prioritized_issues must be an object: {priority (integer; 1 is highest), title (string), why (string), evidence (object; include relevant metric slices), suggested_actions (array of strings)}.\n"
 		"Focus on STRATEGIC, LONG-TERM initiatives that require planning and implementation over months."
 	)
-	contents_json = json.dumps(metrics, ensure_ascii=False)
+	contents_json = orjson.dumps(metrics, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode()
 	prompt = (
 		"You are Gemini 2.5 Pro. Analyze the following role-specific METRICS JSON (FULL 90 DAYS) and produce a structured JSON with prioritized issues.\n"
 		f"Role: {role}\n"
@@ -160,11 +233,8 @@ def analyze_metrics(role: str, metrics: Dict[str, Any]) -> Dict[str, Any]:
 	}
 
 
-def generate_chart_insights(chart_title: str, chart_data: List[Dict[str, Any]], chart_type: str = "unknown") -> List[str]:
-	"""Generate enhanced insights for specific chart data using Gemini Flash 2.5."""
-	if not chart_data:
-		return ["No data available for analysis."]
-	
+def _chart_insights_request(chart_title: str, chart_data: List[Dict[str, Any]], chart_type: str):
+	"""Build the chart insights prompt and its cache key."""
 	prompt = (
 		"You are Gemini 2.5 Flash, an expert data analyst. Analyze the following chart data and provide 3-5 key insights in bullet point format.\n\n"
 		f"Chart Title: {chart_title}\n"
@@ -184,30 +254,100 @@ def generate_chart_insights(chart_title: str, chart_data: List[Dict[str, Any]],
 	
 	# Limit data size for API efficiency (max 20 records for insights)
 	sample_data = chart_data[:20] if len(chart_data) > 20 else chart_data
-	data_json = json.dumps(sample_data, ensure_ascii=False)
+	data_json = orjson.dumps(sample_data, option=orjson.OPT_NON_STR_KEYS).decode()
+	
+	# The same chart over the same data gets the cached insights instead of
+	# another model round-trip
+	cache_key = hashlib.blake2b(
+		f"{chart_title}\x00{chart_type}\x00{data_json}".encode(), digest_size=16
+	).hexdigest()
+	return prompt + data_json, cache_key
+
+
+def _clean_insight_line(line: str) -> str:
+	"""Strip bullet markers from one line of model output; empty if too short to be an insight."""
+	cleaned = line.replace('•', '').replace('-', '').strip()
+	return cleaned if len(cleaned) > 10 else ""  # Minimum meaningful insight length
+
+
+def _cached_chart_insights(cache_key: str):
+	with _chart_insights_lock:
+		cached = _chart_insights_cache.get(cache_key)
+	return list(cached) if cached is not None else None
+
+
+def _cache_chart_insights(cache_key: str, insights: List[str]):
+	with _chart_insights_lock:
+		_chart_insights_cache[cache_key] = tuple(insights)
+
+
+def generate_chart_insights(chart_title: str, chart_data: List[Dict[str, Any]], chart_type: str = "unknown") -> List[str]:
+	"""Generate enhanced insights for specific chart data using Gemini Flash 2.5."""
+	if not chart_data:
+		return ["No data available for analysis."]
+	
+	prompt, cache_key = _chart_insights_request(chart_title, chart_data, chart_type)
+	cached = _cached_chart_insights(cache_key)
+	if cached is not None:
+		return cached
 	
 	try:
-		insights_text = _generate_text_from_model(prompt + data_json)
+		insights_text = _generate_text_from_model(prompt)
 		
 		# Parse the bullet points
-		lines = [line.strip() for line in insights_text.split('\n') if line.strip()]
 		insights = []
-		
-		for line in lines:
-			# Clean up the line and ensure it starts with a bullet
-			cleaned = line.replace('•', '').replace('-', '').strip()
-			if cleaned and len(cleaned) > 10:  # Minimum meaningful insight length
+		for line in insights_text.split('\n'):
+			cleaned = _clean_insight_line(line)
+			if cleaned:
 				insights.append(cleaned)
 		
 		# Ensure we have at least one insight
 		if not insights:
-			insights = ["Data analysis completed, but no specific insights were generated."]
+			return ["Data analysis completed, but no specific insights were generated."]
 		
 		# Limit to max 5 insights
-		return insights[:5]
+		insights = insights[:5]
+		_cache_chart_insights(cache_key, insights)
+		return insights
 		
 	except Exception as e:
 		logger.error(f"Error generating chart insights: {e}")
 		return [f"Unable to generate insights: {str(e)}"]
 
 
+def stream_chart_insights(chart_title: str, chart_data: List[Dict[str, Any]], chart_type: str = "unknown") -> Iterator[str]:
+	"""
+	Generate chart insights like generate_chart_insights, yielding each one as soon as the
+	model has finished writing its line. Errors propagate to the caller.
+	"""
+	if not chart_data:
+		yield "No data available for analysis."
+		return
+	
+	prompt, cache_key = _chart_insights_request(chart_title, chart_data, chart_type)
+	cached = _cached_chart_insights(cache_key)
+	if cached is not None:
+		yield from cached
+		return
+	
+	insights = []
+	pending = ""
+	for chunk in _stream_text_from_model(prompt):
+		pending += chunk
+		*lines, pending = pending.split('\n')
+		for line in lines:
+			cleaned = _clean_insight_line(line)
+			if cleaned and len(insights) < 5:
+				insights.append(cleaned)
+				yield cleaned
+	cleaned = _clean_insight_line(pending)
+	if cleaned and len(insights) < 5:
+		insights.append(cleaned)
+		yield cleaned
+	
+	if insights:
+		_cache_chart_insights(cache_key, insights)
+	else:
+		yield "Data analysis completed, but no specific insights were generated."
+
+
@@ -0,0 +1,126 @@
+"""
+Persistent cache for model responses.
+
+Responses are stored in the shared SQLite database, so they survive restarts
+and are shared between worker processes. Lookups are exact: the key is a
+hash of everything the response depends on (normally the full prompt).
+"""
+
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+import orjson
+
+from app.database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def _ensure_schema(conn):
+    """Create the llm_cache table the first time this process uses it."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                namespace TEXT NOT NULL,
+                response_json TEXT NOT NULL CHECK (json_valid(response_json)),
+                created_ts REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_created ON llm_cache (created_ts)")
+        conn.commit()
+        _schema_ready = True
+
+
+class LLMCache:
+    """
+    Exact-match cache of JSON model responses, stored in the llm_cache table.
+
+    Each instance covers one namespace (one kind of prompt) with its own
+    time-to-live. Cache errors are logged and treated as misses, so a
+    broken cache never fails the request that uses it.
+
+    Args:
+        namespace (str): Name of the kind of response being cached
+        ttl (int): Seconds an entry stays valid
+    """
+
+    def __init__(self, namespace: str, ttl: int):
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def key(self, prompt: str) -> str:
+        """
+        Get the cache key for a prompt.
+
+        Args:
+            prompt (str): The full prompt sent to the model
+
+        Returns:
+            str: Hex digest identifying the prompt within this namespace
+        """
+        return hashlib.sha256(f"{self.namespace}|{prompt}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Look up a cached response.
+
+        Args:
+            key (str): Key from key()
+
+        Returns:
+            The decoded response, or None if missing or expired
+        """
+        try:
+            conn = get_db_connection()
+            try:
+                _ensure_schema(conn)
+                row = conn.execute(
+                    "SELECT response_json FROM llm_cache WHERE key = ? AND created_ts >= ?",
+                    (key, time.time() - self.ttl),
+                ).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache lookup failed: {e}")
+            return None
+        return orjson.loads(row[0]) if row else None
+
+    def set(self, key: str, response: Any):
+        """
+        Store a response, replacing any earlier one, and drop expired entries.
+
+        Args:
+            key (str): Key from key()
+            response: JSON-serializable model response
+        """
+        now = time.time()
+        try:
+            conn = get_db_connection()
+            try:
+                _ensure_schema(conn)
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, namespace, response_json, created_ts) VALUES (?, ?, ?, ?)",
+                    (key, self.namespace, orjson.dumps(response).decode(), now),
+                )
+                conn.execute(
+                    "DELETE FROM llm_cache WHERE namespace = ? AND created_ts < ?",
+                    (self.namespace, now - self.ttl),
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache write failed: {e}")
@@ -367,8 +367,6 @@ class ExploreActionModal {
     }
 
     async loadActionData() {
-        this.loadNotes();
-
         try {
             const response = await fetch(`/api/actions/${this.currentAction.data.action_id}`);
             
@@ -377,10 +375,14 @@ class ExploreActionModal {
                 this.currentAction.data = data.action;
                 this.updateContextContent(data.action.gemini_context);
                 this.updateNextStepsContent(data.action.next_steps);
-                // Notes are now loaded separately
+                // The action comes back with its notes
+                this.updateNotesContent(data.action.notes || []);
+            } else {
+                this.loadNotes();
             }
         } catch (error) {
             console.error('Error loading action data:', error);
+            this.loadNotes();
         }
     }
 
@@ -392,7 +394,10 @@ class ExploreActionModal {
         try {
             const response = await fetch('/api/actions/explore', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Accept': 'application/x-ndjson'
+                },
                 body: JSON.stringify({
                     action_id: this.currentAction.data.action_id,
                     action_data: this.currentAction.data,
@@ -402,7 +407,12 @@ class ExploreActionModal {
             });
 
             if (response.ok) {
-                const data = await response.json();
+                const data = await this.readContextStream(response, (partial) => {
+                    this.updateContextContent(partial);
+                });
+                if (!data.success || !data.action) {
+                    throw new Error(data.error || 'Failed to generate context');
+                }
                 this.currentAction.data = data.action;
                 this.updateContextContent(data.action.gemini_context);
                 this.updateNextStepsContent(data.action.next_steps);
@@ -418,6 +428,58 @@ class ExploreActionModal {
         }
     }
 
+    /**
+     * Reads the NDJSON explore stream, rendering context sections as they complete
+     * @param {Response} response - Fetch response from /api/actions/explore
+     * @param {Function} onContext - Called with the context fields parsed so far
+     * @returns {Promise<Object>} Final {success, action} or {success, error} record
+     */
+    async readContextStream(response, onContext) {
+        const contentType = response.headers.get('Content-Type') || '';
+        if (!response.body || !contentType.includes('application/x-ndjson')) {
+            return response.json();
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        const fieldPattern = /"(strategic_alignment|market_rationale|potential_impact|risk_assessment)"\s*:\s*"((?:[^"\\]|\\.)*)"/g;
+        let text = '';
+        let buffer = '';
+        let shown = 0;
+        let result = { success: false, error: 'Context stream ended unexpectedly' };
+
+        const handleLine = (line) => {
+            if (!line.trim()) return;
+            const record = JSON.parse(line);
+            if (record.chunk === undefined) {
+                result = record;
+                return;
+            }
+            text += record.chunk;
+            // Only string fields whose closing quote has arrived are matched
+            const partial = {};
+            for (const match of text.matchAll(fieldPattern)) {
+                partial[match[1]] = JSON.parse(`"${match[2]}"`);
+            }
+            const count = Object.keys(partial).length;
+            if (count > shown) {
+                shown = count;
+                onContext(partial);
+            }
+        };
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            lines.forEach(handleLine);
+        }
+        handleLine(buffer + decoder.decode());
+        return result;
+    }
+
     updateContextContent(context) {
         const content = document.getElementById('context-content');
         
@@ -538,6 +600,8 @@ class ExploreActionModal {
     }
 
     updateNotesContent(notes) {
+        // Kept so adding or deleting a note can update the list in place
+        this.notes = notes || [];
         const content = this.modal.querySelector('#action-notes-content, #notes-content');
         
         if (!notes || notes.length === 0) {
@@ -610,11 +674,12 @@ class ExploreActionModal {
             });
 
             if (response.ok) {
+                const data = await response.json();
                 // Clear the textarea
                 if (textarea) textarea.value = '';
                 this.hideAddNoteForm();
-                // Reload notes to show new note
-                this.loadNotes();
+                // Append the saved note instead of reloading the list
+                this.updateNotesContent([...(this.notes || []), data.note]);
                 this._saveAction(); // Autosave after adding a note
             } else {
                 const errorText = await response.text();
@@ -657,8 +722,7 @@ class ExploreActionModal {
             });
 
             if (response.ok) {
-                const data = await response.json();
-                this.updateNotesContent(data.notes);
+                this.updateNotesContent((this.notes || []).filter(note => note.id !== noteId));
             } else {
                 throw new Error('Failed to delete note');
             }
@@ -646,6 +646,30 @@ async function viewSavedAction(actionId) {
   }
 }
 
+/**
+ * Expands columnar metric series ({cols, rows}) into arrays of row objects
+ * @param {Object} metrics - Map of series name to {cols: string[], rows: Array[]}
+ * @returns {Object} Map of series name to array of row objects
+ */
+function expandColumnarMetrics(metrics) {
+  const expanded = {};
+  Object.entries(metrics || {}).forEach(([key, series]) => {
+    if (series && Array.isArray(series.cols) && Array.isArray(series.rows)) {
+      const cols = series.cols;
+      expanded[key] = series.rows.map(row => {
+        const obj = {};
+        for (let i = 0; i < cols.length; i++) {
+          obj[cols[i]] = row[i];
+        }
+        return obj;
+      });
+    } else {
+      expanded[key] = series;
+    }
+  });
+  return expanded;
+}
+
 /**
  * Loads metrics for built-in roles (E-commerce Manager, Marketing Lead, etc.)
  */
@@ -657,6 +681,8 @@ async function loadBuiltInRoleMetrics() {
     }
     
     const data = await response.json();
+    // Series arrive columnar to keep the payload small; reshape once here
+    data.metrics = expandColumnarMetrics(data.metrics);
     window.__LATEST_METRICS__ = data;
     
     // Update dashboard title with role name
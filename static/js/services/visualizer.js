@@ -985,6 +985,48 @@ class MetricsVisualizer {
     }
   }
 
+  /**
+   * Reads an NDJSON insights response, reporting insights as they arrive
+   * @param {Response} response - Fetch response from /api/chart/insights
+   * @param {Function} onInsights - Called with the insights received so far
+   * @returns {Promise<Object>} Final result record ({ok, insights} or {ok, error})
+   */
+  async readInsightsStream(response, onInsights) {
+    const contentType = response.headers.get('Content-Type') || '';
+    if (!response.body || !contentType.includes('application/x-ndjson')) {
+      // Validation errors come back as plain JSON
+      return response.json();
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    const partial = [];
+    let buffer = '';
+    let result = { ok: false, error: 'Insights stream ended unexpectedly' };
+
+    const handleLine = (line) => {
+      if (!line.trim()) return;
+      const record = JSON.parse(line);
+      if (record.insight !== undefined) {
+        partial.push(record.insight);
+        onInsights(partial.slice());
+      } else {
+        result = record;
+      }
+    };
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const lines = buffer.split('\n');
+      buffer = lines.pop();
+      lines.forEach(handleLine);
+    }
+    handleLine(buffer + decoder.decode());
+    return result;
+  }
+
   /**
    * Generates new insights for a chart
    * @param {string} chartKey - Full chart key
@@ -1010,6 +1052,7 @@ class MetricsVisualizer {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Accept': 'application/x-ndjson',
         },
         body: JSON.stringify({
           role_name: roleName,
@@ -1020,7 +1063,9 @@ class MetricsVisualizer {
         })
       });
 
-      const result = await response.json();
+      const result = await this.readInsightsStream(response, (partial) => {
+        this.renderChartInsights(insightsDiv, partial, chartKey, chartId, chartTitle, chartData, chartType);
+      });
 
       if (result.ok && result.insights && result.insights.length > 0) {
         this.renderChartInsights(insightsDiv, result.insights, chartKey, chartId, chartTitle, chartData, chartType);
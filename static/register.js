@@ -14,6 +14,20 @@ function logProgress(msg) {
   log.appendChild(p);
 }
 
+// Polls a background role analysis until it finishes and returns its result
+async function waitForAnalysis(jobId) {
+  let polls = 0;
+  while (true) {
+    await new Promise(resolve => setTimeout(resolve, 2000));
+    const res = await fetch(`/api/new_role/analyze_status?job_id=${encodeURIComponent(jobId)}`);
+    const json = await res.json();
+    if (!res.ok) throw new Error(json.error || 'Analysis status unavailable');
+    if (json.status !== 'running') return json;
+    polls += 1;
+    if (polls % 5 === 0) logProgress('Still analyzing...');
+  }
+}
+
 document.getElementById('btn-cancel').addEventListener('click', () => {
   window.location.href = '/';
 });
@@ -72,6 +86,8 @@ document.getElementById('register-form').addEventListener('submit', async (e) =>
     });
     const analyzeJson = await analyzeRes.json();
     if (!analyzeRes.ok || !analyzeJson.ok) throw new Error(analyzeJson.error || 'Analysis failed');
+    const analysisResult = await waitForAnalysis(analyzeJson.job_id);
+    if (!analysisResult.ok) throw new Error(analysisResult.error || 'Analysis failed');
     setStepState('step-4', 'done');
     setStepState('step-5', 'active');
     logProgress('Analysis finished. Generating dashboard...');